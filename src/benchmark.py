@@ -0,0 +1,63 @@
+import argparse
+
+from benchmarks.suite import compare_results, load_results, run_suite, save_results
+
+def startup():
+    '''The benchmark startup function.'''
+
+    parser = argparse.ArgumentParser(description='Benchmark Podcast Downloader against a local stand-in server.')
+    parser.add_argument('--sizes', default='10,1000,100000',
+                        help='The numbers of episodes in the parsed feeds, separated by commas (10,1000,100000)')
+    parser.add_argument('--downloads', type=int, default=50,
+                        help='The number of files to download (50, or 0 to skip the download benchmark)')
+    parser.add_argument('--enclosure-size', type=int, default=1024 * 1024,
+                        help='The length of each file in bytes (1 MiB)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='The number of files to download at once (4)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='The number of runs of each benchmark; the fastest is reported (3)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='The delay in seconds the server adds to each request (0)')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='The server bandwidth limit in bytes per second for each response (no limit)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='The fraction of file requests the server answers with an error (0)')
+    parser.add_argument('--no-startup', action='store_true',
+                        help='Skip measuring how long the entry points take to start')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='The JSON file to write the results to (benchmark_results.json)')
+    parser.add_argument('--compare',
+                        help='Earlier results to compare with, such as the results of the previous commit')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    results = run_suite(sizes, args.downloads, args.enclosure_size, args.workers, args.repeat,
+                        args.latency, args.bandwidth, args.error_rate, startup=not args.no_startup)
+    save_results(results, args.output)
+
+    print()
+    for result in results['results']:
+        if 'import_seconds' in result:
+            print(f'{result["name"]:>24}: {result["seconds"]:.4f}s to start, {result["import_seconds"]:.4f}s '
+                  f'importing {str(result["modules"])} modules (slowest: '
+                  f'{", ".join(name for name, _ in result["slowest_imports"])})')
+
+            if result['forbidden_imports']:
+                print(f'{"":>24}  WARNING: imports {", ".join(result["forbidden_imports"])}')
+            continue
+
+        print(f'{result["name"]:>18} {str(result["items"]):>7} items: {result["seconds"]:.4f}s, '
+              f'{result["items_per_second"]:.0f} items/s, '
+              f'{result["peak_memory_bytes"] / 1e6:.1f} MB peak'
+              + (f', {result["bytes_per_second"] / 1e6:.1f} MB/s' if result.get('bytes_per_second') else ''))
+    print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        print(f'\nCompared with {args.compare}:')
+        for change in compare_results(load_results(args.compare), results):
+            print(f'{change["name"]:>18} {str(change["items"]):>7} items {change["metric"]}: '
+                  f'{change["change"]:+.1%} ({"better" if change["improved"] else "worse"})')
+
+if __name__ == '__main__':
+    startup()
@@ -0,0 +1 @@
+# The benchmark suite. Run it with benchmark.py.
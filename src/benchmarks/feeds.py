@@ -0,0 +1,57 @@
+# Synthetic RSS feeds for the benchmarks.
+
+from email.utils import formatdate
+from xml.sax.saxutils import escape, quoteattr
+
+# The publication date of the newest synthetic episode (2020-01-01)
+NEWEST_EPISODE = 1577836800
+
+def make_feed(items: int, base_url: str, enclosure_size: int=1024) -> bytes:
+    '''Returns an RSS feed with the given number of <item> elements.
+
+    Episode i has the GUID "episode-i", is published i days before the newest
+    episode and has the enclosure <base_url>/episodes/i.mp3.
+
+    Arguments:
+        items: The number of episodes.
+        base_url: The URL the enclosures are served from, without a trailing slash.
+        enclosure_size: The length of each enclosure in bytes.
+    '''
+
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0"><channel>'
+        f'<title>Benchmark Podcast ({str(items)} episodes)</title>'
+        f'<link>{escape(base_url)}</link>'
+        '<description>A synthetic feed for benchmarking.</description>'
+    ]
+
+    for index in range(items):
+        date = formatdate(NEWEST_EPISODE - index * 86400, usegmt=True)
+        url = f'{base_url}/episodes/{str(index)}.mp3'
+
+        parts.append(
+            '<item>'
+            f'<guid isPermaLink="false">episode-{str(index)}</guid>'
+            f'<title>Episode {str(index)}: A &amp; B</title>'
+            f'<pubDate>{date}</pubDate>'
+            '<description>Show notes for the episode, long enough to be realistic. '
+            'Lorem ipsum dolor sit amet, consectetur adipiscing elit.</description>'
+            f'<enclosure url={quoteattr(url)} length="{str(enclosure_size)}" type="audio/mpeg"/>'
+            '</item>'
+        )
+
+    parts.append('</channel></rss>')
+
+    return ''.join(parts).encode('utf-8')
+
+def make_enclosure(size: int) -> bytes:
+    '''Returns the content of a synthetic enclosure.
+
+    Arguments:
+        size: The length in bytes.
+    '''
+
+    pattern = bytes(range(256))
+
+    return (pattern * (size // len(pattern) + 1))[:size]
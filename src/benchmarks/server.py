@@ -0,0 +1,218 @@
+# A local stand-in for a podcast host, for the benchmarks.
+
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .feeds import make_enclosure, make_feed
+
+class StandInServer(object):
+    '''A local HTTP server which serves synthetic feeds and their enclosures.
+
+    /feeds/<n>.xml is a feed with n episodes, and /episodes/<i>.mp3 is the enclosure
+    of episode i. Feeds are generated on the first request and then kept in memory.
+    Enclosures support Range requests and have an ETag, like a typical CDN.
+
+    Latency, a bandwidth limit and errors can be injected, to see how the downloader
+    behaves with a slow or unreliable host.
+
+    Example:
+        with StandInServer(latency=0.05, error_rate=0.1) as server:
+            rss = parse_remote_xml(server.feed_url(1000))
+    '''
+
+    def __init__(self, enclosure_size: int=1024, latency: float=0, bandwidth: float=None,
+                 error_rate: float=0, seed: int=0):
+        '''Create a StandInServer object. The server is started by start().
+
+        Arguments:
+            enclosure_size: The length of each enclosure in bytes.
+            latency: The number of seconds each request is delayed before it is answered.
+            bandwidth: The bandwidth limit in bytes per second for each response (None for no limit).
+            error_rate: The fraction of enclosure requests answered with 503 Service Unavailable.
+            seed: The seed for choosing which requests fail, so runs are repeatable.
+        '''
+
+        self.enclosure_size = enclosure_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+
+        # The number of requests answered, by kind
+        self.requests = {'feed': 0, 'enclosure': 0, 'error': 0}
+
+        self._random = random.Random(seed)
+        self._feeds = {}
+        self._enclosure = make_enclosure(enclosure_size)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        '''The URL of the server, without a trailing slash.'''
+
+        host, port = self._server.server_address[:2]
+
+        return f'http://{host}:{str(port)}'
+
+    def feed_url(self, items: int) -> str:
+        '''Returns the URL of a feed with the given number of episodes.
+
+        Arguments:
+            items: The number of episodes.
+        '''
+
+        return f'{self.base_url}/feeds/{str(items)}.xml'
+
+    def feed(self, items: int) -> bytes:
+        '''Returns the feed with the given number of episodes, generating it if needed.
+
+        Arguments:
+            items: The number of episodes.
+        '''
+
+        with self._lock:
+            feed = self._feeds.get(items)
+
+            if feed is None:
+                feed = self._feeds[items] = make_feed(items, self.base_url, self.enclosure_size)
+
+            return feed
+
+    def start(self):
+        '''Start the server on a free local port, in a background thread.'''
+
+        self._server = _ThreadingServer(('127.0.0.1', 0), _handler(self))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the server.'''
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _count(self, kind: str):
+        '''Count a request.'''
+
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _should_fail(self) -> bool:
+        '''Whether to inject an error into the current request.'''
+
+        if not self.error_rate:
+            return False
+
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    '''An HTTP server which answers each connection on its own thread.'''
+
+    daemon_threads = True
+
+def _handler(server: StandInServer):
+    '''Returns the request handler class for a StandInServer.'''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if server.latency:
+                time.sleep(server.latency)
+
+            feed = re.fullmatch(r'/feeds/(\d+)\.xml', self.path)
+            if feed:
+                server._count('feed')
+                self._send(server.feed(int(feed.group(1))), 'application/rss+xml')
+                return
+
+            if re.fullmatch(r'/episodes/\d+\.mp3', self.path):
+                if server._should_fail():
+                    server._count('error')
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                server._count('enclosure')
+                self._send(server._enclosure, 'audio/mpeg')
+                return
+
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def _send(self, body: bytes, content_type: str):
+            '''Send a body, honouring a Range header.'''
+
+            etag = f'"{str(len(body))}"'
+            start = 0
+            end = len(body)
+
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+            if_range = self.headers.get('If-Range')
+
+            if match and (if_range is None or if_range == etag):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)) + 1)
+
+                if start >= len(body):
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{str(len(body))}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {str(start)}-{str(end - 1)}/{str(len(body))}')
+            else:
+                self.send_response(200)
+
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(end - start))
+            self.send_header('ETag', etag)
+            self.end_headers()
+
+            self._write(memoryview(body)[start:end])
+
+        def _write(self, data):
+            '''Write the body, holding to the bandwidth limit.'''
+
+            if not server.bandwidth:
+                self.wfile.write(data)
+                return
+
+            started = time.monotonic()
+            sent = 0
+
+            for offset in range(0, len(data), 16 * 1024):
+                chunk = data[offset:offset + 16 * 1024]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+
+                # Sleep until the bytes sent so far are within the limit
+                delay = sent / server.bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    return Handler
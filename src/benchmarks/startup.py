@@ -0,0 +1,120 @@
+# Measuring how long the entry points take to start.
+
+import os
+import subprocess
+import sys
+import time
+
+# The directory of the entry points
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules startup_cli imports once the first question has been answered
+CLI_DOWNLOAD_MODULES = ('defusedxml.ElementTree', 'modules.batch', 'modules.cache', 'modules.download',
+                        'modules.metrics', 'modules.ratelimit', 'modules.transfer', 'modules.xml')
+
+# The name of each benchmark, the modules it imports, and the modules it must not import
+ENTRY_POINTS = (
+    ('import startup_cli', 'startup_cli', ('PySide2', 'asyncio')),
+    # The imports the user waits for after the first prompt
+    ('import startup_cli downloads', ', '.join(CLI_DOWNLOAD_MODULES), ('PySide2', 'asyncio')),
+    ('import startup_headless', 'startup_headless', ('PySide2', 'asyncio')),
+    ('import startup', 'startup', ('asyncio',)),
+)
+
+# The number of slowest modules listed for each entry point
+SLOWEST_IMPORTS = 5
+
+# Run by the child process: import the entry point, then print the import time and the loaded modules
+_MEASURE = '''
+import sys, time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+print(' '.join(sys.modules))
+'''
+
+def bench_startup(module: str, forbidden: tuple=(), repeat: int=3, name: str=None) -> dict:
+    '''Benchmark starting an entry point in a new Python process, without running it.
+
+    Returns None if the entry point can not be imported (for example, if PySide2 is not installed).
+
+    The result has the time to start the interpreter and import the entry point ('seconds'),
+    the time of the import alone ('import_seconds'), the slowest modules by their own import
+    time (from python -X importtime), and any forbidden modules which were imported.
+
+    Arguments:
+        module: The module name of the entry point, such as startup_cli, or several
+                module names separated by commas.
+        forbidden: The modules the entry point must not import.
+        repeat: The number of timed runs (the fastest is reported).
+        name: The name of the result (by default, 'import' and the module name).
+    '''
+
+    best = None
+    import_seconds = None
+    modules = []
+
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        output = _run([sys.executable, '-c', _MEASURE.format(module=module)])
+        elapsed = time.perf_counter() - started
+
+        if output is None:
+            return None
+
+        lines = output.stdout.decode().splitlines()
+
+        if best is None or elapsed < best:
+            best = elapsed
+            import_seconds = float(lines[0])
+            modules = lines[1].split()
+
+    # The import time of each module, without the modules it imports
+    output = _run([sys.executable, '-X', 'importtime', '-c', f'import {module}'])
+    slowest = []
+
+    if output is not None:
+        times = []
+
+        for line in output.stderr.decode().splitlines():
+            parts = line.split('|')
+
+            if len(parts) == 3 and parts[0].startswith('import time:') and parts[0][12:].strip().isdigit():
+                times.append((int(parts[0][12:]), parts[2].strip()))
+
+        slowest = [[name, microseconds / 1e6] for microseconds, name in sorted(times, reverse=True)[:SLOWEST_IMPORTS]]
+
+    return {
+        'name': name or f'import {module}',
+        'items': 1,
+        'seconds': best,
+        'import_seconds': import_seconds,
+        'modules': len(modules),
+        'slowest_imports': slowest,
+        'forbidden_imports': sorted(name for name in modules
+                                    if name.split('.')[0] in forbidden),
+    }
+
+def bench_entry_points(repeat: int=3) -> list:
+    '''Benchmark starting every entry point. See bench_startup().
+
+    Arguments:
+        repeat: The number of timed runs of each entry point (the fastest is reported).
+    '''
+
+    results = []
+
+    for name, module, forbidden in ENTRY_POINTS:
+        result = bench_startup(module, forbidden, repeat, name)
+
+        if result is not None:
+            results.append(result)
+
+    return results
+
+def _run(command: list):
+    '''Run a command in the source directory, returning the completed process, or None if it failed.'''
+
+    output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=SOURCE_DIR)
+
+    return output if output.returncode == 0 else None
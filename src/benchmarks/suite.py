@@ -0,0 +1,305 @@
+# The benchmarks, and saving and comparing their results.
+
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from modules.download import podcast_download
+from modules.network import HttpClient
+from modules.podcast import Episode, iter_episodes
+from modules.transfer import TransferOptions
+from modules.xml import parse_remote_xml
+
+from .server import StandInServer
+from .startup import bench_entry_points
+
+# The version of the results file format
+RESULTS_VERSION = 1
+
+# The metrics compared between runs, and whether a larger value is better
+METRICS = {
+    'seconds': False,
+    'import_seconds': False,
+    'peak_memory_bytes': False,
+    'items_per_second': True,
+    'bytes_per_second': True,
+}
+
+def time_best(function, repeat: int=3):
+    '''Call a function several times.
+
+    Returns the shortest time in seconds and the result of the last call.
+
+    Arguments:
+        function: The function to call, without arguments.
+        repeat: The number of calls.
+    '''
+
+    best = None
+    result = None
+
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+def peak_memory(function) -> int:
+    '''Call a function once and return the most memory in bytes it allocated at one time.
+
+    Measured with tracemalloc, so only memory allocated by Python is counted.
+    The function is timed separately, since tracing slows it down.
+
+    Arguments:
+        function: The function to call, without arguments.
+    '''
+
+    tracemalloc.start()
+
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_parse_remote_xml(server: StandInServer, items: int, repeat: int=3) -> dict:
+    '''Benchmark downloading and parsing a feed with parse_remote_xml.
+
+    Arguments:
+        server: The running stand-in server.
+        items: The number of episodes in the feed.
+        repeat: The number of timed runs (the fastest is reported).
+    '''
+
+    client = HttpClient(proxies={})
+    url = server.feed_url(items)
+
+    # Generate the feed before timing
+    feed = server.feed(items)
+
+    seconds, _ = time_best(lambda: parse_remote_xml(url, client=client), repeat)
+    memory = peak_memory(lambda: parse_remote_xml(url, client=client))
+    client.close()
+
+    return _result('parse_remote_xml', items, seconds, memory, feed_bytes=len(feed))
+
+def bench_episodes(server: StandInServer, items: int, repeat: int=3) -> list:
+    '''Benchmark creating Episode objects, from a parsed feed and by streaming the feed.
+
+    Arguments:
+        server: The running stand-in server.
+        items: The number of episodes in the feed.
+        repeat: The number of timed runs (the fastest is reported).
+    '''
+
+    feed = server.feed(items)
+    rss = parse_remote_xml(server.feed_url(items), client=HttpClient(proxies={}))
+    elements = rss.findall('channel/item')
+
+    def from_elements():
+        return [Episode(item) for item in elements]
+
+    def streamed():
+        return sum(1 for _ in iter_episodes(io.BytesIO(feed)))
+
+    results = []
+
+    seconds, _ = time_best(from_elements, repeat)
+    memory = peak_memory(from_elements)
+    results.append(_result('Episode', items, seconds, memory))
+
+    seconds, _ = time_best(streamed, repeat)
+    memory = peak_memory(streamed)
+    results.append(_result('iter_episodes', items, seconds, memory, feed_bytes=len(feed)))
+
+    return results
+
+def bench_podcast_download(server: StandInServer, files: int, workers: int=4, repeat: int=3) -> dict:
+    '''Benchmark downloading the enclosures of a feed with podcast_download.
+
+    Each run downloads every file to a new temporary directory, with a new HttpClient.
+
+    Arguments:
+        server: The running stand-in server.
+        files: The number of episodes in the feed.
+        workers: The number of files downloaded at once.
+        repeat: The number of timed runs (the fastest is reported).
+    '''
+
+    rss = parse_remote_xml(server.feed_url(files), client=HttpClient(proxies={}))
+
+    def download():
+        client = HttpClient(proxies={})
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            report = podcast_download(rss, output_dir=output_dir, workers=workers,
+                                      options=TransferOptions(client=client))
+
+        client.close()
+
+        return report
+
+    seconds, report = time_best(download, repeat)
+    memory = peak_memory(download)
+
+    total_bytes = report['total_downloads'] * server.enclosure_size
+
+    result = _result('podcast_download', files, seconds, memory, workers=workers,
+                     errors=report['total_errors'])
+    result['bytes_per_second'] = total_bytes / seconds if seconds else None
+
+    return result
+
+def run_suite(sizes=(10, 1000, 100000), downloads: int=50, enclosure_size: int=1024 * 1024,
+              workers: int=4, repeat: int=3, latency: float=0, bandwidth: float=None,
+              error_rate: float=0, print_progress=print, startup: bool=True) -> dict:
+    '''Run every benchmark and return the results.
+
+    Arguments:
+        sizes: The numbers of episodes in the feeds for the parsing benchmarks.
+        downloads: The number of files in the download benchmark (0 to skip it).
+        enclosure_size: The length of each downloaded file in bytes.
+        workers: The number of files downloaded at once.
+        repeat: The number of timed runs of each benchmark (the fastest is reported).
+        latency: The number of seconds the server delays each request.
+        bandwidth: The server's bandwidth limit in bytes per second for each response
+                   (None for no limit).
+        error_rate: The fraction of file requests the server answers with an error.
+        print_progress: The function used to report which benchmark is running.
+        startup: Whether to measure how long the entry points take to start.
+    '''
+
+    settings = {
+        'sizes': list(sizes),
+        'downloads': downloads,
+        'enclosure_size': enclosure_size,
+        'workers': workers,
+        'repeat': repeat,
+        'latency': latency,
+        'bandwidth': bandwidth,
+        'error_rate': error_rate,
+    }
+
+    results = []
+
+    if startup:
+        print_progress('Starting the entry points...')
+        results.extend(bench_entry_points(repeat))
+
+    with StandInServer(enclosure_size, latency, bandwidth, error_rate) as server:
+        for items in sizes:
+            print_progress(f'Parsing a feed with {str(items)} episodes...')
+            results.append(bench_parse_remote_xml(server, items, repeat))
+            results.extend(bench_episodes(server, items, repeat))
+
+        if downloads:
+            print_progress(f'Downloading {str(downloads)} files...')
+            results.append(bench_podcast_download(server, downloads, workers, repeat))
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results,
+    }
+
+def save_results(results: dict, path: str):
+    '''Save benchmark results as JSON.
+
+    Arguments:
+        results: The results from run_suite().
+        path: The path of the JSON file.
+    '''
+
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+def load_results(path: str) -> dict:
+    '''Load benchmark results saved by save_results().
+
+    Arguments:
+        path: The path of the JSON file.
+    '''
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def compare_results(old: dict, new: dict) -> list:
+    '''Compare two sets of benchmark results.
+
+    Returns a list of dicts with the benchmark name, the number of items, the metric,
+    the old and new values, the change as a fraction of the old value, and whether
+    the change is an improvement. Only benchmarks and metrics in both sets are compared.
+
+    Arguments:
+        old: The earlier results (for example, from the previous commit).
+        new: The later results.
+    '''
+
+    old_results = {(result['name'], result['items']): result for result in old['results']}
+    comparison = []
+
+    for result in new['results']:
+        previous = old_results.get((result['name'], result['items']))
+        if previous is None:
+            continue
+
+        for metric, larger_is_better in METRICS.items():
+            old_value = previous.get(metric)
+            new_value = result.get(metric)
+
+            if not old_value or new_value is None:
+                continue
+
+            change = (new_value - old_value) / old_value
+
+            comparison.append({
+                'name': result['name'],
+                'items': result['items'],
+                'metric': metric,
+                'old': old_value,
+                'new': new_value,
+                'change': change,
+                'improved': change > 0 if larger_is_better else change < 0,
+            })
+
+    return comparison
+
+def _result(name: str, items: int, seconds: float, memory: int, **extra) -> dict:
+    '''Returns the result of a benchmark as a dict.'''
+
+    result = {
+        'name': name,
+        'items': items,
+        'seconds': seconds,
+        'items_per_second': items / seconds if seconds else None,
+        'peak_memory_bytes': memory,
+    }
+    result.update(extra)
+
+    return result
+
+def _git_commit():
+    '''Returns the current git commit, or None if it is unknown.'''
+
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.stdout.decode().strip() or None
@@ -0,0 +1,292 @@
+# Downloading many podcasts at once.
+
+import hashlib
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from defusedxml import ElementTree
+from xml.etree.ElementTree import Element
+
+from .download import (_EventRelay, _download_jobs, _event_handler, _iter_results, _parse_items, _pending_episodes,
+                       _prepare_output_dir)
+from .misc import null
+from .results import ResultLog
+from .scheduler import ORDER_ROUND_ROBIN, QueuedDownload, order_downloads
+from .state import StateStore
+from .string import str_to_filename
+from .transfer import TransferOptions
+from .xml import get_unique_xml_element, parse_remote_xml
+
+# The file in each podcast's subdirectory which holds the URL or path of the podcast's feed
+FEED_SOURCE_FILENAME = '.podcast_downloader_feed'
+
+def parse_opml(path: str) -> list:
+    '''Returns the feed URLs listed in an OPML file, in order and without duplicates.
+
+    Uses defusedxml for parsing.
+
+    An example OPML file:
+        <opml version="1.0">
+            <body>
+                <outline text="Podcasts">
+                    <outline type="rss" text="Podcast Title" xmlUrl="https://example.com/feed.xml" />
+                </outline>
+            </body>
+        </opml>
+
+    Arguments:
+        path: The path of the OPML file.
+    '''
+
+    feeds = []
+    seen = set()
+
+    for outline in ElementTree.parse(path).iter('outline'):
+        url = outline.get('xmlUrl')
+
+        if url and url not in seen:
+            seen.add(url)
+            feeds.append(url)
+
+    return feeds
+
+def load_feed(source: str, cache=None, client=None) -> Element:
+    '''Parse a remote or local RSS file.
+
+    Arguments:
+        source: The URL (starting with http:// or https://) or the path of the RSS file.
+        cache: If supplied, the modules.cache.FeedCache for remote RSS files.
+        client: The modules.network.HttpClient to use (by default, the shared client).
+    '''
+
+    if source.lower().startswith(('http://', 'https://')):
+        return parse_remote_xml(source, cache=cache, client=client)
+    else:
+        return ElementTree.parse(source).getroot()
+
+def batch_download(feeds: list, output_dir: str='', rename: bool=False, print_progress=null,
+                   workers: int=4, host_limit: int=4, feed_workers: int=8, resync: bool=False,
+                   cache=None, options: TransferOptions=None, on_event=None, selection=None,
+                   order=None, on_result=None, keep_results: bool=True) -> dict:
+    '''Download all episodes in several podcasts.
+
+    The feeds are fetched and parsed in parallel. All of their episodes are then
+    downloaded by one shared pool of workers. By default the feeds take turns
+    (round-robin), so one huge back catalog can not starve the others, and the
+    per-host limit applies across all feeds. Each file is only started once the
+    disk has room for it (see modules.space.DiskSpace).
+
+    Each podcast is saved in a subdirectory of the output directory, named after its title.
+
+    Returns a dict shaped like the podcast_download result, with the totals for all feeds,
+    plus a 'feeds' dict with the podcast_download result for each feed, keyed by the feed
+    source, with the feed's output 'directory' and 'title' (None if it has no title).
+    Feeds that could not be fetched or parsed have an 'error' instead.
+
+    Arguments:
+        feeds: The URLs or paths of the RSS files (see parse_opml() for reading an OPML file).
+        output_dir: The output directory name (or the same directory if an empty string is supplied).
+        rename: Whether to rename the downloaded files to the names of the episodes.
+        print_progress: The function for handling the progress output.
+        workers: The number of files to download at once.
+        host_limit: The maximum number of connections to the same host at once, counting each file
+                    and each extra range of a segmented download (0 for no limit).
+                    Ignored if options.host_slots is set.
+        feed_workers: The number of feeds to fetch at once.
+        resync: If True, download every episode again, even if it was downloaded before.
+        cache: If supplied, the modules.cache.FeedCache for remote RSS files.
+        options: The settings for the file downloads, such as the HTTP client
+                 (see modules.transfer.TransferOptions). Also used for fetching the feeds.
+                 Set options.cancel to stop the download from another thread.
+        on_event: A function called with a modules.events.DownloadEvent for each step of
+                  each download (see podcast_download).
+        selection: If supplied, a modules.selection.EpisodeSelection choosing the episodes
+                   to download from each feed.
+        order: The order the episodes of all the feeds are downloaded in: the name of an order
+               in modules.scheduler.DOWNLOAD_ORDERS, or a function that orders a list of
+               modules.scheduler.QueuedDownload objects (grouped by feed source).
+               By default, ORDER_ROUND_ROBIN.
+        on_result: A function called with the modules.results.DownloadResult of each episode
+                   as soon as it is final (see podcast_download and iter_batch_download()).
+        keep_results: Whether to keep the result of every episode for the 'downloads' list
+                      of each feed. If False, only the totals are returned.
+    '''
+
+    options = options or TransferOptions()
+
+    # Each feed is only downloaded once
+    feeds = list(OrderedDict.fromkeys(feeds))
+
+    # Set the download path
+    output_dir = _prepare_output_dir(output_dir)
+
+    # The events are passed to on_event, and their messages to print_progress
+    relay = _EventRelay(_event_handler(print_progress, on_event, on_result))
+
+    # Fetch and parse the feeds in parallel
+    print_progress(f'Fetching {str(len(feeds))} feed{"s" if len(feeds) != 1 else ""}...')
+
+    def fetch(source: str):
+        try:
+            return load_feed(source, cache, options.client), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max(1, feed_workers)) as executor:
+        fetched = list(executor.map(fetch, feeds))
+
+    # The result for each feed, keyed by the feed source
+    results = {}
+
+    # The state, episodes and results of each feed
+    # (source, output directory, state store, pending episodes, ResultLog)
+    plans = []
+
+    # source -> the podcast title
+    titles = {}
+
+    for source, (rss, error) in zip(feeds, fetched):
+        try:
+            if error is not None:
+                raise error
+
+            titles[source] = _feed_title(rss)
+            feed_dir = _feed_directory(output_dir, rss, source)
+            state = StateStore(feed_dir)
+            if resync:
+                state.clear()
+
+            # Parse the episodes up front, so the total number of files is known
+            items = rss.findall('channel/item')
+            if selection is not None:
+                items = selection.select_items(items)
+
+            # The items which can not be parsed are reported and skipped, as for a single feed
+            download_progress = ResultLog(keep_results, relay.emit)
+            episodes = _parse_items(items, download_progress, relay.emit, feed_dir)
+            pending = list(_pending_episodes(episodes, rename, state, download_progress, relay.emit,
+                                              resync))
+
+            plans.append((source, feed_dir, state, pending, download_progress))
+        except Exception as e:
+            print_progress(f'  ERROR -> "{source}": {str(e)}')
+            results[source] = {'error': str(e)}
+
+    # The (group, state store, ResultLog, index, episode, file name) of each file
+    # to download, where the group is the feed source
+    jobs = [(source, state, download_progress, index, episode, filename)
+            for source, feed_dir, state, pending, download_progress in plans
+            for index, episode, filename in pending]
+
+    order = order or ORDER_ROUND_ROBIN
+
+    downloads = [QueuedDownload(job[0], job[4], job) for job in jobs]
+    jobs = [download.job for download in order_downloads(downloads, order)]
+
+    try:
+        # With round-robin, the feeds take turns in the scheduler. Any other order is kept
+        # across all feeds and hosts, apart from the jobs held back by the host limit.
+        _download_jobs(jobs, len(jobs), relay, workers, host_limit, options, order == ORDER_ROUND_ROBIN)
+    finally:
+        # Save the record of the downloaded episodes, even if the download was interrupted,
+        # and report the episodes which were not downloaded as cancelled
+        for plan in plans:
+            plan[2].save()
+            plan[4].close()
+
+    for source, feed_dir, state, pending, download_progress in plans:
+        results[source] = download_progress.summary()
+        results[source]['directory'] = feed_dir
+        results[source]['title'] = titles[source]
+
+    # Add up the totals for all feeds, keeping the feeds in their original order
+    report = {
+        'total_items': 0,
+        'total_downloads': 0,
+        'total_skipped': 0,
+        'total_cancelled': 0,
+        'total_errors': 0,
+        'feeds': {},
+    }
+
+    for source in feeds:
+        result = results[source]
+        report['feeds'][source] = result
+
+        for key in ('total_items', 'total_downloads', 'total_skipped', 'total_cancelled', 'total_errors'):
+            report[key] += result.get(key, 0)
+
+    # Feeds that could not be downloaded count as one error each
+    report['total_errors'] += sum(1 for result in results.values() if 'error' in result)
+
+    return report
+
+def iter_batch_download(feeds: list, **kwargs):
+    '''A generator that runs batch_download and yields the modules.results.DownloadResult
+    of each episode of every feed as soon as it is final. The generator's return value
+    is the batch_download result. See modules.download.iter_podcast_download().
+
+    Arguments:
+        feeds: The URLs or paths of the RSS files.
+        kwargs: The other arguments of batch_download.
+    '''
+
+    return _iter_results(batch_download, (feeds,), kwargs)
+
+def _feed_directory(output_dir: str, rss: Element, source: str) -> str:
+    '''Returns the full path of the subdirectory for a podcast, creating it if it does not exist.
+
+    The directory is named after the podcast title, or the feed source if there is no title.
+    If a directory with that name already belongs to another feed, such as a different
+    podcast with the same title, a short hash of the feed source is added to the name:
+    "Title (1a2b3c4d)". Each directory records the source of the feed it belongs to
+    (see FEED_SOURCE_FILENAME), so a feed keeps its directory whatever order the feeds are in.
+
+    Arguments:
+        output_dir: The full path of the output directory.
+        rss: The podcast RSS.
+        source: The URL or path of the RSS file.
+    '''
+
+    title = _feed_title(rss)
+    name = str_to_filename((title or source).strip()) or 'podcast'
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]
+
+    for directory_name in (name, f'{name} ({digest})'):
+        directory = _prepare_output_dir(os.path.join(output_dir, directory_name))
+        path = os.path.join(directory, FEED_SOURCE_FILENAME)
+
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                owner = file.read().strip()
+        except OSError:
+            owner = None
+
+        if owner is None:
+            # A new directory (or one saved by an older version), which now belongs to this feed
+            try:
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(source)
+            except OSError:
+                pass
+
+            return directory
+
+        if owner == source:
+            return directory
+
+    # Another source has the same hash, which is very unlikely, so the directory is shared
+    return directory
+
+def _feed_title(rss: Element):
+    '''Returns the podcast title, or None if the feed does not have exactly one.
+
+    Arguments:
+        rss: The podcast RSS.
+    '''
+
+    try:
+        return get_unique_xml_element(rss, 'channel/title').text
+    except Exception:
+        return None
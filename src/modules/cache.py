@@ -0,0 +1,220 @@
+# The on-disk cache for RSS feeds.
+
+import hashlib
+import json
+import os
+import threading
+
+from defusedxml import ElementTree
+from xml.etree.ElementTree import Element, SubElement
+
+from .podcast import EPISODE_ELEMENTS
+
+# The version of the saved episode lists, which are ignored if it changes
+EPISODES_VERSION = 1
+
+def default_cache_dir() -> str:
+    '''Returns the default feed cache directory for the current user.'''
+
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'PodcastDownloader', 'feeds')
+
+class FeedCache(object):
+    '''Stores RSS feeds with their ETag and Last-Modified headers.
+
+    The validators are sent back with the next request for the same feed
+    (as If-None-Match and If-Modified-Since). If the server responds with
+    304 Not Modified, the cached feed is used instead.
+
+    Feeds that have already been parsed by this object are kept in memory, so a
+    304 response skips the parse as well as the transfer. The channel title and the
+    <item> elements read by modules.podcast.Episode are also saved in a compact form
+    with the validators, so a new process rebuilds just those elements on a 304
+    instead of parsing the whole feed again. The cached body is only parsed if the
+    saved episodes are missing or out of date.
+    '''
+
+    def __init__(self, directory: str=None):
+        '''Create a FeedCache object.
+
+        Arguments:
+            directory: The cache directory (see default_cache_dir() for the default).
+                       It is created if it does not exist.
+        '''
+
+        self.directory = directory or default_cache_dir()
+        os.makedirs(self.directory, exist_ok=True)
+
+        # URL -> (validators, parsed feed)
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    def validators(self, url: str) -> dict:
+        '''Returns the conditional request headers for a cached feed.
+
+        Returns an empty dict if the feed is not cached.
+
+        Arguments:
+            url: The URL of the feed.
+        '''
+
+        meta = self._load_meta(url)
+        headers = {}
+
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        return headers
+
+    def load(self, url: str) -> Element:
+        '''Returns a cached feed.
+
+        If it was not parsed by this object, it is rebuilt from the saved episodes, which
+        only have the <channel><title> element and the <item> elements with the children
+        read by modules.podcast.Episode.
+
+        Arguments:
+            url: The URL of the feed.
+        '''
+
+        meta = self._load_meta(url)
+        validators = _meta_validators(meta) if meta is not None else None
+
+        with self._lock:
+            parsed = self._parsed.get(url)
+
+        if parsed is not None and validators is not None and parsed[0] == validators:
+            return parsed[1]
+
+        rss = self._load_episodes(url, validators) if validators is not None else None
+
+        if rss is None:
+            with open(self._path(url, '.xml'), 'rb') as file:
+                rss = ElementTree.fromstring(file.read())
+
+            # Save the episodes, so the next process does not parse the body again
+            if validators is not None:
+                self._store_episodes(url, validators, rss)
+
+        if validators is not None:
+            with self._lock:
+                self._parsed[url] = (validators, rss)
+
+        return rss
+
+    def store(self, url: str, body: bytes, etag: str=None, last_modified: str=None, rss: Element=None):
+        '''Add a feed to the cache.
+
+        Feeds without an ETag or Last-Modified header can not be validated, so they are not cached.
+
+        Arguments:
+            url: The URL of the feed.
+            body: The (decompressed) feed XML.
+            etag: The ETag header of the response.
+            last_modified: The Last-Modified header of the response.
+            rss: The parsed feed, if it has already been parsed.
+        '''
+
+        if not etag and not last_modified:
+            return
+
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+        # Write the body before the validators, so the validators never refer to a missing body
+        _write_atomic(self._path(url, '.xml'), body)
+        if rss is not None:
+            self._store_episodes(url, _meta_validators(meta), rss)
+        _write_atomic(self._path(url, '.json'), json.dumps(meta).encode('utf-8'))
+
+        if rss is not None:
+            with self._lock:
+                self._parsed[url] = (_meta_validators(meta), rss)
+
+    def _path(self, url: str, extension: str) -> str:
+        '''Returns the path of a cache file for a feed.'''
+
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+        return os.path.join(self.directory, key + extension)
+
+    def _store_episodes(self, url: str, validators: tuple, rss: Element):
+        '''Save the channel title and the episode elements of a parsed feed, with its validators.'''
+
+        record = {
+            'version': EPISODES_VERSION,
+            'validators': list(validators),
+            'titles': [title.text for title in rss.findall('channel/title')],
+            # The [tag, text, attributes] of the children of each <item> read by Episode
+            'items': [
+                [[child.tag, child.text, dict(child.attrib)] for child in item if child.tag in EPISODE_ELEMENTS]
+                for item in rss.findall('channel/item')
+            ],
+        }
+
+        _write_atomic(self._path(url, '.episodes.json'), json.dumps(record, separators=(',', ':')).encode('utf-8'))
+
+    def _load_episodes(self, url: str, validators: tuple):
+        '''Returns the feed rebuilt from its saved episodes, or None if they are missing
+        or were saved for different validators.'''
+
+        try:
+            with open(self._path(url, '.episodes.json'), 'r', encoding='utf-8') as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if record.get('version') != EPISODES_VERSION or tuple(record.get('validators', ())) != validators:
+            return None
+
+        rss = Element('rss')
+        channel = SubElement(rss, 'channel')
+
+        for text in record['titles']:
+            SubElement(channel, 'title').text = text
+
+        for children in record['items']:
+            item = SubElement(channel, 'item')
+
+            for tag, text, attributes in children:
+                SubElement(item, tag, attributes).text = text
+
+        return rss
+
+    def _load_meta(self, url: str):
+        '''Returns the saved validators for a feed, or None if the feed is not cached.'''
+
+        try:
+            with open(self._path(url, '.json'), 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('url') != url or not os.path.isfile(self._path(url, '.xml')):
+            return None
+
+        return meta
+
+def _meta_validators(meta: dict) -> tuple:
+    '''Returns the validators in a cache record as a tuple.'''
+
+    return (meta.get('etag'), meta.get('last_modified'))
+
+def _write_atomic(path: str, data: bytes):
+    '''Write a file under a temporary name and rename it into place.'''
+
+    temporary_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(data)
+
+    os.replace(temporary_path, path)
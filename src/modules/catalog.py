@@ -0,0 +1,322 @@
+# The catalog of podcasts and episodes, kept in an SQLite database between runs.
+
+import os
+import sqlite3
+import threading
+import time
+
+from . import events
+from .selection import parse_date
+
+# The version of the database schema
+CATALOG_VERSION = 1
+
+# The number of changes written in one transaction
+BATCH_SIZE = 500
+
+# The longest time in seconds a change is kept in memory before it is written
+FLUSH_INTERVAL = 2.0
+
+# The episode statuses
+# The episode is waiting to be downloaded
+STATUS_QUEUED = 'queued'
+# The episode is being downloaded
+STATUS_DOWNLOADING = 'downloading'
+# The episode's file is in the output directory
+STATUS_DOWNLOADED = 'downloaded'
+# The last download of the episode failed (or was cancelled)
+STATUS_FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS feeds (
+    id INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL UNIQUE,
+    title TEXT,
+    source TEXT,
+    updated REAL
+);
+
+CREATE TABLE IF NOT EXISTS episodes (
+    feed_id INTEGER NOT NULL REFERENCES feeds (id),
+    guid TEXT NOT NULL,
+    title TEXT,
+    pub_date REAL,
+    url TEXT,
+    length INTEGER,
+    size INTEGER,
+    status TEXT NOT NULL,
+    path TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (feed_id, guid)
+);
+
+CREATE INDEX IF NOT EXISTS episodes_guid ON episodes (guid);
+CREATE INDEX IF NOT EXISTS episodes_pub_date ON episodes (pub_date);
+CREATE INDEX IF NOT EXISTS episodes_status ON episodes (status, updated);
+'''
+
+# The columns returned for each episode
+_EPISODE_COLUMNS = '''
+    feeds.directory AS feed, feeds.title AS feed_title, episodes.guid, episodes.title, episodes.pub_date,
+    episodes.url, episodes.length, episodes.size, episodes.status, episodes.path, episodes.error,
+    episodes.updated
+'''
+
+def default_catalog_path() -> str:
+    '''Returns the default catalog path for the current user.'''
+
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+
+    return os.path.join(base, 'PodcastDownloader', 'catalog.sqlite3')
+
+class Catalog(object):
+    '''The podcasts and episodes seen by every run, and what happened to each episode.
+
+    Pass the catalog as the on_event argument of podcast_download or batch_download
+    (combined with other handlers using modules.events.fan_out, if needed). It records
+    each episode with its GUID, title, publication date, URL, size, status, local path
+    and last error. Podcasts are identified by their output directory.
+
+    Changes are kept in memory and written in one transaction every BATCH_SIZE changes
+    or FLUSH_INTERVAL seconds, and by flush() and close(). The queries read the database
+    only, so they answer questions such as "which podcasts have episodes waiting" or
+    "what failed last week" without fetching any feeds.
+
+    Safe to use from several threads at once.
+
+    Example:
+        catalog = Catalog()
+        podcast_download(rss, output_dir='download', on_event=catalog)
+        catalog.close()
+
+        for episode in Catalog().failures(since=time.time() - 7 * 24 * 60 * 60):
+            print(episode['feed_title'], episode['title'], episode['error'])
+    '''
+
+    def __init__(self, path: str=None):
+        '''Open a catalog, creating it if it does not exist.
+
+        Arguments:
+            path: The path of the database file (see default_catalog_path() for the default),
+                  or ':memory:' for a catalog that is not saved.
+        '''
+
+        self.path = path or default_catalog_path()
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # The events are usually recorded on a different thread from the one that opened the catalog
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+            self._connection.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+        # directory -> feed id
+        self._feed_ids = {}
+
+        # The (SQL, parameters) of the changes which have not been written yet
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+        self._lock = threading.RLock()
+
+    def __call__(self, event: events.DownloadEvent):
+        '''Record an event. See handle().'''
+
+        self.handle(event)
+
+    def handle(self, event: events.DownloadEvent):
+        '''Record an event. Events without a GUID and feed (which are only set by
+        podcast_download and batch_download) are ignored.
+
+        Arguments:
+            event: The event.
+        '''
+
+        if event.guid is None or event.feed is None or event.kind in (events.RESPONSE, events.BYTES):
+            return
+
+        with self._lock:
+            feed_id = self._feed_id(event.feed)
+            path = os.path.join(event.feed, event.file)
+
+            if event.kind in (events.QUEUED, events.SKIPPED):
+                status = STATUS_DOWNLOADED if event.kind == events.SKIPPED else STATUS_QUEUED
+
+                self._pending.append((
+                    'INSERT OR IGNORE INTO episodes (feed_id, guid, status, updated) VALUES (?, ?, ?, ?)',
+                    (feed_id, event.guid, status, event.time),
+                ))
+                self._pending.append((
+                    'UPDATE episodes SET title = ?, pub_date = ?, url = ?, length = ?, status = ?, path = ?,'
+                    ' size = CASE WHEN ? THEN size ELSE NULL END, updated = ? WHERE feed_id = ? AND guid = ?',
+                    (event.title, parse_date(event.date), event.url, event.length, status, path,
+                     event.kind == events.SKIPPED, event.time, feed_id, event.guid),
+                ))
+            elif event.kind == events.STARTED:
+                self._update(feed_id, event, 'status = ?, error = NULL', STATUS_DOWNLOADING)
+            elif event.kind == events.FINISHED:
+                self._update(feed_id, event, 'status = ?, size = ?, error = NULL', STATUS_DOWNLOADED,
+                             event.size)
+            elif event.kind == events.FAILED:
+                self._update(feed_id, event, 'status = ?, error = ?', STATUS_FAILED, event.error)
+
+            self._pending.append(('UPDATE feeds SET updated = ? WHERE id = ?', (event.time, feed_id)))
+
+            if len(self._pending) >= BATCH_SIZE or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                self.flush()
+
+    def add_feed(self, directory: str, source: str=None, title: str=None):
+        '''Record the source and title of a podcast. The podcast is added if it is not in the catalog.
+
+        Arguments:
+            directory: The output directory of the podcast.
+            source: The URL or path of the RSS file.
+            title: The podcast title.
+        '''
+
+        with self._lock:
+            feed_id = self._feed_id(directory)
+
+            self._pending.append((
+                'UPDATE feeds SET source = COALESCE(?, source), title = COALESCE(?, title) WHERE id = ?',
+                (source, title, feed_id),
+            ))
+
+    def flush(self):
+        '''Write the changes kept in memory, in one transaction.'''
+
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+            self._last_flush = time.monotonic()
+
+            if pending:
+                with self._connection:
+                    for sql, parameters in pending:
+                        self._connection.execute(sql, parameters)
+
+    def close(self):
+        '''Write the remaining changes and close the database.'''
+
+        with self._lock:
+            self.flush()
+            self._connection.close()
+
+    def feeds(self) -> list:
+        '''Returns each podcast with its number of episodes by status, the latest
+        publication date and when it was last updated, as a list of dicts.'''
+
+        return self._query(
+            'SELECT feeds.directory AS feed, feeds.title, feeds.source, feeds.updated,'
+            ' COUNT(episodes.guid) AS episodes,'
+            ' SUM(episodes.status = ?) AS queued,'
+            ' SUM(episodes.status = ?) AS downloaded,'
+            ' SUM(episodes.status = ?) AS failed,'
+            ' MAX(episodes.pub_date) AS latest'
+            ' FROM feeds LEFT JOIN episodes ON episodes.feed_id = feeds.id'
+            ' GROUP BY feeds.id ORDER BY feeds.directory',
+            (STATUS_QUEUED, STATUS_DOWNLOADED, STATUS_FAILED),
+        )
+
+    def episodes(self, feed: str=None, status: str=None, since: float=None, until: float=None,
+                 guid: str=None, limit: int=None) -> list:
+        '''Returns the episodes which match every filter that is set, newest first, as a list of dicts.
+
+        Arguments:
+            feed: The output directory of the podcast.
+            status: The status (STATUS_QUEUED, STATUS_DOWNLOADING, STATUS_DOWNLOADED or STATUS_FAILED).
+            since: The earliest publication date, as a Unix timestamp.
+            until: The publication date the episodes must be published before, as a Unix timestamp.
+            guid: The episode GUID.
+            limit: The largest number of episodes to return.
+        '''
+
+        conditions = []
+        parameters = []
+
+        if feed is not None:
+            conditions.append('feeds.directory = ?')
+            parameters.append(os.path.abspath(feed))
+        if status is not None:
+            conditions.append('episodes.status = ?')
+            parameters.append(status)
+        if since is not None:
+            conditions.append('episodes.pub_date >= ?')
+            parameters.append(since)
+        if until is not None:
+            conditions.append('episodes.pub_date < ?')
+            parameters.append(until)
+        if guid is not None:
+            conditions.append('episodes.guid = ?')
+            parameters.append(guid)
+
+        sql = f'SELECT {_EPISODE_COLUMNS} FROM episodes JOIN feeds ON feeds.id = episodes.feed_id'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY episodes.pub_date DESC'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+
+        return self._query(sql, parameters)
+
+    def pending(self, feed: str=None) -> list:
+        '''Returns the episodes which have not been downloaded yet (queued or failed), newest first.
+
+        Arguments:
+            feed: If supplied, only the episodes of the podcast with this output directory.
+        '''
+
+        return [episode for episode in self.episodes(feed)
+                if episode['status'] in (STATUS_QUEUED, STATUS_FAILED)]
+
+    def failures(self, since: float=None) -> list:
+        '''Returns the episodes whose last download failed, most recent failure first.
+
+        Arguments:
+            since: If supplied, only the failures after this time, as a Unix timestamp.
+        '''
+
+        sql = (f'SELECT {_EPISODE_COLUMNS} FROM episodes JOIN feeds ON feeds.id = episodes.feed_id'
+               ' WHERE episodes.status = ? AND episodes.updated >= ? ORDER BY episodes.updated DESC')
+
+        return self._query(sql, (STATUS_FAILED, since if since is not None else 0))
+
+    def _update(self, feed_id: int, event: events.DownloadEvent, assignments: str, *values):
+        '''Queue an update of an episode. Must be called while holding the lock.'''
+
+        self._pending.append((
+            f'UPDATE episodes SET {assignments}, updated = ? WHERE feed_id = ? AND guid = ?',
+            values + (event.time, feed_id, event.guid),
+        ))
+
+    def _feed_id(self, directory: str) -> int:
+        '''Returns the id of a podcast, adding it if it is not in the catalog. Must be called while holding the lock.'''
+
+        directory = os.path.abspath(directory)
+        feed_id = self._feed_ids.get(directory)
+
+        if feed_id is None:
+            with self._connection:
+                self._connection.execute('INSERT OR IGNORE INTO feeds (directory) VALUES (?)', (directory,))
+
+            feed_id = self._connection.execute('SELECT id FROM feeds WHERE directory = ?',
+                                               (directory,)).fetchone()[0]
+            self._feed_ids[directory] = feed_id
+
+        return feed_id
+
+    def _query(self, sql: str, parameters) -> list:
+        '''Write the pending changes, then run a query and return its rows as dicts.'''
+
+        with self._lock:
+            self.flush()
+
+            return [dict(row) for row in self._connection.execute(sql, parameters)]
@@ -1,36 +1,413 @@
+import functools
 import os
+import queue
+import threading
 
-from defusedxml import ElementTree
 from xml.etree.ElementTree import Element
-from urllib import request
 
+from .events import EpisodeEvents, FAILED, QUEUED, SKIPPED, DownloadEvent, print_adapter
+from .planner import DirectoryIndex, FilenamePlanner
 from .podcast import Episode
-from .string import str_to_filename
-from .xml import get_unique_xml_element
 from .misc import null
+from .ratelimit import RateLimiter
+from .results import DownloadResult, ResultLog
+from .scheduler import ORDER_FEED, HostSlots, QueuedDownload, Scheduler, order_downloads, url_host
+from .state import StateStore
+from .transfer import PART_SUFFIX, DownloadCancelled, PartialDownload, TransferOptions, download_file
+from .verify import Verifier
+from .xml import XmlElementNotFound, XmlElementNotUnique
+
+# The largest number of episodes read from a streamed feed ahead of the downloads
+READ_AHEAD = 10000
 
 def podcast_download(rss: Element, delay: int=0, output_dir: str='',
-                     rename: bool=False, print_progress=null) -> dict:
+                     rename: bool=False, print_progress=null,
+                     workers: int=1, host_limit: int=4, resync: bool=False,
+                     options: TransferOptions=None, on_event=None, selection=None, order=None,
+                     on_result=None, keep_results: bool=True) -> dict:
     '''The main function.
 
     Download all episodes in a podcast.
 
+    Episodes that were downloaded by an earlier run, and have not changed since,
+    are skipped. See modules.state.StateStore.
+
     Arguments:
-        url: The podcast RSS.
-        delay: The delay in seconds between file downloads.
+        url: The podcast RSS, or an iterable of Episode objects. Use an iterator such as
+             modules.podcast.iter_remote_episodes() to start downloading the first episodes
+             while the rest of the feed is still being parsed. The iterator is read on a
+             separate thread, so the feed is not held open while the episodes download.
+        delay: The delay in seconds between requests to the same host. Ignored if
+               options has a rate limiter, which should set requests_per_second instead.
         output_dir: The output directory name (or the same directory if an empty string is supplied).
         rename: Whether to rename the downloaded file to the name of the to the episode.
         print_progress: The function for handling the progress output.
+        workers: The number of files to download at once.
+        host_limit: The maximum number of connections to the same host at once, counting each
+                    file and each extra range of a segmented download (0 for no limit). Only used
+                    when downloading more than one file at once. Ignored if options.host_slots is set.
+        resync: If True, download every episode again, even if it was downloaded before.
+        options: The settings for the file downloads, such as the HTTP client
+                 (see modules.transfer.TransferOptions). Set options.cancel to stop the
+                 download from another thread: the episodes that were not downloaded
+                 are reported as cancelled.
+        on_event: A function called with a modules.events.DownloadEvent for each step of
+                  each download (queued, started, bytes received, finished or failed),
+                  such as a modules.metrics.MetricsCollector.
+        selection: If supplied, a modules.selection.EpisodeSelection choosing the episodes to
+                   download, such as the latest few. The other episodes are not parsed. To also
+                   stop fetching a remote feed early, pass the selection to
+                   modules.podcast.iter_remote_episodes() instead.
+        order: The order the episodes are downloaded in: the name of an order in
+               modules.scheduler.DOWNLOAD_ORDERS (such as ORDER_NEWEST or ORDER_SMALLEST),
+               or a function that orders a list of modules.scheduler.QueuedDownload objects.
+               By default, the feed order. Any other order parses the whole feed before
+               the first download starts.
+        on_result: A function called with the modules.results.DownloadResult of each episode
+                   as soon as it is final (skipped, downloaded and checked, failed or cancelled),
+                   such as a modules.results.JsonLinesWriter. See also iter_podcast_download().
+        keep_results: Whether to keep the result of every episode for the 'downloads' list.
+                      If False, only the totals are returned, so the memory used does not grow
+                      with the number of episodes.
+
+    Returns the totals of the episodes downloaded, skipped, cancelled and failed, and the
+    'downloads' list of the modules.results.DownloadResult of each episode, in feed order
+    (if keep_results is True).
+
+    Each file is only started once the disk has room for it (see modules.space.DiskSpace).
+
+    NOTE: print_progress, on_event and on_result are always called from the calling thread,
+          in order, even when several files are downloaded at once.
     '''
 
-    # Count the number of files downloaded and the number of errors
-    files_downloaded = 0
-    file_errors = 0
+    options = options or TransferOptions()
 
-    # Keep a record of the download progress
-    download_progress = []
+    if delay and options.limiter is None:
+        # Space out the requests to each host, even when several files are downloaded at once
+        options = options.copy(limiter=RateLimiter(requests_per_second=1 / delay))
 
     # Set the download path
+    output_dir = _prepare_output_dir(output_dir)
+
+    # Load the record of the episodes downloaded by earlier runs
+    state = StateStore(output_dir)
+    if resync:
+        state.clear()
+
+    # The events are passed to on_event, and their messages to print_progress
+    relay = _EventRelay(_event_handler(print_progress, on_event, on_result))
+
+    # The result of each episode, in the same order as the feed
+    download_progress = ResultLog(keep_results, relay.emit)
+
+    if hasattr(rss, 'findall'):
+        # Parse all RSS <item> elements up front, so the total number of files is known
+        items = rss.findall('channel/item')
+        if selection is not None:
+            items = selection.select_items(items)
+
+        episodes = _parse_items(items, download_progress, relay.emit, output_dir)
+        pending = list(_pending_episodes(episodes, rename, state, download_progress, relay.emit, resync))
+        total_files = len(pending)
+    elif order not in (None, ORDER_FEED):
+        # The whole feed is needed to order the episodes
+        if selection is not None:
+            rss = selection.select(rss)
+
+        pending = list(_pending_episodes(rss, rename, state, download_progress, relay.emit, resync))
+        total_files = len(pending)
+    else:
+        # The episodes are parsed as they are downloaded
+        if selection is not None:
+            rss = selection.select(rss)
+
+        pending = _pending_episodes(_read_ahead(rss), rename, state, download_progress, relay.emit, resync)
+        total_files = None
+
+    if order not in (None, ORDER_FEED):
+        pending = _order_pending(pending, output_dir, order)
+
+    # Every episode belongs to the one podcast
+    jobs = ((output_dir, state, download_progress, index, episode, filename)
+            for index, episode, filename in pending)
+
+    try:
+        _download_jobs(jobs, total_files, relay, workers, host_limit, options)
+    finally:
+        # Save the record of the downloaded episodes, even if the download was interrupted
+        state.save()
+
+        # The episodes which were not downloaded are reported as cancelled
+        download_progress.close()
+
+    return download_progress.summary()
+
+def iter_podcast_download(rss: Element, **kwargs):
+    '''A generator that runs podcast_download and yields the modules.results.DownloadResult
+    of each episode as soon as it is final (in the order they finish, not the feed order).
+
+    Example:
+        for result in iter_podcast_download(rss, output_dir='download', workers=4):
+            print(result.file, result.downloaded)
+
+    The download runs on a separate thread, which also calls print_progress and on_event.
+    The results are not kept (keep_results is False), so the memory used does not grow with
+    the number of episodes. The generator's return value is the podcast_download result,
+    with the totals. Closing the generator early cancels the download.
+
+    Arguments:
+        rss: The podcast RSS, or an iterable of Episode objects.
+        kwargs: The other arguments of podcast_download.
+    '''
+
+    return _iter_results(podcast_download, (rss,), kwargs)
+
+def _iter_results(function, args: tuple, kwargs: dict):
+    '''Runs a download function on a separate thread, yielding the results passed to its
+    on_result argument and returning its return value. See iter_podcast_download().
+
+    Arguments:
+        function: podcast_download or batch_download.
+        args: The positional arguments of the function.
+        kwargs: The keyword arguments of the function, apart from on_result.
+    '''
+
+    # The cancel event is needed to stop the download if the generator is closed early
+    options = kwargs.get('options') or TransferOptions()
+    if options.cancel is None:
+        options = options.copy(cancel=threading.Event())
+
+    results = queue.Queue()
+    outcome = {}
+
+    def run():
+        try:
+            outcome['report'] = function(*args, **dict(kwargs, options=options, on_result=results.put,
+                                                       keep_results=kwargs.get('keep_results', False)))
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            # None marks the end of the results
+            results.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    finished = False
+
+    try:
+        result = results.get()
+        while result is not None:
+            yield result
+            result = results.get()
+
+        finished = True
+    finally:
+        if not finished:
+            # Stop the download, keeping the partial files for the next run
+            options.cancel.set()
+
+        thread.join()
+
+    if 'error' in outcome:
+        raise outcome['error']
+
+    return outcome['report']
+
+def _pending_episodes(episodes, rename: bool, state: StateStore, download_progress: ResultLog, emit=null,
+                     resync: bool=False):
+    '''Yields the (index, episode, file name) of each episode that needs to be downloaded.
+
+    The output directory is scanned once, and each episode is given a file name that
+    no other episode uses (see modules.planner.FilenamePlanner). Episodes whose file
+    is already in the directory are skipped: either an earlier run recorded it, or
+    it has the size the feed gives for the episode, in which case it is recorded now.
+
+    A result is added to download_progress for every episode. Episodes that are
+    already downloaded get a final 'skipped' result, and the others get a
+    'cancelled' result, to be replaced at their index once they are downloaded.
+
+    Arguments:
+        episodes: An iterable of Episode objects.
+        rename: Whether to use the episode titles as the file names.
+        state: The record of the episodes downloaded by earlier runs.
+        download_progress: The modules.results.ResultLog for the episodes.
+        emit: The function the SKIPPED and QUEUED events are passed to.
+        resync: If True, download the episodes even if their files are already present.
+    '''
+
+    index = DirectoryIndex(state.output_dir)
+    planner = FilenamePlanner(state, rename, index)
+
+    for episode in episodes:
+        filename = planner.assign(episode)
+
+        if not resync and _is_present(episode, filename, state, index):
+            download_progress.add(DownloadResult(filename, skipped=True, guid=episode.guid,
+                                                 feed=state.output_dir), final=True)
+            emit(DownloadEvent(SKIPPED, episode.title, episode.url, url_host(episode.url), filename,
+                               guid=episode.guid, feed=state.output_dir, date=episode.date,
+                               length=episode.length))
+        else:
+            position = download_progress.add(_cancelled_result(episode, filename, state.output_dir))
+            emit(DownloadEvent(QUEUED, episode.title, episode.url, url_host(episode.url), filename,
+                               guid=episode.guid, feed=state.output_dir, date=episode.date,
+                               length=episode.length))
+            yield position, episode, filename
+
+def _parse_items(items, download_progress: ResultLog, emit, feed: str):
+    '''Yields an Episode for each RSS <item> element, skipping the items which can not be parsed.
+
+    Each skipped item, such as one without an <enclosure>, gets an error result in
+    download_progress and a FAILED event, so one malformed item does not stop the
+    rest of the podcast from being downloaded.
+
+    Arguments:
+        items: The <item> elements.
+        download_progress: The modules.results.ResultLog for the episodes.
+        emit: The function the FAILED events are passed to.
+        feed: The full path of the podcast's output directory.
+    '''
+
+    for item in items:
+        try:
+            episode = Episode(item)
+        except (XmlElementNotFound, XmlElementNotUnique) as e:
+            result = _invalid_item_result(item, e, feed)
+            download_progress.add(result, final=True)
+
+            url = _enclosure_url(item)
+            emit(DownloadEvent(FAILED, item.findtext('title') or '', url, url_host(url) if url else None,
+                               result.file, guid=result.guid, feed=feed, error=result.error))
+            continue
+
+        yield episode
+
+def _invalid_item_result(item: Element, error: Exception, feed: str) -> DownloadResult:
+    '''Returns the result for an RSS <item> element which can not be parsed.
+
+    Arguments:
+        item: The <item> element.
+        error: The exception raised while parsing it.
+        feed: The full path of the podcast's output directory.
+    '''
+
+    url = _enclosure_url(item)
+
+    return DownloadResult(url.split('/')[-1] if url else '', error=f'Invalid episode: {str(error)}',
+                          guid=item.findtext('guid'), feed=feed)
+
+def _enclosure_url(item: Element):
+    '''Returns the URL of the first <enclosure> of an RSS <item> element, or None if it has none.'''
+
+    enclosure = item.find('enclosure')
+
+    return enclosure.get('url') if enclosure is not None else None
+
+def _read_ahead(episodes, size: int=READ_AHEAD):
+    '''Yields the items of an iterable, which is read on a separate thread.
+
+    The items are read as fast as the source gives them (up to size items ahead), so a
+    streamed feed is read to the end and its connection closed without waiting for the
+    downloads, which could otherwise leave it idle until the server times it out.
+
+    Re-raises any exception raised while reading. If the generator is closed early,
+    the reading stops and the iterable is closed.
+
+    Arguments:
+        episodes: The iterable, such as modules.podcast.iter_remote_episodes().
+        size: The largest number of items read ahead.
+    '''
+
+    buffer = queue.Queue(size)
+    stopped = threading.Event()
+
+    # Marks the end of the items, with the exception raised while reading (if any)
+    end = object()
+
+    def put(item) -> bool:
+        # Wait for room in the buffer, unless the items are no longer wanted
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def read():
+        try:
+            for episode in episodes:
+                if not put((episode, None)):
+                    return
+
+            put((end, None))
+        except Exception as e:
+            put((end, e))
+        finally:
+            # Close the connection of a streamed feed that was not read to the end
+            close = getattr(episodes, 'close', None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=read, daemon=True).start()
+
+    try:
+        while True:
+            episode, error = buffer.get()
+
+            if episode is end:
+                if error is not None:
+                    raise error
+
+                return
+
+            yield episode
+    finally:
+        stopped.set()
+
+def _order_pending(pending: list, group, order) -> list:
+    '''Returns the (index, episode, file name) of each episode to download, in the order they should start.
+
+    Arguments:
+        pending: The (index, episode, file name) of each episode, in feed order.
+        group: The podcast the episodes belong to.
+        order: The download order (see modules.scheduler.order_downloads()).
+    '''
+
+    downloads = [QueuedDownload(group, job[1], job) for job in pending]
+
+    return [download.job for download in order_downloads(downloads, order)]
+
+def _is_present(episode: Episode, filename: str, state: StateStore, index: DirectoryIndex) -> bool:
+    '''Whether an episode's file is already in the output directory, recording it if
+    it was not downloaded by an earlier run but has the expected size.
+
+    Arguments:
+        episode: The episode.
+        filename: The file name the episode is saved as.
+        state: The record of the episodes downloaded by earlier runs.
+        index: The index of the output directory.
+    '''
+
+    if state.is_downloaded(episode, filename, index):
+        return True
+
+    # A file left by an older version, or copied in by hand
+    if episode.guid not in state.episodes and episode.length and index.size(filename) == episode.length:
+        state.record(episode, filename, episode.length)
+        return True
+
+    return False
+
+def _prepare_output_dir(output_dir: str) -> str:
+    '''Returns the full path of the output directory, creating it if it does not exist.
+
+    Arguments:
+        output_dir: The output directory name (or the same directory if an empty string is supplied).
+    '''
+
     # os.path.join() returns a path ending in a slash when a second argument is an empty string,
     # and a path not ending in a slash otherwise.
     if output_dir:
@@ -41,58 +418,789 @@ def podcast_download(rss: Element, delay: int=0, output_dir: str='',
             os.makedirs(output_dir)
     else:
         output_dir = os.getcwd()
-    
-
-    # Find all RSS <item> elements
-    items = rss.findall('channel/item')
-	
-	# Count the total number of files
-    total_files = len(items)
-	
-    # Keep track of the file number
-    file_number = 0
-    
-    for item in items:
-	
-        # Increment the file number
-        file_number += 1
-
-        # Parse the <item> element for the episode
-        episode = Episode(item)
-
-        print_progress(f'Downloading {str(file_number)} of {str(total_files)}: "{episode.title}"')
-             
-        if rename:
-            # Rename the file to the episode title
-            filename = f'{str_to_filename(episode.title)}.{str_to_filename(episode.file_extension)}'
+
+    return output_dir
+
+def _download_episode(episode: Episode, output_dir: str, filename: str, state: StateStore=None,
+                      events: EpisodeEvents=None, options: TransferOptions=None, verifier: Verifier=None,
+                      key: tuple=None, reservation=None) -> DownloadResult:
+    '''Download a single episode, whose disk space has already been set aside (see _reserve_space()).
+
+    Returns the modules.results.DownloadResult for the episode.
+
+    Arguments:
+        episode: The episode to download.
+        output_dir: The full path of the output directory.
+        filename: The file name to save the episode as.
+        state: If supplied, the download is recorded in this state store.
+        events: If supplied, the events for the download are emitted through this object.
+                Its STARTED event should already have been emitted.
+        options: The transfer settings.
+        verifier: If supplied, the downloaded file is queued to be checked by this verifier,
+                  and is only recorded in the state store once it passes (see _check_downloads).
+        key: The (state store, ResultLog, index, episode, file name) of the download, for the verifier.
+        reservation: The disk space set aside for the file, which is released once the download ends.
+    '''
+
+    options = options or TransferOptions()
+    filepath = os.path.join(output_dir, filename)
+
+    try:
+        # Remember the length given by the server, which the download is checked against
+        progress = _LengthRecorder(events.progress if events is not None else None)
+
+        size = download_file(episode.url, filepath, options, episode.length, progress)
+
+        if verifier is not None:
+            verifier.submit(filepath, size, episode.length, key, progress.length)
+        elif state is not None:
+            state.record(episode, filename, size)
+
+        if events is not None:
+            events.finished(size)
+
+        return DownloadResult(filename, downloaded=True, guid=episode.guid, feed=output_dir)
+    except DownloadCancelled as e:
+        if events is not None:
+            events.failed(e)
+
+        return _cancelled_result(episode, filename, output_dir)
+    except Exception as e:
+        if events is not None:
+            events.failed(e)
+
+        return DownloadResult(filename, error=str(e), guid=episode.guid, feed=output_dir)
+    finally:
+        options.disk_space.release(reservation)
+
+def _store_result(download_progress: ResultLog, index: int, result: DownloadResult, verifier: Verifier=None):
+    '''Store the result of a download. A downloaded file's result is only final once the
+    file has been checked (see _check_downloads).
+
+    Arguments:
+        download_progress: The ResultLog for the episodes.
+        index: The index of the episode.
+        result: The result returned by _download_episode.
+        verifier: The verifier the downloaded files are queued with, if any.
+    '''
+
+    if verifier is not None and result.downloaded:
+        download_progress.update(index, result)
+    else:
+        download_progress.finish(index, result)
+
+def _download_jobs(jobs, total_files, relay, workers: int, host_limit: int, options: TransferOptions,
+                   round_robin: bool=False):
+    '''Download episodes, checking each downloaded file and downloading the files which fail
+    the check once more. The download loop of podcast_download and modules.batch.batch_download.
+
+    The result of each episode is stored in its ResultLog at the episode's index, and the
+    files that pass the check are recorded in their state store. The caller saves the state
+    stores and closes the ResultLogs, even if this raises.
+
+    With one worker, the episodes are downloaded on the calling thread. Otherwise they
+    are run by a modules.scheduler.Scheduler, which is fed by a separate thread, so
+    downloads start while a lazy feed is still being parsed. See _EventRelay for how
+    the events are handled.
+
+    Arguments:
+        jobs: An iterable of the (group, state store, ResultLog, index, episode, file name) of
+              each episode to download, in the order they should start. The group is the
+              podcast the episode belongs to, such as its output directory.
+        total_files: The number of episodes to download, or None if it is not known.
+        relay: The _EventRelay for the events.
+        workers: The number of files to download at once.
+        host_limit: The maximum number of connections to the same host at once (0 for no limit).
+                    Ignored if options.host_slots is set.
+        options: The transfer settings.
+        round_robin: Whether the podcasts take turns in the scheduler. Otherwise the episodes
+                     start in the order of jobs, apart from those held back by the host limit.
+    '''
+
+    # The downloaded files are checked on a separate pool of threads
+    verifier = Verifier(options.verify_workers) if options.verify_workers > 0 else None
+
+    # The downloads which failed the check in this pass
+    retries = []
+
+    def check(wait: bool=False):
+        # Record the files checked so far, so their results are final as soon as possible
+        if verifier is not None:
+            retries.extend(_check_downloads(verifier, relay.emit, attempt == 0 and not _is_cancelled(options),
+                                            wait))
+
+    try:
+        # The files which fail the check are downloaded once more
+        for attempt in range(2):
+            if workers > 1:
+                # Download the files on a pool of worker threads
+                relay.run(functools.partial(_scheduled_download, jobs, total_files, relay.emit, workers,
+                                            host_limit, options, verifier, round_robin), check)
+            else:
+                # Keep track of the file number
+                file_number = 0
+
+                for job in jobs:
+                    if _is_cancelled(options):
+                        break
+
+                    # The download only starts once the disk has room for the file
+                    reserved, reservation = _reserve_space(job, relay.emit, options)
+
+                    if reserved:
+                        # Increment the file number
+                        file_number += 1
+
+                        _download_job(job, _job_events(job, relay.emit, file_number, total_files), options,
+                                      verifier, reservation)
+
+                    check()
+
+            if verifier is None:
+                break
+
+            check(wait=True)
+            if not retries:
+                break
+
+            jobs = [(state.output_dir, state, download_progress, index, episode, filename)
+                    for state, download_progress, index, episode, filename in retries]
+            total_files = len(jobs)
+            del retries[:]
+    finally:
+        if verifier is not None:
+            # Record the files that were checked before the download was interrupted
+            _check_downloads(verifier, relay.emit, False)
+            verifier.close()
+
+def _scheduled_download(jobs, total_files, emit, workers: int, host_limit: int, options: TransferOptions,
+                        verifier: Verifier=None, round_robin: bool=False):
+    '''Download episodes on a pool of worker threads, queuing them from the calling thread.
+
+    Arguments:
+        jobs: An iterable of the (group, state store, ResultLog, index, episode, file name) of each episode.
+        total_files: The number of episodes to download, or None if it is not known.
+        emit: The function the events are passed to.
+        workers: The number of worker threads.
+        host_limit: The maximum number of connections to the same host at once.
+        options: The transfer settings.
+        verifier: If supplied, the verifier the downloaded files are queued with.
+        round_robin: Whether the podcasts take turns.
+    '''
+
+    # The segmented downloads take their extra connections from the scheduler's per-host limit,
+    # and from the workers, so the ranges do not add to the connections open at once
+    slots = options.host_slots or HostSlots(host_limit, workers)
+    options = options.copy(host_slots=slots)
+
+    # Files are numbered in the order they start downloading
+    counter = {'started': 0}
+    counter_lock = threading.Lock()
+
+    def run(job: tuple, reservation):
+        if _is_cancelled(options):
+            options.disk_space.release(reservation)
+            return
+
+        with counter_lock:
+            counter['started'] += 1
+            events = _job_events(job, emit, counter['started'], total_files)
+
+        _download_job(job, events, options, verifier, reservation)
+
+    scheduler = Scheduler(workers, ordered=not round_robin, slots=slots)
+    scheduler.start()
+
+    try:
+        for job in jobs:
+            if _is_cancelled(options):
+                break
+
+            # The space is set aside before the job is queued, so a job waiting for room on the
+            # disk does not hold a worker or a connection to its host meanwhile
+            reserved, reservation = _reserve_space(job, emit, options)
+            if not reserved:
+                continue
+
+            group, state, download_progress, index, episode, filename = job
+            host = url_host(episode.url)
+
+            # With round-robin, each podcast is its own group, so the podcasts take turns
+            scheduler.submit_group(group if round_robin else host, host, run, job, reservation)
+    finally:
+        # If the feed can not be parsed, the episodes queued so far are still downloaded
+        scheduler.close()
+        scheduler.join()
+
+def _reserve_space(job: tuple, emit, options: TransferOptions) -> tuple:
+    '''Set aside the disk space for the episode of a job of _download_jobs (see modules.space.DiskSpace).
+
+    The space is set aside before the STARTED event, so the time spent waiting for it
+    does not count towards the time to the first byte.
+
+    Returns (True, the reservation), or (False, None) if the episode does not fit on the disk
+    or the download was cancelled while waiting. The episode's result is then final.
+
+    Arguments:
+        job: The (group, state store, ResultLog, index, episode, file name) of the episode.
+        emit: The function the FAILED event is passed to.
+        options: The transfer settings.
+    '''
+
+    group, state, download_progress, index, episode, filename = job
+    filepath = os.path.join(state.output_dir, filename)
+
+    try:
+        return True, options.disk_space.reserve(filepath + PART_SUFFIX, episode.length, options.check_cancelled)
+    except DownloadCancelled as e:
+        EpisodeEvents(emit, episode, filename, state.output_dir).failed(e)
+        download_progress.finish(index, _cancelled_result(episode, filename, state.output_dir))
+    except Exception as e:
+        EpisodeEvents(emit, episode, filename, state.output_dir).failed(e)
+        download_progress.finish(index, DownloadResult(filename, error=str(e), guid=episode.guid,
+                                                       feed=state.output_dir))
+
+    return False, None
+
+def _job_events(job: tuple, emit, number: int, total_files) -> EpisodeEvents:
+    '''Returns the EpisodeEvents for a job of _download_jobs, emitting its STARTED event.
+
+    Arguments:
+        job: The (group, state store, ResultLog, index, episode, file name) of the episode.
+        emit: The function the events are passed to.
+        number: The number of the download, in the order they started.
+        total_files: The number of episodes to download, or None if it is not known.
+    '''
+
+    group, state, download_progress, index, episode, filename = job
+
+    events = EpisodeEvents(emit, episode, filename, state.output_dir)
+    events.started(number, total_files)
+
+    return events
+
+def _download_job(job: tuple, events: EpisodeEvents, options: TransferOptions, verifier: Verifier=None,
+                  reservation=None):
+    '''Download the episode of a job of _download_jobs, storing its result.
+
+    Arguments:
+        job: The (group, state store, ResultLog, index, episode, file name) of the episode.
+        events: The EpisodeEvents for the download, whose STARTED event has been emitted.
+        options: The transfer settings.
+        verifier: If supplied, the verifier the downloaded file is queued with.
+        reservation: The disk space set aside for the file (see _reserve_space()).
+    '''
+
+    group, state, download_progress, index, episode, filename = job
+
+    _store_result(download_progress, index, _download_episode(
+        episode, state.output_dir, filename, state, events, options,
+        verifier, (state, download_progress, index, episode, filename), reservation
+    ), verifier)
+
+def _check_downloads(verifier: Verifier, emit, retry: bool, wait: bool=True) -> list:
+    '''Wait for the downloaded files to be checked, recording the files that pass
+    and returning the downloads of the files that fail.
+
+    Must be called on the thread that owns the relay of the events.
+
+    Arguments:
+        verifier: The verifier the downloads were queued with.
+        emit: The function the WARNING and FAILED events are passed to.
+        retry: Whether the files that fail are downloaded again. If not, their
+               results are final.
+        wait: Whether to wait for every queued check (False to only handle the checks
+              which have already finished).
+
+    Returns the (state store, ResultLog, index, episode, file name) of each
+    file that failed the check, if retry is True.
+    '''
+
+    retries = []
+
+    for key, verification in (verifier.wait() if wait else verifier.collect()):
+        state, download_progress, index, episode, filename = key
+
+        if verification.error is None:
+            if verification.warning is not None:
+                EpisodeEvents(emit, episode, filename, state.output_dir).warning(verification.warning)
+
+            state.record(episode, filename, verification.size, verification.digest, verification.mtime)
+            download_progress.finish(index)
+            continue
+
+        EpisodeEvents(emit, episode, filename, state.output_dir).failed(verification.error)
+
+        result = DownloadResult(filename, error=str(verification.error), guid=episode.guid,
+                                feed=state.output_dir)
+
+        if retry:
+            download_progress.update(index, result)
+            retries.append(key)
+        else:
+            download_progress.finish(index, result)
+
+    return retries
+
+class _LengthRecorder(object):
+    '''A progress function for download_file which remembers the size of the file given
+    by the server, and passes the progress on to another progress function.'''
+
+    def __init__(self, progress=None):
+        '''Create a _LengthRecorder object.
+
+        Arguments:
+            progress: The progress function to pass the progress on to, if any.
+        '''
+
+        # The size of the file given by the server, or None if it is not known
+        self.length = None
+
+        self._progress = progress
+
+    def __call__(self, size: int, position: int, length, latency: float=None):
+        self.length = length
+
+        if self._progress is not None:
+            self._progress(size, position, length, latency)
+
+class _EventRelay(object):
+    '''Passes events to a handler, always on the thread that created the relay.
+
+    Events emitted on the creating thread are handled straight away. Events emitted
+    on other threads (such as download workers) are queued, and handled in order on
+    the creating thread while it is in run(). So the handler does not need to be
+    thread safe (for example, when it updates a GUI).
+    '''
+
+    def __init__(self, handler):
+        '''Create an _EventRelay object.
+
+        Arguments:
+            handler: The function the events are passed to.
+        '''
+
+        self._handler = handler
+        self._thread = threading.get_ident()
+
+        # Events from the other threads. None marks the end of the work.
+        self._queue = queue.Queue()
+
+    def emit(self, event):
+        '''Pass an event to the handler. Safe to call from any thread.
+
+        Arguments:
+            event: The event.
+        '''
+
+        if threading.get_ident() == self._thread:
+            self._handler(event)
         else:
-            # Keep the file name as is
-            filename = str_to_filename(episode.file_name)
+            self._queue.put(event)
+
+    def run(self, work, poll=None):
+        '''Run a function on a separate thread, handling its events on this thread until it returns.
+
+        Re-raises any exception raised by the function.
+
+        Arguments:
+            work: The function to run, without arguments.
+            poll: If supplied, a function called on this thread after each event is handled,
+                  such as to collect work finished on other threads.
+        '''
+
+        errors = []
+
+        def run():
+            try:
+                work()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self._queue.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+
+        # Handle the events on this thread
+        event = self._queue.get()
+        while event is not None:
+            self._handler(event)
+
+            if poll is not None:
+                poll()
+
+            event = self._queue.get()
+
+        if errors:
+            raise errors[0]
+
+def _event_handler(print_progress, on_event, on_result=None):
+    '''Returns a function which passes each event to on_event, and its progress message to print_progress.
+    The download results passed through the same relay go to on_result.
+
+    Arguments:
+        print_progress: The function for handling the progress output.
+        on_event: The function for handling the events, or None.
+        on_result: The function for handling the modules.results.DownloadResult objects, or None.
+    '''
+
+    print_event = print_adapter(print_progress)
+
+    def handle(event: DownloadEvent):
+        if isinstance(event, DownloadResult):
+            if on_result is not None:
+                on_result(event)
+            return
+
+        if on_event is not None:
+            on_event(event)
+
+        print_event(event)
+
+    return handle
+
+def _cancelled_result(episode: Episode, filename: str, output_dir: str) -> DownloadResult:
+    '''Returns the result for an episode that was not downloaded because the download was cancelled.
+
+    Arguments:
+        episode: The episode.
+        filename: The file name the episode would have been saved as.
+        output_dir: The full path of the output directory.
+    '''
+
+    return DownloadResult(filename, cancelled=True, guid=episode.guid, feed=output_dir)
+
+def _is_cancelled(options: TransferOptions) -> bool:
+    '''Returns whether the downloads have been cancelled with options.cancel.'''
+
+    return options.cancel is not None and options.cancel.is_set()
+
+#region ASYNC
+
+# asyncio is slow to import, so it is only imported by the async functions
+
+async def podcast_download_async(rss, output_dir: str='', rename: bool=False,
+                                 limit=4, resync: bool=False, options: TransferOptions=None,
+                                 selection=None):
+    '''The asyncio counterpart of podcast_download.
+
+    An async generator that downloads all episodes in a podcast and yields the
+    modules.results.DownloadResult for each episode as soon as it finishes
+    (in the order they finish, not the feed order), as iter_podcast_download does.
+    Episodes that were already downloaded are skipped in the same way as podcast_download.
+
+    Example:
+        async for result in podcast_download_async(rss, 'download', limit=8):
+            print(result.file, result.downloaded)
+
+    The blocking network and file operations are run in the event loop's default
+    executor one chunk at a time, so the event loop is never blocked and a
+    download can be cancelled between chunks.
+
+    Arguments:
+        rss: The podcast RSS, or an iterable of Episode objects such as
+             modules.podcast.iter_remote_episodes(), which is read in the executor.
+        output_dir: The output directory name (or the same directory if an empty string is supplied).
+        rename: Whether to rename the downloaded file to the name of the to the episode.
+        limit: The maximum number of files to download at once.
+               Either a number or an asyncio.Semaphore, which may be shared with other downloads.
+        resync: If True, download every episode again, even if it was downloaded before.
+        options: The settings for the file downloads (see modules.transfer.TransferOptions).
+        selection: If supplied, a modules.selection.EpisodeSelection choosing the episodes to download.
+    '''
+
+    import asyncio
+
+    options = options or TransferOptions()
+
+    if isinstance(limit, asyncio.Semaphore):
+        semaphore = limit
+    else:
+        semaphore = asyncio.Semaphore(max(1, limit))
 
+    loop = asyncio.get_event_loop()
+
+    # Set the download path
+    output_dir = await loop.run_in_executor(None, _prepare_output_dir, output_dir)
+
+    # Load the record of the episodes downloaded by earlier runs
+    state = await loop.run_in_executor(None, StateStore, output_dir)
+    if resync:
+        state.clear()
+
+    # The downloaded files are checked on a separate pool of threads
+    verifier = Verifier(options.verify_workers) if options.verify_workers > 0 else None
+
+    # The downloads set aside their disk space one at a time, in the order they were queued
+    reserve_lock = asyncio.Lock()
+
+    async def download(episode: Episode, filename: str) -> DownloadResult:
         filepath = os.path.join(output_dir, filename)
 
         try:
-            request.urlretrieve(episode.url, filepath)
+            # A file which fails the check is downloaded once more
+            for attempt in range(2):
+                # Set aside the disk space for the file, or fail if it does not fit. This happens
+                # before taking a place in the download limit, so the place is not held while waiting.
+                async with reserve_lock:
+                    reserving = loop.run_in_executor(None, options.disk_space.reserve, filepath + PART_SUFFIX,
+                                                     episode.length, options.check_cancelled)
+
+                    try:
+                        reservation = await asyncio.shield(reserving)
+                    except asyncio.CancelledError:
+                        # The space is given back as soon as the reservation returns
+                        reserving.add_done_callback(functools.partial(_release_reserved, options.disk_space))
+                        raise
+
+                try:
+                    async with semaphore:
+                        size, server_length = await _stream_to_file_async(episode, filepath, options)
+                finally:
+                    options.disk_space.release(reservation)
+
+                if verifier is None:
+                    state.record(episode, filename, size)
+                    break
+
+                # The file is checked outside the download limit, so the next download can start.
+                # It is recorded as soon as it passes, even if the download is cancelled meanwhile.
+                check = verifier.executor.submit(verifier.verify, filepath, size, episode.length, server_length)
+                check.add_done_callback(functools.partial(_record_verified, state, episode, filename))
+
+                verification = await asyncio.wrap_future(check)
 
-            files_downloaded += 1
-            download_progress.append({
-                'file': filename,
-                'downloaded': True,
-            })
+                if verification.error is None:
+                    break
+
+                if attempt:
+                    raise verification.error
+
+            return DownloadResult(filename, downloaded=True, guid=episode.guid, feed=output_dir)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print_progress(f'  ERROR -> {str(e)}')
-
-            file_errors += 1
-            download_progress.append({
-                'file': filename,
-                'downloaded': False,
-                'error': str(e),
-            })
-
-    # Return data about the download process
-    return {
-        'total_items': len(items),
-        'total_downloads': files_downloaded,
-        'total_errors': file_errors,
-        'downloads': download_progress,
-    }
+            return DownloadResult(filename, error=str(e), guid=episode.guid, feed=output_dir)
+
+    tasks = []
+
+    # Scan the output directory once, off the event loop
+    index = await loop.run_in_executor(None, DirectoryIndex, output_dir)
+    planner = FilenamePlanner(state, rename, index)
+
+    # The results of the <item> elements which can not be parsed
+    invalid = []
+
+    episodes = _iter_episodes_async(rss, selection, invalid, output_dir)
+
+    try:
+        async for episode in episodes:
+            while invalid:
+                yield invalid.pop(0)
+
+            filename = planner.assign(episode)
+
+            if not resync and _is_present(episode, filename, state, index):
+                yield DownloadResult(filename, skipped=True, guid=episode.guid, feed=output_dir)
+            else:
+                tasks.append(asyncio.ensure_future(download(episode, filename)))
+
+        while invalid:
+            yield invalid.pop(0)
+
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # Stop the remaining downloads if the caller stops iterating early
+        for task in tasks:
+            task.cancel()
+
+        # Close a streamed feed that was not read to the end
+        await episodes.aclose()
+
+        # Wait for the cancelled downloads to stop using their files
+        if tasks:
+            await asyncio.wait(tasks)
+
+        if verifier is not None:
+            # Record the files that were being checked when the download was interrupted
+            await loop.run_in_executor(None, verifier.close)
+
+        # Save the record of the downloaded episodes, even if the download was interrupted
+        state.save()
+
+async def _iter_episodes_async(rss, selection=None, invalid: list=None, feed: str=None):
+    '''Yields the episodes of a podcast RSS, or of an iterable of Episode objects.
+
+    An iterable such as modules.podcast.iter_remote_episodes() blocks while it reads
+    the feed, so each episode is read from it in the event loop's default executor.
+
+    Arguments:
+        rss: The podcast RSS, or an iterable of Episode objects.
+        selection: If supplied, a modules.selection.EpisodeSelection choosing the episodes.
+        invalid: If supplied, the <item> elements which can not be parsed are skipped,
+                 and their error results are added to this list (see _parse_items()).
+        feed: The full path of the podcast's output directory, for the error results.
+    '''
+
+    if hasattr(rss, 'findall'):
+        items = rss.findall('channel/item')
+        if selection is not None:
+            items = selection.select_items(items)
+
+        for item in items:
+            try:
+                episode = Episode(item)
+            except (XmlElementNotFound, XmlElementNotUnique) as e:
+                if invalid is None:
+                    raise
+
+                invalid.append(_invalid_item_result(item, e, feed))
+                continue
+
+            yield episode
+
+        return
+
+    import asyncio
+
+    if selection is not None:
+        rss = selection.select(rss)
+
+    loop = asyncio.get_event_loop()
+    episodes = iter(rss)
+
+    # Marks the end of the episodes
+    end = object()
+
+    try:
+        while True:
+            episode = await _wait_in_executor(loop, next, episodes, end)
+            if episode is end:
+                return
+
+            yield episode
+    finally:
+        # Close the connection of a streamed feed that was not read to the end
+        close = getattr(episodes, 'close', None)
+        if close is not None:
+            close()
+
+def _release_reserved(disk_space, future):
+    '''Releases the disk space set aside by a reservation that was abandoned while it was waiting.
+
+    Arguments:
+        disk_space: The modules.space.DiskSpace.
+        future: The future of the DiskSpace.reserve() call.
+    '''
+
+    if not future.cancelled() and future.exception() is None:
+        disk_space.release(future.result())
+
+async def _wait_in_executor(loop, function, *args):
+    '''Runs a blocking function in the event loop's default executor and returns its result.
+
+    The function can not be stopped once it has started, so if the awaiting task is
+    cancelled, the cancellation is only raised once the function has returned. The
+    caller can then safely close whatever the function was using.
+
+    Arguments:
+        loop: The event loop.
+        function: The function.
+        args: The arguments of the function.
+    '''
+
+    import asyncio
+
+    future = loop.run_in_executor(None, function, *args)
+
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        while not future.done():
+            try:
+                await asyncio.wait([future])
+            except asyncio.CancelledError:
+                pass
+
+        raise
+
+def _record_verified(state: StateStore, episode: Episode, filename: str, check):
+    '''Record a downloaded file in the state store if it passed the check.
+    A done callback for the future of Verifier.verify().
+
+    Arguments:
+        state: The state store.
+        episode: The episode.
+        filename: The file name the episode was saved as.
+        check: The finished future.
+    '''
+
+    if check.cancelled() or check.exception() is not None:
+        return
+
+    verification = check.result()
+
+    if verification.error is None:
+        state.record(episode, filename, verification.size, verification.digest, verification.mtime)
+
+async def _stream_to_file_async(episode: Episode, filepath: str, options: TransferOptions) -> tuple:
+    '''Stream a remote file to disk without blocking the event loop.
+
+    Unfinished downloads are resumed, and temporary errors retried,
+    in the same way as podcast_download. Segmented downloads (see TransferOptions)
+    run on a thread of the executor.
+
+    Returns the size of the file, and the size given by the server (None if it is not known).
+
+    Arguments:
+        episode: The episode to download.
+        filepath: The path to save the file to.
+        options: The transfer settings.
+    '''
+
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+
+    if options.segments > 1:
+        progress = _LengthRecorder()
+        size = await loop.run_in_executor(None, download_file, episode.url, filepath, options,
+                                          episode.length, progress)
+
+        return size, progress.length
+
+    host = url_host(episode.url)
+    attempt = 0
+
+    while True:
+        attempt += 1
+        options.breaker.check(host)
+
+        download = PartialDownload(episode.url, filepath, options, episode.length)
+
+        try:
+            # If the download is cancelled, the chunk being read is finished before the file is closed
+            await _wait_in_executor(loop, download.open)
+
+            while await _wait_in_executor(loop, download.read_chunk):
+                pass
+
+            await _wait_in_executor(loop, download.finish)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay = options.retry.handle_failure(attempt, e, host, options.breaker)
+            if delay is None:
+                raise
+
+            await asyncio.sleep(delay)
+            continue
+        finally:
+            download.close()
+
+        options.breaker.record_success(host)
+
+        return download.position, download.total
+
+#endregion
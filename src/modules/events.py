@@ -0,0 +1,289 @@
+# Structured progress events for episode downloads.
+
+import threading
+import time
+
+from .scheduler import url_host
+
+# The kinds of event, in the order they happen to a download
+# The episode is waiting to be downloaded
+QUEUED = 'queued'
+# The episode was already downloaded by an earlier run
+SKIPPED = 'skipped'
+# The download has started
+STARTED = 'started'
+# The server has responded (the first response, if the download is retried)
+RESPONSE = 'response'
+# Some bytes have been received
+BYTES = 'bytes'
+# The file is complete
+FINISHED = 'finished'
+# The file was kept, but something about it is unexpected (such as its length in the feed)
+WARNING = 'warning'
+# The download has failed
+FAILED = 'failed'
+
+EVENT_KINDS = (QUEUED, SKIPPED, STARTED, RESPONSE, BYTES, FINISHED, WARNING, FAILED)
+
+# The shortest time in seconds between two BYTES events for the same download
+BYTES_INTERVAL = 0.1
+
+class DownloadEvent(object):
+    '''Something that happened to an episode download.
+
+    Every event has a kind, a timestamp and the episode's title, URL, host and
+    file name. The other fields are None unless the kind of event sets them:
+        guid: The episode GUID (set by podcast_download and batch_download for every event).
+        feed: The full path of the podcast's output directory (likewise).
+        date: The <pubDate> of the episode (QUEUED, SKIPPED).
+        number: The number of the download, in the order they started (STARTED and later).
+        total: The total number of files to download, if known (STARTED and later).
+        size: The bytes received since the last BYTES event (BYTES), or the size of the file (FINISHED).
+        position: The bytes received so far for the file (RESPONSE, BYTES).
+        length: The expected size of the file, if known (from the feed for QUEUED and SKIPPED,
+                and from the server for RESPONSE and BYTES).
+        elapsed: The seconds since the download started. For RESPONSE, this is the
+                 time to the first byte.
+        latency: The seconds from sending the request to receiving the response headers (RESPONSE).
+        error: The error message (FAILED), or the warning message (WARNING).
+    '''
+
+    __slots__ = ('kind', 'time', 'title', 'url', 'host', 'file', 'guid', 'feed', 'date', 'number', 'total',
+                 'size', 'position', 'length', 'elapsed', 'latency', 'error')
+
+    def __init__(self, kind: str, title: str, url: str, host: str, file: str, **fields):
+        '''Create a DownloadEvent object.
+
+        Arguments:
+            kind: The kind of event (see EVENT_KINDS).
+            title: The episode title.
+            url: The enclosure URL.
+            host: The host of the enclosure URL.
+            file: The file name the episode is saved as.
+            fields: The other fields, as keyword arguments.
+        '''
+
+        self.kind = kind
+        self.time = time.time()
+        self.title = title
+        self.url = url
+        self.host = host
+        self.file = file
+        self.guid = fields.pop('guid', None)
+        self.feed = fields.pop('feed', None)
+        self.date = fields.pop('date', None)
+        self.number = fields.pop('number', None)
+        self.total = fields.pop('total', None)
+        self.size = fields.pop('size', None)
+        self.position = fields.pop('position', None)
+        self.length = fields.pop('length', None)
+        self.elapsed = fields.pop('elapsed', None)
+        self.latency = fields.pop('latency', None)
+        self.error = fields.pop('error', None)
+
+        if fields:
+            raise TypeError(f'Unknown event fields: {", ".join(fields)}')
+
+    def as_dict(self) -> dict:
+        '''Returns the event as a dict, leaving out the fields that are not set.'''
+
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self):
+        return f'DownloadEvent({self.kind!r}, {self.title!r})'
+
+class EpisodeEvents(object):
+    '''Emits the events for one episode download.
+
+    The progress() method is passed to modules.transfer.download_file. It turns
+    the per-chunk callbacks into a RESPONSE event and BYTES events, which are
+    coalesced so there is at most one every BYTES_INTERVAL seconds.
+    '''
+
+    def __init__(self, emit, episode, filename: str, feed: str=None):
+        '''Create an EpisodeEvents object.
+
+        Arguments:
+            emit: The function the events are passed to.
+            episode: The modules.podcast.Episode being downloaded.
+            filename: The file name the episode is saved as.
+            feed: The full path of the podcast's output directory.
+        '''
+
+        self._emit = emit
+        self._episode = episode
+        self._filename = filename
+        self._feed = feed
+        self._host = url_host(episode.url)
+
+        self._started = None
+        self._responded = False
+        self._last_bytes = 0.0
+
+        # The bytes received since the last BYTES event
+        self._pending = 0
+        self._position = 0
+        self._length = None
+
+        # Segmented downloads report progress from several threads
+        self._lock = threading.Lock()
+
+    def emit(self, kind: str, **fields):
+        '''Emit an event for the episode.
+
+        Arguments:
+            kind: The kind of event.
+            fields: The other fields of the event, as keyword arguments.
+        '''
+
+        self._emit(DownloadEvent(kind, self._episode.title, self._episode.url, self._host,
+                                 self._filename, guid=self._episode.guid, feed=self._feed, **fields))
+
+    def started(self, number: int, total):
+        '''Emit a STARTED event.
+
+        Arguments:
+            number: The number of the download, in the order they started.
+            total: The total number of files to download, or None if it is not known.
+        '''
+
+        self._started = time.monotonic()
+        self._last_bytes = self._started
+        self.emit(STARTED, number=number, total=total)
+
+    def progress(self, size: int, position: int, length, latency: float=None):
+        '''Record the progress of the download. See modules.transfer.download_file.
+
+        Arguments:
+            size: The bytes received since the last call (0 when the response arrives).
+            position: The bytes received so far for the file.
+            length: The expected size of the file, or None if it is not known.
+            latency: The seconds from sending the request to receiving the response headers
+                     (only when the response arrives).
+        '''
+
+        with self._lock:
+            now = time.monotonic()
+
+            if not self._responded:
+                self._responded = True
+                self.emit(RESPONSE, position=position, length=length, elapsed=self._elapsed(now),
+                          latency=latency)
+
+            self._pending += size
+            self._position = position
+            self._length = length
+
+            if self._pending and now - self._last_bytes >= BYTES_INTERVAL:
+                self._flush(now)
+
+    def finished(self, size: int):
+        '''Emit the last BYTES event and a FINISHED event.
+
+        Arguments:
+            size: The size of the file.
+        '''
+
+        now = time.monotonic()
+        self._flush(now)
+        self.emit(FINISHED, size=size, elapsed=self._elapsed(now))
+
+    def warning(self, message: str):
+        '''Emit a WARNING event.
+
+        Arguments:
+            message: The warning message.
+        '''
+
+        self.emit(WARNING, error=message)
+
+    def failed(self, error: Exception):
+        '''Emit the last BYTES event and a FAILED event.
+
+        Arguments:
+            error: The error.
+        '''
+
+        now = time.monotonic()
+        self._flush(now)
+        self.emit(FAILED, elapsed=self._elapsed(now), error=str(error))
+
+    def _flush(self, now: float):
+        '''Emit a BYTES event for the bytes received since the last one, if there are any.'''
+
+        if self._pending:
+            self.emit(BYTES, size=self._pending, position=self._position, length=self._length,
+                      elapsed=self._elapsed(now))
+            self._pending = 0
+
+        self._last_bytes = now
+
+    def _elapsed(self, now: float):
+        '''Returns the seconds since the download started, or None if it has not started.'''
+
+        return now - self._started if self._started is not None else None
+
+def progress_message(number: int, total, title: str) -> str:
+    '''Returns the progress message for the start of a download.
+
+    Arguments:
+        number: The number of the file.
+        total: The total number of files, or None if it is not known yet.
+        title: The episode title.
+    '''
+
+    if total is None:
+        return f'Downloading {str(number)}: "{title}"'
+    else:
+        return f'Downloading {str(number)} of {str(total)}: "{title}"'
+
+def format_event(event: DownloadEvent):
+    '''Returns the progress message for an event, or None if the event has no message.
+
+    Arguments:
+        event: The event.
+    '''
+
+    if event.kind == STARTED:
+        return progress_message(event.number, event.total, event.title)
+    elif event.kind == WARNING:
+        return f'  WARNING -> "{event.title}": {event.error}'
+    elif event.kind == FAILED:
+        return f'  ERROR -> "{event.title}": {event.error}'
+
+    return None
+
+def print_adapter(print_progress):
+    '''Returns an event handler which passes the progress messages of the events to a
+    print_progress function, in the same format as before the events existed.
+
+    Arguments:
+        print_progress: The function for handling the progress output.
+    '''
+
+    def handle(event: DownloadEvent):
+        message = format_event(event)
+
+        if message is not None:
+            print_progress(message)
+
+    return handle
+
+def fan_out(*handlers):
+    '''Returns an event handler which passes each event to every handler, in order.
+    Handlers which are None are left out.
+
+    Example:
+        podcast_download(rss, 'download', on_event=fan_out(MetricsCollector(), Catalog()))
+
+    Arguments:
+        handlers: The event handlers.
+    '''
+
+    handlers = [handler for handler in handlers if handler is not None]
+
+    def handle(event: DownloadEvent):
+        for handler in handlers:
+            handler(event)
+
+    return handle
@@ -1,11 +1,13 @@
 # Classes, functions and constants for the Qt gui.
 
+import collections
+import threading
+
 from PySide2 import QtCore, QtGui, QtWidgets
 from PySide2.QtWidgets import *
-from defusedxml import ElementTree
 
-from modules.xml import get_unique_xml_element, parse_remote_xml
-from modules.download import podcast_download
+# The download modules are imported when the first download starts, so the window opens sooner
+from modules import events
 
 #region CONSTANTS
 
@@ -20,6 +22,14 @@ MAINFORM_STYLESHEET = '''
     }
 '''
 
+# The podcast sources
+SOURCE_REMOTE = 'Remote RSS file'
+SOURCE_LOCAL = 'Local RSS file'
+SOURCE_OPML = 'OPML file (several podcasts)'
+
+# The interval in milliseconds between updates of the progress display
+PROGRESS_INTERVAL = 100
+
 #endregion
 
 #region WIDGET_CLASSES
@@ -44,17 +54,31 @@ class ParallelWidgets(QtWidgets.QWidget):
         self.setLayout(self.layout)
 
 class ProgressDisplay(QtWidgets.QWidget):
-    '''The main output widget.'''
+    '''The main output widget.
+
+    Appended text is buffered and added to the end of the log in one batch
+    every PROGRESS_INTERVAL milliseconds, so a long download with thousands of
+    messages does not redraw the log for every line.
+    '''
 
     def __init__(self, parent=None):
         QtWidgets.QWidget.__init__(self, parent)
 
-        # The output is displayed as a text box
-        self.output = QtWidgets.QTextEdit()
+        # The output is displayed as a plain text log
+        self.output = QtWidgets.QPlainTextEdit()
 
         # Make the progress display read only.
         self.output.setReadOnly(True)
 
+        # The text appended since the last update
+        self.pending = []
+
+        # Apply the pending text on a timer
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(PROGRESS_INTERVAL)
+        self.timer.timeout.connect(self.flush_progress)
+        self.timer.start()
+
         # Widget layout
         self.layout = QtWidgets.QVBoxLayout()
         self.layout.addWidget(self.output)
@@ -68,37 +92,397 @@ class ProgressDisplay(QtWidgets.QWidget):
             - end: also automatically append this string (a line break by default).
         '''
 
-        new_output = self.output.toPlainText() + message + end
+        self.pending.append(message + end)
+
+    def flush_progress(self):
+        '''Adds the pending text to the end of the progress box.'''
+
+        if not self.pending:
+            return
 
-        self.output.setText(new_output)
+        text = ''.join(self.pending)
+        self.pending = []
+
+        # Keep following the end of the log, unless the user has scrolled up
+        scroll_bar = self.output.verticalScrollBar()
+        at_end = scroll_bar.value() == scroll_bar.maximum()
+
+        cursor = QtGui.QTextCursor(self.output.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.insertText(text)
+
+        if at_end:
+            scroll_bar.setValue(scroll_bar.maximum())
 
     def clear_progress(self):
         '''Clears the progress box.'''
 
-        self.output.setText('')
+        self.pending = []
+        self.output.clear()
+
+class EpisodeRow(object):
+    '''The progress of one episode in the EpisodeTableModel.'''
+
+    __slots__ = ('title', 'file', 'size', 'position', 'speed', 'status', 'error', 'updated')
+
+    def __init__(self, title: str, file: str):
+        self.title = title
+        self.file = file
+
+        # The size of the file in bytes, from the feed until the server sends it (None if unknown)
+        self.size = None
+
+        # The bytes downloaded so far
+        self.position = 0
+
+        # The current speed in bytes per second (None if it is not downloading)
+        self.speed = None
+
+        self.status = ''
+        self.error = None
+
+        # The time of the latest RESPONSE or BYTES event, for working out the speed
+        self.updated = None
+
+    def update(self, event: events.DownloadEvent):
+        '''Applies a download event to the row.'''
+
+        if event.kind == events.QUEUED:
+            self.status = 'Queued'
+            self.size = event.length
+        elif event.kind == events.SKIPPED:
+            self.status = 'Already downloaded'
+            self.size = event.length
+        elif event.kind == events.STARTED:
+            self.status = 'Starting'
+        elif event.kind == events.RESPONSE:
+            self.status = 'Downloading'
+            self.size = event.length or self.size
+            self.position = event.position or 0
+            self.updated = event.time
+        elif event.kind == events.BYTES:
+            if self.updated is not None and event.time > self.updated:
+                self.speed = event.size / (event.time - self.updated)
+
+            self.size = event.length or self.size
+            self.position = event.position
+            self.updated = event.time
+        elif event.kind == events.FINISHED:
+            self.status = 'Done'
+            self.size = self.position = event.size
+            self.speed = None
+        elif event.kind == events.FAILED:
+            self.status = 'Failed'
+            self.error = event.error
+            self.speed = None
+
+class EpisodeTableModel(QtCore.QAbstractTableModel):
+    '''A table with a row for each episode in a download.
+
+    The rows are updated from download events in batches (see apply_events()),
+    so a batch causes at most one row insertion and one repaint, however many
+    events it holds. The view only asks for the rows that are visible.
+    '''
+
+    COLUMNS = ('Title', 'Size', 'Downloaded', 'Speed', 'Status')
+
+    def __init__(self, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+
+        self.rows = []
+
+        # (URL, file name) -> row number
+        self.row_numbers = {}
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.COLUMNS[section]
+
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = self.rows[index.row()]
+        column = index.column()
+
+        if role == QtCore.Qt.DisplayRole:
+            if column == 0:
+                return row.title
+            elif column == 1:
+                return format_size(row.size) if row.size else ''
+            elif column == 2:
+                return format_size(row.position) if row.position else ''
+            elif column == 3:
+                return f'{format_size(row.speed)}/s' if row.speed else ''
+            else:
+                return row.status
+        elif role == QtCore.Qt.ToolTipRole:
+            return row.error or row.file
+        elif role == QtCore.Qt.TextAlignmentRole and column in (1, 2, 3):
+            return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        elif role == QtCore.Qt.ForegroundRole and row.error:
+            return QtGui.QColor('red')
+
+        return None
+
+    def clear(self):
+        '''Removes all rows.'''
+
+        self.beginResetModel()
+        self.rows = []
+        self.row_numbers = {}
+        self.endResetModel()
+
+    def apply_events(self, batch: list):
+        '''Applies a batch of download events, adding rows for new episodes.
+
+        Arguments:
+         - batch: the modules.events.DownloadEvent objects, in the order they happened.
+        '''
+
+        new_rows = []
+
+        # The first and last existing rows that changed
+        first = last = None
+
+        for event in batch:
+            key = (event.url, event.file)
+            number = self.row_numbers.get(key)
+
+            if number is None:
+                row = EpisodeRow(event.title, event.file)
+                self.row_numbers[key] = len(self.rows) + len(new_rows)
+                new_rows.append(row)
+            elif number >= len(self.rows):
+                row = new_rows[number - len(self.rows)]
+            else:
+                row = self.rows[number]
+                first = number if first is None else min(first, number)
+                last = number if last is None else max(last, number)
+
+            row.update(event)
+
+        if new_rows:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(new_rows) - 1)
+            self.rows.extend(new_rows)
+            self.endInsertRows()
+
+        if first is not None:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, len(self.COLUMNS) - 1))
+
+class EpisodeTable(QtWidgets.QWidget):
+    '''The per-episode progress widget.
+
+    Download events can be added from any thread. They are queued, and applied
+    to the table in one batch every PROGRESS_INTERVAL milliseconds on the GUI thread.
+    '''
+
+    def __init__(self, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+
+        self.model = EpisodeTableModel(self)
+
+        self.view = QtWidgets.QTableView()
+        self.view.setModel(self.model)
+        self.view.setWordWrap(False)
+        self.view.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+
+        # Fixed row heights, so the view never measures rows that are not visible
+        vertical_header = self.view.verticalHeader()
+        vertical_header.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        vertical_header.setDefaultSectionSize(self.view.fontMetrics().height() + 6)
+        vertical_header.hide()
+
+        self.view.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+
+        # The events added since the last update (appending to a deque is thread safe)
+        self.events = collections.deque()
+
+        # Apply the queued events on a timer
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(PROGRESS_INTERVAL)
+        self.timer.timeout.connect(self.flush_events)
+        self.timer.start()
+
+        # Widget layout
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.view)
+        self.setLayout(self.layout)
+
+    def add_event(self, event: events.DownloadEvent):
+        '''Queues a download event. Safe to call from any thread.'''
+
+        self.events.append(event)
+
+    def flush_events(self):
+        '''Applies the queued events to the table.'''
+
+        batch = []
+        while self.events:
+            batch.append(self.events.popleft())
+
+        if batch:
+            self.model.apply_events(batch)
+
+    def clear(self):
+        '''Removes all episodes from the table.'''
+
+        self.events.clear()
+        self.model.clear()
+
+class DownloadWorker(QtCore.QObject):
+    '''Fetches the podcast and downloads the episodes on a worker thread.
+
+    The worker only talks to the GUI through its signals, which Qt delivers on the
+    GUI thread. Move it to a QThread and connect the thread's started signal to run().
+    '''
+
+    # A progress message
+    progress = QtCore.Signal(str)
+
+    # The podcast could not be fetched or parsed (the error message)
+    feed_error = QtCore.Signal(str)
+
+    # The download is complete (the podcast_download or batch_download result)
+    done = QtCore.Signal(object)
+
+    # The download stopped with an unexpected error (the error message)
+    failed = QtCore.Signal(str)
+
+    # The worker has stopped, after any of the signals above
+    finished = QtCore.Signal()
+
+    def __init__(self, settings: dict, feed_cache, on_event=None):
+        '''Initializes the worker.
+
+        Arguments:
+         - settings: the form values (source, location, delay, bandwidth, workers,
+                     download_to, rename and resync).
+         - feed_cache: the modules.cache.FeedCache for remote RSS files.
+         - on_event: a thread safe function for the download events (see modules.events).
+        '''
+
+        QtCore.QObject.__init__(self)
+
+        self.settings = settings
+        self.feed_cache = feed_cache
+        self.on_event = on_event
+
+        # Set from the GUI thread to stop the download
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        '''Stops the download. Safe to call from any thread.'''
+
+        self.cancel_event.set()
+
+    @QtCore.Slot()
+    def run(self):
+        '''Fetches the podcast and downloads the episodes.'''
+
+        settings = self.settings
+
+        try:
+            from defusedxml import ElementTree
+
+            from modules.batch import batch_download, parse_opml
+            from modules.download import podcast_download
+            from modules.ratelimit import RateLimiter
+            from modules.transfer import TransferOptions
+            from modules.xml import parse_remote_xml
+
+            try:
+                # Parse the RSS file
+                if settings['source'] == SOURCE_REMOTE:
+                    rss = parse_remote_xml(settings['location'], cache=self.feed_cache)
+                elif settings['source'] == SOURCE_LOCAL:
+                    rss = ElementTree.parse(settings['location'])
+                elif settings['source'] == SOURCE_OPML:
+                    rss = None
+                    feeds = parse_opml(settings['location'])
+                    if not feeds:
+                        raise ValueError('The OPML file does not list any RSS feeds.')
+                else:
+                    # This should in theory not happen because the source field is a dropdown.
+                    raise ValueError('Invalid podcast source.')
+            except Exception as e:
+                self.feed_error.emit(str(e))
+                return
+
+            # The rate limits apply to all downloads at once
+            delay = settings['delay']
+            options = TransferOptions(limiter=RateLimiter(
+                bytes_per_second=settings['bandwidth'] * 1000,
+                requests_per_second=1 / delay if delay else None,
+            ), cancel=self.cancel_event)
+
+            self.progress.emit('Starting download...\n')
+
+            if rss is None:
+                self.progress.emit(f'{str(len(feeds))} podcast{"s" if len(feeds) != 1 else ""} in total.\n')
+
+                # Call the batch download function
+                download = batch_download(feeds, settings['download_to'], settings['rename'],
+                                          print_progress=self.progress.emit,
+                                          workers=settings['workers'], resync=settings['resync'],
+                                          cache=self.feed_cache, options=options, on_event=self.on_event)
+            else:
+                # Count the total number of files
+                total_files = len(rss.findall('channel/item'))
+                self.progress.emit(f'{str(total_files)} file{"s" if total_files != 1 else ""} in total.\n')
+
+                # Call the download function
+                download = podcast_download(rss, delay, settings['download_to'], settings['rename'],
+                                            print_progress=self.progress.emit,
+                                            workers=settings['workers'], resync=settings['resync'],
+                                            options=options, on_event=self.on_event)
+
+            self.done.emit(download)
+        except Exception as e:
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit()
 
 class MainForm(QtWidgets.QWidget):
     '''The main input widget.'''
     
-    def __init__(self, parent=None, progress_display=None):
+    def __init__(self, parent=None, progress_display=None, episode_table=None):
         '''Initializes the widget.
 
         Specialty arguments:
          - progress_display: the widget for outputting the progress.
+         - episode_table: the EpisodeTable for showing the progress of each episode.
         '''
 
         QtWidgets.QWidget.__init__(self, parent)
 
         # Define the progress display function
         self.progress_display = progress_display
+        self.episode_table = episode_table
+
+        # Unchanged remote RSS files are loaded from the feed cache (created by the first download)
+        self.feed_cache = None
+
+        # The worker and its thread, while a download is running
+        self.worker = None
+        self.worker_thread = None
 
         # Set the stylesheet
         self.setStyleSheet(MAINFORM_STYLESHEET)
 
         # Podcast information
         podcast_sources = [
-            'Remote RSS file',
-            'Local RSS file',
+            SOURCE_REMOTE,
+            SOURCE_LOCAL,
+            SOURCE_OPML,
         ]
         self.podcast_source = QComboBox()
         self.podcast_source.addItems(podcast_sources)
@@ -106,8 +490,11 @@ class MainForm(QtWidgets.QWidget):
 
         # Download settings
         self.delay = QLineEdit()
+        self.bandwidth = QLineEdit()
+        self.workers = QLineEdit()
         self.download_to = QLineEdit()
         self.rename = QCheckBox("Rename each file to the episode name?")
+        self.resync = QCheckBox("Download episodes that were already downloaded again?")
 
         # Download button
         self.download_button = QPushButton("Download")
@@ -124,10 +511,18 @@ class MainForm(QtWidgets.QWidget):
         self.layout.addWidget(self.podcast_location)
         self.layout.addSpacing(SPACING_VERTICAL)
 
-        self.layout.addWidget(QLabel('Delay between downloads:'))
+        self.layout.addWidget(QLabel('Delay between requests to the same server:'))
         self.layout.addWidget(self.delay)
         self.layout.addSpacing(SPACING_VERTICAL)
+
+        self.layout.addWidget(QLabel('Bandwidth limit in KB/s (0 for no limit):'))
+        self.layout.addWidget(self.bandwidth)
+        self.layout.addSpacing(SPACING_VERTICAL)
         
+        self.layout.addWidget(QLabel('Simultaneous downloads:'))
+        self.layout.addWidget(self.workers)
+        self.layout.addSpacing(SPACING_VERTICAL)
+
         self.layout.addWidget(QLabel('Download to:'))
         self.layout.addWidget(self.download_to)
         self.layout.addSpacing(SPACING_VERTICAL)
@@ -135,6 +530,9 @@ class MainForm(QtWidgets.QWidget):
         self.layout.addWidget(self.rename)
         self.layout.addSpacing(SPACING_VERTICAL)
 
+        self.layout.addWidget(self.resync)
+        self.layout.addSpacing(SPACING_VERTICAL)
+
         self.layout.addWidget(self.download_button)
         
         #layout.addWidget(QLineEdit())
@@ -143,11 +541,13 @@ class MainForm(QtWidgets.QWidget):
 
         self.setLayout(self.layout)
 
-        # Event listener for the download button
-        self.download_button.clicked.connect(self.start_download)
+        # Event listener for the download button, which cancels the download while it is running
+        self.download_button.clicked.connect(self.toggle_download)
 
         # Set the default values
         self.delay.setText('1')
+        self.bandwidth.setText('0')
+        self.workers.setText('1')
         self.download_to.setText('download')
 
     def append_progress(self, *args, **kwargs):
@@ -173,15 +573,16 @@ class MainForm(QtWidgets.QWidget):
         '''
 
         required_fields = [self.podcast_location, self.download_to]
-        number_fields = [self.delay]
+        number_fields = [self.delay, self.bandwidth]
 
         # Remove field highlights
-        for field in (required_fields + number_fields):
+        for field in (required_fields + number_fields + [self.workers]):
             highlight_invalid_field(field, revert=True)
 
         # Validate field requirements
         validate_required = validate_required_fields(required_fields)
         validate_numbers = validate_number_fields(number_fields, integer=True, min=(0, True))
+        validate_workers = validate_number_fields([self.workers], integer=True, min=(1, True))
 
         # Highlight invalid fields
         if not validate_required['valid']:
@@ -196,59 +597,120 @@ class MainForm(QtWidgets.QWidget):
                 if not field[0]:
                     highlight_invalid_field(number_fields[i])
                 i += 1
+        if not validate_workers['valid']:
+            highlight_invalid_field(self.workers)
 
-        return validate_required['valid'] and validate_numbers['valid']
+        return validate_required['valid'] and validate_numbers['valid'] and validate_workers['valid']
 
-    def start_download(self):
+    def toggle_download(self):
         '''Handles the click event for the download button.
-        Validates inputs and calls the download function.'''
+        Starts a download, or cancels the running download.'''
+
+        if self.worker is None:
+            self.start_download()
+        else:
+            self.cancel_download()
+
+    def start_download(self):
+        '''Validates inputs and starts the download on a worker thread.'''
 
         # First clear the progress display
         self.clear_progress()
 
+        if self.episode_table is not None:
+            self.episode_table.clear()
+
         # Download the files if all fields are valid
-        if self.validate():
+        if not self.validate():
+            self.append_progress('Invalid input in one or more fields.')
+            return
+
+        self.append_progress(f"Downloading from {self.podcast_location.text()} to {self.download_to.text()}.")
+        self.append_progress()
+
+        # Read the form on the GUI thread, since widgets must not be used from the worker
+        settings = {
+            'source': self.podcast_source.currentText(),
+            'location': self.podcast_location.text(),
+            'delay': int(self.delay.text()),
+            'bandwidth': int(self.bandwidth.text()),
+            'workers': int(self.workers.text()),
+            'download_to': self.download_to.text(),
+            'rename': self.rename.checkState() == QtCore.Qt.CheckState.Checked,
+            'resync': self.resync.checkState() == QtCore.Qt.CheckState.Checked,
+        }
+
+        if self.feed_cache is None:
+            from modules.cache import FeedCache
+            self.feed_cache = FeedCache()
+
+        self.worker = DownloadWorker(settings, self.feed_cache,
+                                     self.episode_table.add_event if self.episode_table is not None else None)
+        self.worker_thread = QtCore.QThread(self)
+        self.worker.moveToThread(self.worker_thread)
+
+        # The signals are delivered on the GUI thread
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.append_progress)
+        self.worker.feed_error.connect(self.download_feed_error)
+        self.worker.done.connect(self.download_done)
+        self.worker.failed.connect(self.download_failed)
+        self.worker.finished.connect(self.download_finished)
+
+        # Clean up once the thread has stopped
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.worker.deleteLater)
+        self.worker_thread.finished.connect(self.worker_thread.deleteLater)
+
+        self.download_button.setText('Cancel')
+        self.worker_thread.start()
+
+    def cancel_download(self):
+        '''Cancels the running download, if there is one. The worker's finished signal
+        is emitted once it has stopped.'''
+
+        if self.worker is None:
+            return
+
+        self.worker.cancel()
+        self.download_button.setText('Cancelling...')
+        self.download_button.setEnabled(False)
+
+    def download_feed_error(self, message: str):
+        '''Shows an error in fetching or parsing the podcast.'''
+
+        # Print the error and highlight the field.
+        highlight_invalid_field(self.podcast_location)
+        self.append_progress('Error when parsing the RSS file:')
+        self.append_progress(message)
+
+    def download_done(self, download: dict):
+        '''Shows the result of the download.'''
+
+        if download.get('total_cancelled'):
+            self.append_progress('Download cancelled\n')
+            self.append_progress(f'{str(download["total_cancelled"])} files not downloaded.')
+        else:
+            self.append_progress('Download complete\n')
 
-            self.append_progress(f"Downloading from {self.podcast_location.text()} to {self.download_to.text()}.")
-            self.append_progress()
-            
-            # This will be set to false if there is an error in the download options.
-            can_download = True
+        self.append_progress(f'{str(download["total_downloads"])} files downloaded.')
+        self.append_progress(f'{str(download["total_skipped"])} files already downloaded.')
+        self.append_progress(f'{str(download["total_errors"])} errors.')
 
-            try:
-                # Parse the RSS file
-                if self.podcast_source.currentText() == 'Remote RSS file':
-                    rss = parse_remote_xml(self.podcast_location.text())
-                elif self.podcast_source.currentText() == 'Local RSS file':
-                    rss = ElementTree.parse(self.podcast_location.text())
-                else:
-                    # This should in theory not happen because the source field is a dropdown.
-                    self.append_progress('Invalid podcast source.')
-            except Exception as e:
-                # If there is an error, print it and highlight the field.
-                can_download = False
-                highlight_invalid_field(self.podcast_location)
-                self.append_progress('Error when parsing the RSS file:')
-                self.append_progress(str(e))
-
-            if can_download:
-                self.append_progress('Starting download...\n')
+    def download_failed(self, message: str):
+        '''Shows an unexpected error that stopped the download.'''
 
-                # Count the total number of files
-                total_files = len(rss.findall('channel/item'))
-                self.append_progress(f'{str(total_files)} file{"s" if total_files != 1 else ""} in total.\n')
+        self.append_progress('Error when downloading:')
+        self.append_progress(message)
 
-                # Call the download function
-                download = podcast_download(rss, int(self.delay.text()), self.download_to.text(),
-                                                     self.rename.checkState() == QtCore.Qt.CheckState.Checked,
-                                                     print_progress=self.append_progress)
+    def download_finished(self):
+        '''Resets the form once the worker has stopped.'''
 
-                self.append_progress('Download complete\n')
-                self.append_progress(f'{str(download["total_downloads"])} files downloaded.')
-                self.append_progress(f'{str(download["total_errors"])} errors.')
+        self.worker = None
+        self.worker_thread = None
 
-        else:
-            self.append_progress('Invalid input in one or more fields.')
+        self.download_button.setText('Download')
+        self.download_button.setEnabled(True)
 
 class MainWidget(QtWidgets.QWidget):
     '''The main GUI widget.'''
@@ -257,17 +719,49 @@ class MainWidget(QtWidgets.QWidget):
         QtWidgets.QWidget.__init__(self, parent)
 
         self.output_widget = ProgressDisplay(self)
-        self.input_widget = MainForm(self, progress_display=self.output_widget)
+        self.episode_table = EpisodeTable(self)
+        self.input_widget = MainForm(self, progress_display=self.output_widget,
+                                     episode_table=self.episode_table)
+
+        # The episode table above the progress log
+        self.output_splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
+        self.output_splitter.addWidget(self.episode_table)
+        self.output_splitter.addWidget(self.output_widget)
 
         # Widget layout
         self.layout = QtWidgets.QHBoxLayout()
         self.layout.addWidget(self.input_widget)
-        self.layout.addWidget(self.output_widget)
+        self.layout.addWidget(self.output_splitter)
 
         self.setLayout(self.layout)
 
         self.setGeometry(10, 10, 1000, 500)
 
+        # Whether the window closes once the running download has stopped
+        self.closing = False
+
+    def closeEvent(self, event):
+        '''Cancels any running download before the window closes.
+
+        The window stays open until the worker has stopped, without blocking the GUI
+        thread meanwhile, and is then closed from the worker's finished signal.
+        '''
+
+        worker = self.input_widget.worker
+
+        if worker is None:
+            event.accept()
+            return
+
+        if not self.closing:
+            self.closing = True
+
+            # Connected after MainForm.download_finished, so the form has let go of the worker first
+            worker.finished.connect(self.close)
+            self.input_widget.cancel_download()
+
+        event.ignore()
+
 #endregion
 
 #region FUNCTIONS
@@ -413,6 +907,20 @@ def validate_number_fields(widgets: list, integer: bool=False, max: tuple=(None,
         'fields': fields,
     }
 
+def format_size(size: float) -> str:
+    '''Returns a number of bytes as a short string, such as '12.3 MB'.
+
+    Arguments:
+     - size: the number of bytes
+    '''
+
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1000:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1000
+
+    return f'{size:.1f} TB'
+
 def highlight_invalid_field(field, revert: bool=False):
     '''Applies a stylesheet property to an invalid field.
     
@@ -0,0 +1,323 @@
+# Throughput and latency metrics, collected from the download events.
+
+import collections
+import os
+import tempfile
+import threading
+import time
+
+from . import events
+
+# The histogram buckets in seconds for the time to the first byte
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# The histogram buckets in seconds for the duration of a download
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+# The number of seconds the current download speed is averaged over
+RATE_WINDOW = 10.0
+
+# The prefix of the Prometheus metric names
+METRIC_PREFIX = 'podcast_downloader'
+
+class Histogram(object):
+    '''A histogram with fixed buckets, in the style of a Prometheus histogram.'''
+
+    def __init__(self, buckets: tuple):
+        '''Create a Histogram object.
+
+        Arguments:
+            buckets: The upper bounds of the buckets, in increasing order.
+        '''
+
+        self.buckets = tuple(buckets)
+
+        # The number of observations in each bucket (not cumulative), plus one for the rest
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        '''Add an observation.
+
+        Arguments:
+            value: The observed value.
+        '''
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        '''Returns the (upper bound, number of observations up to it) of each bucket,
+        ending with (inf, count).'''
+
+        result = []
+        total = 0
+
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+class MetricsCollector(object):
+    '''Collects throughput and latency metrics from the download events.
+
+    Pass the collector as the on_event argument of podcast_download or batch_download.
+    It counts the episodes by result and the bytes by host, keeps per-host
+    histograms of the time to the first byte, the request latency and the download durations,
+    and works out the download speed.
+
+    Safe to use from several threads at once.
+
+    Example:
+        metrics = MetricsCollector()
+        podcast_download(rss, output_dir='download', on_event=metrics)
+        print(metrics.bytes_per_second())
+        metrics.write_prometheus('/var/lib/node_exporter/podcast_downloader.prom')
+    '''
+
+    def __init__(self, latency_buckets: tuple=LATENCY_BUCKETS, duration_buckets: tuple=DURATION_BUCKETS,
+                 rate_window: float=RATE_WINDOW):
+        '''Create a MetricsCollector object.
+
+        Arguments:
+            latency_buckets: The histogram buckets in seconds for the time to the first byte
+                             and the request latency.
+            duration_buckets: The histogram buckets in seconds for the download durations.
+            rate_window: The number of seconds the current download speed is averaged over.
+        '''
+
+        self.latency_buckets = latency_buckets
+        self.duration_buckets = duration_buckets
+        self.rate_window = rate_window
+
+        # kind -> the number of episodes (for the QUEUED, SKIPPED, STARTED, FINISHED and FAILED events)
+        self.episodes = collections.Counter()
+
+        # host -> the number of bytes received
+        self.bytes_by_host = collections.Counter()
+
+        # host -> Histogram
+        self.time_to_first_byte = {}
+        self.latencies = {}
+        self.durations = {}
+
+        # The time of the first response and of the latest BYTES event. The times of the events
+        # are used (time.time), not when they are handled, since events can wait in a queue first.
+        self._first_response = None
+        self._last_bytes = None
+
+        # The (time, size) of the BYTES events within the rate window
+        self._recent = collections.deque()
+
+        self._lock = threading.Lock()
+
+    def __call__(self, event: events.DownloadEvent):
+        '''Record an event. See handle().'''
+
+        self.handle(event)
+
+    def handle(self, event: events.DownloadEvent):
+        '''Record an event.
+
+        Arguments:
+            event: The event.
+        '''
+
+        with self._lock:
+            if event.kind == events.BYTES:
+                if self._first_response is None or event.time < self._first_response:
+                    self._first_response = event.time
+                self._last_bytes = max(self._last_bytes or event.time, event.time)
+
+                self.bytes_by_host[event.host] += event.size
+                self._recent.append((event.time, event.size))
+                self._expire(self._last_bytes)
+            elif event.kind == events.RESPONSE:
+                if self._first_response is None or event.time < self._first_response:
+                    self._first_response = event.time
+
+                if event.elapsed is not None:
+                    self._histogram(self.time_to_first_byte, event.host,
+                                    self.latency_buckets).observe(event.elapsed)
+
+                if event.latency is not None:
+                    self._histogram(self.latencies, event.host,
+                                    self.latency_buckets).observe(event.latency)
+            else:
+                self.episodes[event.kind] += 1
+
+                if event.kind == events.FINISHED and event.elapsed is not None:
+                    self._histogram(self.durations, event.host,
+                                    self.duration_buckets).observe(event.elapsed)
+
+    def total_bytes(self) -> int:
+        '''Returns the number of bytes received from every host.'''
+
+        with self._lock:
+            return sum(self.bytes_by_host.values())
+
+    def bytes_per_second(self) -> float:
+        '''Returns the average download speed in bytes per second,
+        from the first response to the latest bytes received.'''
+
+        with self._lock:
+            if self._last_bytes is None or self._last_bytes == self._first_response:
+                return 0.0
+
+            return sum(self.bytes_by_host.values()) / (self._last_bytes - self._first_response)
+
+    def current_bytes_per_second(self) -> float:
+        '''Returns the download speed in bytes per second over the last rate_window seconds.'''
+
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+
+            if not self._recent:
+                return 0.0
+
+            elapsed = min(self.rate_window, now - self._first_response)
+            if elapsed <= 0:
+                return 0.0
+
+            return sum(size for _, size in self._recent) / elapsed
+
+    def snapshot(self) -> dict:
+        '''Returns the current values of the metrics as a dict.'''
+
+        average = self.bytes_per_second()
+        current = self.current_bytes_per_second()
+
+        with self._lock:
+            return {
+                'episodes': dict(self.episodes),
+                'bytes': dict(self.bytes_by_host),
+                'bytes_per_second': average,
+                'current_bytes_per_second': current,
+                'time_to_first_byte': {host: _histogram_dict(histogram)
+                                       for host, histogram in self.time_to_first_byte.items()},
+                'latency': {host: _histogram_dict(histogram)
+                            for host, histogram in self.latencies.items()},
+                'durations': {host: _histogram_dict(histogram)
+                              for host, histogram in self.durations.items()},
+            }
+
+    def prometheus(self) -> str:
+        '''Returns a snapshot of the metrics in the Prometheus text exposition format.'''
+
+        average = self.bytes_per_second()
+        current = self.current_bytes_per_second()
+        lines = []
+
+        def header(name: str, kind: str, description: str):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {description}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+
+        with self._lock:
+            header('episodes_total', 'counter', 'Episodes by download result.')
+            for kind in events.EVENT_KINDS:
+                if kind in (events.RESPONSE, events.BYTES):
+                    continue
+                lines.append(f'{METRIC_PREFIX}_episodes_total{{result="{kind}"}} {self.episodes[kind]}')
+
+            header('bytes_total', 'counter', 'Bytes received by host.')
+            for host, size in sorted(self.bytes_by_host.items()):
+                lines.append(f'{METRIC_PREFIX}_bytes_total{{host={_label(host)}}} {size}')
+
+            header('bytes_per_second', 'gauge', 'Average download speed since the first response.')
+            lines.append(f'{METRIC_PREFIX}_bytes_per_second {_number(average)}')
+
+            header('current_bytes_per_second', 'gauge',
+                   f'Download speed over the last {_number(self.rate_window)} seconds.')
+            lines.append(f'{METRIC_PREFIX}_current_bytes_per_second {_number(current)}')
+
+            for name, histograms, description in (
+                    ('time_to_first_byte_seconds', self.time_to_first_byte,
+                     'Time from the start of a download to the first response, by host.'),
+                    ('request_latency_seconds', self.latencies,
+                     'Time from sending a request to receiving the response headers, by host.'),
+                    ('download_duration_seconds', self.durations,
+                     'Duration of the finished downloads, by host.')):
+                header(name, 'histogram', description)
+
+                for host, histogram in sorted(histograms.items()):
+                    label = f'host={_label(host)}'
+
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{METRIC_PREFIX}_{name}_bucket{{{label},le="{_number(bound)}"}} {count}')
+
+                    lines.append(f'{METRIC_PREFIX}_{name}_sum{{{label}}} {_number(histogram.sum)}')
+                    lines.append(f'{METRIC_PREFIX}_{name}_count{{{label}}} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        '''Atomically write a Prometheus snapshot to a file, for example for the
+        node_exporter textfile collector.
+
+        Arguments:
+            path: The path of the file.
+        '''
+
+        text = self.prometheus()
+        directory = os.path.dirname(os.path.abspath(path))
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(text)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _histogram(self, histograms: dict, host: str, buckets: tuple) -> Histogram:
+        '''Returns the histogram for a host, creating it if it does not exist.'''
+
+        histogram = histograms.get(host)
+
+        if histogram is None:
+            histogram = histograms[host] = Histogram(buckets)
+
+        return histogram
+
+    def _expire(self, now: float):
+        '''Forget the BYTES events older than the rate window. Must be called while holding the lock.'''
+
+        while self._recent and now - self._recent[0][0] > self.rate_window:
+            self._recent.popleft()
+
+def _histogram_dict(histogram: Histogram) -> dict:
+    '''Returns a histogram as a dict.'''
+
+    return {
+        'buckets': [[bound, count] for bound, count in histogram.cumulative()],
+        'sum': histogram.sum,
+        'count': histogram.count,
+    }
+
+def _label(value: str) -> str:
+    '''Returns a quoted and escaped Prometheus label value.'''
+
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return f'"{value}"'
+
+def _number(value: float) -> str:
+    '''Returns a number in the Prometheus format.'''
+
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
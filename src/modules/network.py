@@ -0,0 +1,324 @@
+# The shared HTTP client, with keep-alive connections pooled per host.
+
+import http.client
+import ssl
+import threading
+
+from urllib.parse import urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+# The default timeout in seconds for connecting and for each read
+DEFAULT_TIMEOUT = 30
+
+# The maximum number of redirects followed for a request
+MAX_REDIRECTS = 10
+
+# The maximum number of idle connections kept open for each host
+MAX_IDLE_CONNECTIONS = 8
+
+USER_AGENT = 'PodcastDownloader/0.1'
+
+# The status codes which redirect to the Location header
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+class HttpStatusError(Exception):
+    '''The exception that is raised when a server responds with an error status code.'''
+
+    def __init__(self, url: str, code: int, reason: str, headers=None):
+        Exception.__init__(self, f'HTTP Error {str(code)}: {reason}')
+
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+
+class TooManyRedirects(Exception):
+    '''The exception that is raised when a request is redirected too many times.'''
+
+class Response(object):
+    '''An HTTP response from HttpClient.
+
+    The connection is returned to the pool when the response is closed,
+    if the body was read to the end. Use it as a context manager to make sure
+    it is closed.
+    '''
+
+    def __init__(self, client, key: tuple, connection, response: http.client.HTTPResponse, url: str):
+        self._client = client
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+        # The final URL, after any redirects
+        self.url = url
+
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt: int=None) -> bytes:
+        '''Read up to amt bytes of the body (or the whole body if amt is None).'''
+
+        return self._response.read(amt)
+
+    def readinto(self, buffer) -> int:
+        '''Read the body into a buffer. Returns the number of bytes read.'''
+
+        return self._response.readinto(buffer)
+
+    def raise_for_status(self):
+        '''Raise HttpStatusError (and close the response) if the status code is an error.'''
+
+        if self.status >= 400:
+            self.close()
+            raise HttpStatusError(self.url, self.status, self.reason, self.headers)
+
+    def close(self):
+        '''Close the response, returning the connection to the pool if it can be reused.'''
+
+        if self._connection is None:
+            return
+
+        connection = self._connection
+        self._connection = None
+
+        if self._response.isclosed() and not self._response.will_close:
+            # The body was read to the end and the server keeps the connection alive
+            self._client._release(self._key, connection)
+        else:
+            self._response.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class HttpClient(object):
+    '''An HTTP client that keeps connections alive and reuses them for each host.
+
+    Safe to use from several threads at once. Follows redirects.
+
+    The client can be pointed somewhere else (for example, at a local test server)
+    by supplying a connection factory, or replaced for the whole program with
+    set_default_client().
+    '''
+
+    def __init__(self, timeout: float=DEFAULT_TIMEOUT, max_redirects: int=MAX_REDIRECTS,
+                 max_idle: int=MAX_IDLE_CONNECTIONS, connection_factory=None, proxies: dict=None):
+        '''Create an HttpClient object.
+
+        Arguments:
+            timeout: The timeout in seconds for connecting and for each read.
+            max_redirects: The maximum number of redirects followed for a request.
+            max_idle: The maximum number of idle connections kept open for each host.
+            connection_factory: A function (scheme, host, port, timeout) -> http.client.HTTPConnection
+                                which opens new connections. By default, connections are made
+                                directly or through the proxies in the environment.
+            proxies: A dict of scheme -> proxy URL (by default, the proxies in the environment).
+        '''
+
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.max_idle = max_idle
+        self.connection_factory = connection_factory
+        self.proxies = getproxies() if proxies is None else proxies
+
+        # (scheme, host, port) -> the idle connections
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: dict=None) -> Response:
+        '''Send a GET request. See request().'''
+
+        return self.request('GET', url, headers)
+
+    def request(self, method: str, url: str, headers: dict=None) -> Response:
+        '''Send a request, following any redirects.
+
+        Returns the response, whatever its status code. Call raise_for_status()
+        on the response to turn error codes into exceptions.
+
+        Arguments:
+            method: The HTTP method.
+            url: The URL.
+            headers: The request headers.
+        '''
+
+        headers = dict(headers or {})
+        headers.setdefault('User-Agent', USER_AGENT)
+
+        for redirect in range(self.max_redirects + 1):
+            response = self._send(method, url, headers)
+
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_CODES or not location:
+                return response
+
+            # Discard the redirect body, so the connection can be reused
+            if int(response.headers.get('Content-Length') or 0) < 64 * 1024:
+                response.read()
+            response.close()
+
+            url = urljoin(url, location)
+
+            if response.status == 303 and method != 'HEAD':
+                method = 'GET'
+
+        raise TooManyRedirects(f'More than {str(self.max_redirects)} redirects for {url}.')
+
+    def close(self):
+        '''Close all idle connections.'''
+
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _send(self, method: str, url: str, headers: dict) -> Response:
+        '''Send a single request, on an idle connection if there is one.'''
+
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+
+        if scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme: {url}')
+
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = dict(headers)
+        headers['Host'] = parts.netloc.rsplit('@', 1)[-1]
+
+        connection = self._acquire(key)
+        reused = connection is not None
+
+        while True:
+            if connection is None:
+                connection = self._connect(key)
+
+            try:
+                connection.request(method, self._request_target(key, url, path), headers=headers)
+                response = connection.getresponse()
+                return Response(self, key, connection, response, url)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+
+                if not reused:
+                    raise
+
+                # The server closed the idle connection, so try once more on a new connection
+                connection = None
+                reused = False
+            except Exception:
+                connection.close()
+                raise
+
+    def _proxy(self, scheme: str, host: str):
+        '''Returns the proxy URL for a host, or None if the host is connected to directly.'''
+
+        if self.connection_factory is not None:
+            return None
+
+        proxy = self.proxies.get(scheme)
+        if proxy and proxy_bypass(host):
+            return None
+
+        return proxy
+
+    def _request_target(self, key: tuple, url: str, path: str) -> str:
+        '''Returns the target of the request line: the full URL for a plain HTTP proxy, otherwise the path.'''
+
+        if key[0] == 'http' and self._proxy(key[0], key[1]):
+            return url
+
+        return path
+
+    def _connect(self, key: tuple):
+        '''Open a new connection.'''
+
+        scheme, host, port = key
+
+        if self.connection_factory is not None:
+            return self.connection_factory(scheme, host, port, self.timeout)
+
+        proxy = self._proxy(scheme, host)
+
+        if proxy:
+            proxy_parts = urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+            proxy_host = proxy_parts.hostname
+            proxy_port = proxy_parts.port or 80
+
+            if scheme == 'https':
+                # Tunnel through the proxy with CONNECT
+                connection = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=self.timeout,
+                                                         context=ssl.create_default_context())
+                connection.set_tunnel(host, port)
+            else:
+                connection = http.client.HTTPConnection(proxy_host, proxy_port, timeout=self.timeout)
+
+            return connection
+
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout,
+                                               context=ssl.create_default_context())
+        else:
+            return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _acquire(self, key: tuple):
+        '''Returns an idle connection for a host, or None if there are none.'''
+
+        with self._lock:
+            connections = self._idle.get(key)
+
+            if connections:
+                return connections.pop()
+
+        return None
+
+    def _release(self, key: tuple, connection):
+        '''Return a connection to the pool.'''
+
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+
+        connection.close()
+
+# The client used when no client is supplied
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_default_client() -> HttpClient:
+    '''Returns the shared HttpClient, creating it if it does not exist yet.'''
+
+    global _default_client
+
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+
+        return _default_client
+
+def set_default_client(client: HttpClient):
+    '''Replace the shared HttpClient (for example, to use different timeouts or a test server).
+
+    Arguments:
+        client: The new client, or None to create a new default client when it is next needed.
+    '''
+
+    global _default_client
+
+    with _default_client_lock:
+        _default_client = client
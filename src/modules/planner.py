@@ -0,0 +1,183 @@
+# Planning the file names of the episodes in an output directory.
+
+import os
+import re
+
+from .podcast import Episode
+from .state import StateStore
+from .string import str_to_filename
+
+class DirectoryIndex(object):
+    '''The files in a directory with their sizes and modification times, read once with os.scandir.
+
+    Looking up a file in the index does not touch the disk, so checking
+    thousands of episodes against the output directory costs one scan.
+    '''
+
+    def __init__(self, directory: str):
+        '''Scan a directory. A missing directory is treated as empty.
+
+        Arguments:
+            directory: The path of the directory.
+        '''
+
+        self.directory = directory
+
+        # file name -> size in bytes
+        self.sizes = {}
+
+        # file name -> modification time in nanoseconds
+        self.mtimes = {}
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            self.sizes[entry.name] = stat.st_size
+                            self.mtimes[entry.name] = stat.st_mtime_ns
+                    except OSError:
+                        # The file was removed while the directory was being scanned
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def size(self, filename: str):
+        '''Returns the size of a file in bytes, or None if it does not exist.
+
+        Arguments:
+            filename: The file name.
+        '''
+
+        return self.sizes.get(filename)
+
+    def mtime(self, filename: str):
+        '''Returns the modification time of a file in nanoseconds, or None if it does not exist.
+
+        Arguments:
+            filename: The file name.
+        '''
+
+        return self.mtimes.get(filename)
+
+class FilenamePlanner(object):
+    '''Assigns each episode a file name that no other episode in the directory uses.
+
+    The name is based on the episode title (rename mode) or the enclosure URL.
+    If two episodes would get the same name, such as two episodes with the same
+    title or two enclosures called audio.mp3, the later one in the feed gets a
+    number: "audio (2).mp3", "audio (3).mp3" and so on. Names are compared without
+    case, since many file systems ignore it.
+
+    Names that earlier runs saved other episodes as (see modules.state.StateStore)
+    are never given to a different episode, and an episode keeps the name it was
+    saved as, so the numbering is the same from one run to the next.
+
+    Other files already in the directory are never overwritten either, unless they
+    have the size the feed gives for the episode, in which case they are taken to be
+    the episode saved by an older version or copied in by hand.
+    '''
+
+    def __init__(self, state: StateStore, rename: bool, index: DirectoryIndex=None):
+        '''Create a FilenamePlanner object.
+
+        Arguments:
+            state: The record of the episodes downloaded by earlier runs.
+            rename: Whether to use the episode titles as the file names.
+            index: The DirectoryIndex of the output directory, or None to ignore the files in it.
+        '''
+
+        self.state = state
+        self.rename = rename
+        self.index = index
+
+        # lower case file name -> the GUID of the episode an earlier run saved as it
+        self._owners = {record['file'].lower(): guid for guid, record in state.episodes.items()}
+
+        # lower case file name -> the name of the file in the directory
+        self._files = {name.lower(): name for name in index.sizes} if index is not None else {}
+
+        # The lower case file names assigned so far
+        self._assigned = set()
+
+    def assign(self, episode: Episode) -> str:
+        '''Returns the file name for the next episode.
+
+        Arguments:
+            episode: The episode.
+        '''
+
+        base = episode_filename(episode, self.rename)
+        record = self.state.episodes.get(episode.guid)
+
+        if (record is not None and record['file'].lower() not in self._assigned
+                and _is_numbered_variant(record['file'], base)):
+            # Keep the name from the earlier run
+            filename = record['file']
+        else:
+            filename = base
+            number = 1
+
+            while self._is_taken(filename, episode):
+                number += 1
+                filename = numbered_filename(base, number)
+
+        self._assigned.add(filename.lower())
+
+        return filename
+
+    def _is_taken(self, filename: str, episode: Episode) -> bool:
+        '''Whether a file name is used by a different episode or file.'''
+
+        key = filename.lower()
+
+        if key in self._assigned:
+            return True
+
+        owner = self._owners.get(key)
+
+        if owner is not None:
+            return owner != episode.guid
+
+        existing = self._files.get(key)
+
+        # A file that is not the episode, which must not be overwritten
+        return existing is not None and (episode.length is None or self.index.size(existing) != episode.length)
+
+def episode_filename(episode: Episode, rename: bool) -> str:
+    '''Returns the file name to save an episode as, before any collisions are resolved.
+
+    Arguments:
+        episode: The episode.
+        rename: Whether to use the episode title as the file name.
+    '''
+
+    if rename:
+        # Rename the file to the episode title
+        return f'{str_to_filename(episode.title)}.{str_to_filename(episode.file_extension)}'
+    else:
+        # Keep the file name as is
+        return str_to_filename(episode.file_name)
+
+def numbered_filename(filename: str, number: int) -> str:
+    '''Returns a file name with a number added before the extension, such as "audio (2).mp3".
+
+    Arguments:
+        filename: The file name.
+        number: The number.
+    '''
+
+    stem, extension = os.path.splitext(filename)
+
+    return f'{stem} ({str(number)}){extension}'
+
+def _is_numbered_variant(filename: str, base: str) -> bool:
+    '''Whether a file name is a base file name, or the base file name with a number.'''
+
+    if filename == base:
+        return True
+
+    stem, extension = os.path.splitext(base)
+
+    return re.fullmatch(re.escape(stem) + r' \(\d+\)' + re.escape(extension), filename) is not None
@@ -1,9 +1,21 @@
+import gzip
+
+from defusedxml import ElementTree
 from xml.etree.ElementTree import Element
 
-from modules.xml import get_unique_xml_element
+from modules.network import get_default_client
+from modules.xml import XmlElementNotFound, XmlElementNotUnique
+
+# The <item> child elements read by Episode, each of which must appear exactly once
+EPISODE_ELEMENTS = ('guid', 'title', 'pubDate', 'enclosure')
 
 class Episode(object):
-    '''The podcast episode object.'''
+    '''The podcast episode object.
+
+    Uses __slots__, since a run can create tens of thousands of episodes.
+    '''
+
+    __slots__ = ('guid', 'title', 'date', 'url', 'length', '_file_name')
 
     def __init__(self, item: Element):
         '''Create an Episode object from an RSS item.
@@ -19,7 +31,7 @@ class Episode(object):
                         <title>Episode Title</title>
                         <description>Episode Description</description>
                         <pubDate>Date Published</pubDate>
-                        <enclosure url="https://example.com/episode.mp3" type="audio/mpeg" />
+                        <enclosure url="https://example.com/episode.mp3" length="12345" type="audio/mpeg" />
                     </item>
 
                     <!-- ... -->
@@ -31,14 +43,162 @@ class Episode(object):
             element: The <item> element for the episode.
         '''
 
+        # Find the elements in a single pass over the children of the RSS item
+        elements = {}
+
+        for child in item:
+            tag = child.tag
+
+            if tag in EPISODE_ELEMENTS:
+                if tag in elements:
+                    # If there is more than one element, raise an error.
+                    raise XmlElementNotUnique(f'There is more than one <{tag}> element.')
+
+                elements[tag] = child
+
+        for tag in EPISODE_ELEMENTS:
+            if tag not in elements:
+                # If there are no elements, raise an error.
+                raise XmlElementNotFound(f'Could not find the <{tag}> element.')
+
         # Parse the RSS item
-        self.guid = get_unique_xml_element(item, 'guid').text
-        self.title = get_unique_xml_element(item, 'title').text
-        self.date = get_unique_xml_element(item, 'pubDate').text
-        self.url = get_unique_xml_element(item, 'enclosure').get('url')
+        self.guid = elements['guid'].text
+        self.title = elements['title'].text
+        self.date = elements['pubDate'].text
+        enclosure = elements['enclosure']
+        self.url = enclosure.get('url')
+
+        # The file size in bytes, if the feed lists it
+        self.length = parse_length(enclosure.get('length'))
+
+        # Computed when it is first used
+        self._file_name = None
+
+    @property
+    def file_name(self) -> str:
+        '''The file name, which is the final item in the URL path.'''
+
+        if self._file_name is None:
+            self._file_name = self.url.split('/')[-1]
+
+        return self._file_name
+
+    @property
+    def file_extension(self) -> str:
+        '''The file extension, which is the final item in the file name.'''
+
+        return self.file_name.split('.')[-1]
+
+def parse_length(length: str):
+    '''Parses the length attribute of an <enclosure> element.
+
+    Returns the length in bytes, or None if it is missing or invalid.
+    Some feeds use 0 or -1 when the length is unknown, so these are treated as missing too.
+
+    Arguments:
+        length: The value of the length attribute.
+    '''
+
+    try:
+        length = int(length)
+    except (TypeError, ValueError):
+        return None
+
+    return length if length > 0 else None
+
+def iter_items(source, on_channel=None):
+    '''Parse an RSS file incrementally, yielding each <item> element.
+
+    Uses defusedxml for parsing.
+
+    Each <item> element is discarded once the next one is requested, so memory
+    use does not grow with the size of the feed, and the first item is
+    available before the rest of the feed has been read.
+
+    Arguments:
+        source: The path of the RSS file, or a binary file object (such as an HTTP response).
+        on_channel: If supplied, a function called with the <channel> element before the
+                    first item is yielded (or at the end of the channel, if it has no items).
+                    The channel's elements before the first item, such as its <title>, have
+                    been parsed by then.
+    '''
+
+    # The tags of the currently open elements, from the root
+    path = []
+
+    # The <channel> element, which the <item> elements are removed from once they are parsed
+    channel = None
+
+    # Whether on_channel has been called (or is not needed)
+    channel_reported = on_channel is None
+
+    for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            path.append(element.tag)
+
+            if len(path) == 2 and element.tag == 'channel':
+                channel = element
+        else:
+            if len(path) == 3 and path[1] == 'channel' and element.tag == 'item':
+                if not channel_reported:
+                    channel_reported = True
+                    on_channel(channel)
+
+                yield element
+
+                # Free the parsed item
+                element.clear()
+                channel.remove(element)
+            elif len(path) == 2 and element is channel and not channel_reported:
+                channel_reported = True
+                on_channel(channel)
+
+            path.pop()
+
+def iter_episodes(source, selection=None, on_channel=None):
+    '''Parse an RSS file incrementally, yielding an Episode object for each <item> element.
+
+    See iter_items().
+
+    Arguments:
+        source: The path of the RSS file, or a binary file object (such as an HTTP response).
+        selection: If supplied, a modules.selection.EpisodeSelection. Only the selected
+                   episodes are yielded, and parsing stops once no more can be selected.
+        on_channel: If supplied, a function called with the <channel> element, such as
+                    to read the podcast title (see iter_items()).
+    '''
+
+    items = iter_items(source, on_channel)
+
+    if selection is not None:
+        items = selection.select_items(items)
+
+    for item in items:
+        yield Episode(item)
+
+def iter_remote_episodes(url: str, client=None, selection=None, on_channel=None):
+    '''Stream a remote RSS file, yielding an Episode object for each <item> element.
+
+    The response is parsed while it is still arriving. See iter_episodes().
+
+    Arguments:
+        url: The URL of the RSS file.
+        client: The modules.network.HttpClient to use (by default, the shared client).
+        selection: If supplied, a modules.selection.EpisodeSelection. Only the selected
+                   episodes are yielded, and the connection is closed once no more
+                   can be selected, without reading the rest of the feed.
+        on_channel: If supplied, a function called with the <channel> element, such as
+                    to read the podcast title (see iter_items()).
+    '''
+
+    client = client or get_default_client()
+
+    with client.get(url, {'Accept-Encoding': 'gzip'}) as response:
+        response.raise_for_status()
 
-        # The file name is the final item in the URL path
-        self.file_name = self.url.split('/')[-1]
+        if response.headers.get('Content-Encoding', '').lower() == 'gzip':
+            source = gzip.GzipFile(fileobj=response)
+        else:
+            source = response
 
-        # The file extension is the final item in the file name
-        self.file_extension = self.file_name.split('.')[-1]
+        yield from iter_episodes(source, selection, on_channel)
@@ -0,0 +1,187 @@
+# Bandwidth and request rate limiting.
+
+import threading
+import time
+
+class TokenBucket(object):
+    '''A token bucket, which allows an average rate with short bursts.
+
+    Tokens are added at `rate` per second, up to `capacity`. Taking tokens never
+    fails: if there are not enough, the bucket goes into debt and the caller sleeps
+    until the debt would be paid off. Because every caller reserves its tokens
+    before sleeping, several threads sharing a bucket get the configured rate
+    in total and are served in the order they asked.
+
+    Safe to use from several threads at once.
+    '''
+
+    def __init__(self, rate: float, capacity: float=None):
+        '''Create a TokenBucket object.
+
+        Arguments:
+            rate: The number of tokens added per second (None or 0 for no limit).
+            capacity: The most tokens the bucket can hold, which is the largest burst
+                      (by default, one second's worth).
+        '''
+
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.capacity = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, capacity)
+
+        # Start full, so the first burst is not delayed
+        self._tokens = self.capacity
+
+    def set_rate(self, rate: float, capacity: float=None):
+        '''Change the rate, for example to throttle during working hours.
+
+        Arguments:
+            rate: The number of tokens added per second (None or 0 for no limit).
+            capacity: The most tokens the bucket can hold (by default, one second's worth).
+        '''
+
+        with self._lock:
+            self._refill()
+            self.rate = rate or 0
+            self.capacity = capacity or self.rate
+            self._tokens = min(self._tokens, self.capacity)
+
+    def take(self, amount: float=1):
+        '''Take tokens from the bucket, sleeping until they are available.
+
+        Arguments:
+            amount: The number of tokens.
+        '''
+
+        delay = self.reserve(amount)
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, amount: float=1) -> float:
+        '''Take tokens from the bucket without sleeping.
+
+        Returns the number of seconds the caller should wait before using the tokens.
+
+        Arguments:
+            amount: The number of tokens.
+        '''
+
+        with self._lock:
+            if not self.rate:
+                return 0.0
+
+            self._refill()
+            self._tokens -= amount
+
+            if self._tokens >= 0:
+                return 0.0
+
+            return -self._tokens / self.rate
+
+    def _refill(self):
+        '''Add the tokens earned since the last update. Must be called while holding the lock.'''
+
+        now = time.monotonic()
+
+        if self.rate:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+
+        self._updated = now
+
+class RateLimiter(object):
+    '''Limits the download bandwidth and the request rate.
+
+    The bandwidth can be limited in total and for each host, and the number of
+    requests can be limited for each host. The limits are shared by every download
+    using the limiter, so they hold however many files are downloaded at once.
+
+    Example:
+        # 2 MB/s in total, 500 KB/s and one request per second for each host
+        limiter = RateLimiter(bytes_per_second=2000000, host_bytes_per_second=500000,
+                              requests_per_second=1)
+        options = TransferOptions(limiter=limiter)
+    '''
+
+    def __init__(self, bytes_per_second: float=None, host_bytes_per_second: float=None,
+                 requests_per_second: float=None):
+        '''Create a RateLimiter object.
+
+        Arguments:
+            bytes_per_second: The total bandwidth limit (None for no limit).
+            host_bytes_per_second: The bandwidth limit for each host (None for no limit).
+            requests_per_second: The request rate limit for each host (None for no limit).
+        '''
+
+        self._lock = threading.Lock()
+        self._bandwidth = TokenBucket(bytes_per_second)
+
+        self.host_bytes_per_second = host_bytes_per_second
+        self.requests_per_second = requests_per_second
+
+        # host -> TokenBucket
+        self._host_bandwidth = {}
+        self._host_requests = {}
+
+    def set_rates(self, bytes_per_second: float=None, host_bytes_per_second: float=None,
+                  requests_per_second: float=None):
+        '''Change the limits while downloads are running.
+
+        Arguments:
+            bytes_per_second: The total bandwidth limit (None for no limit).
+            host_bytes_per_second: The bandwidth limit for each host (None for no limit).
+            requests_per_second: The request rate limit for each host (None for no limit).
+        '''
+
+        self._bandwidth.set_rate(bytes_per_second)
+
+        with self._lock:
+            self.host_bytes_per_second = host_bytes_per_second
+            self.requests_per_second = requests_per_second
+
+            for bucket in self._host_bandwidth.values():
+                bucket.set_rate(host_bytes_per_second)
+
+            for bucket in self._host_requests.values():
+                bucket.set_rate(requests_per_second, 1)
+
+    def request(self, host: str):
+        '''Wait until a request can be sent to a host.
+
+        Arguments:
+            host: The host.
+        '''
+
+        if self.requests_per_second:
+            # Requests are not allowed to burst, so they are spaced evenly
+            self._bucket(self._host_requests, host, self.requests_per_second, 1).take(1)
+
+    def transfer(self, host: str, size: int):
+        '''Account for bytes received from a host, waiting if they went over a limit.
+
+        Arguments:
+            host: The host.
+            size: The number of bytes.
+        '''
+
+        delay = self._bandwidth.reserve(size)
+
+        if self.host_bytes_per_second:
+            bucket = self._bucket(self._host_bandwidth, host, self.host_bytes_per_second)
+            delay = max(delay, bucket.reserve(size))
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def _bucket(self, buckets: dict, host: str, rate: float, capacity: float=None) -> TokenBucket:
+        '''Returns the bucket for a host, creating it if it does not exist.'''
+
+        with self._lock:
+            bucket = buckets.get(host)
+
+            if bucket is None:
+                bucket = buckets[host] = TokenBucket(rate, capacity)
+
+            return bucket
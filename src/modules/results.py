@@ -0,0 +1,305 @@
+# The result of each episode of a download, and the totals for the whole download.
+
+import json
+import threading
+
+from collections.abc import Mapping
+
+from .misc import null
+
+# The totals counted for every download
+RESULT_TOTALS = ('total_items', 'total_downloads', 'total_skipped', 'total_cancelled', 'total_errors')
+
+# The fields of a result which are always set, and those which are only included when set
+_REQUIRED_FIELDS = ('file', 'downloaded')
+_OPTIONAL_FIELDS = ('skipped', 'cancelled', 'error', 'guid', 'feed')
+
+class DownloadResult(Mapping):
+    '''The result of one episode of a download.
+
+    The fields are:
+        file: The file name the episode is (or would have been) saved as.
+        downloaded: Whether the episode was downloaded by this run.
+        skipped: Whether the episode was already downloaded by an earlier run.
+        cancelled: Whether the episode was not downloaded because the download was cancelled.
+        error: The error message, if the episode could not be downloaded.
+        guid: The episode GUID, if known.
+        feed: The full path of the podcast's output directory, if known.
+
+    For compatibility with the dicts returned by older versions, a result is also a
+    read-only mapping with the keys of to_dict(): result['file'], 'error' in result,
+    result.get('skipped'), dict(result) and comparing with a dict all work as before.
+    json.dumps() only accepts real dicts, so serialize result.to_dict() instead.
+    '''
+
+    __slots__ = ('file', 'downloaded', 'skipped', 'cancelled', 'error', 'guid', 'feed')
+
+    def __init__(self, file: str, downloaded: bool=False, skipped: bool=False, cancelled: bool=False,
+                 error: str=None, guid: str=None, feed: str=None):
+        '''Create a DownloadResult object.
+
+        Arguments:
+            file: The file name the episode is saved as.
+            downloaded: Whether the episode was downloaded.
+            skipped: Whether the episode was already downloaded.
+            cancelled: Whether the download was cancelled.
+            error: The error message, if the episode could not be downloaded.
+            guid: The episode GUID.
+            feed: The full path of the podcast's output directory.
+        '''
+
+        self.file = file
+        self.downloaded = downloaded
+        self.skipped = skipped
+        self.cancelled = cancelled
+        self.error = error
+        self.guid = guid
+        self.feed = feed
+
+    @classmethod
+    def from_dict(cls, record: dict):
+        '''Create a DownloadResult object from a dict returned by to_dict().
+
+        Arguments:
+            record: The dict.
+        '''
+
+        return cls(record['file'], record.get('downloaded', False), record.get('skipped', False),
+                   record.get('cancelled', False), record.get('error'), record.get('guid'), record.get('feed'))
+
+    def to_dict(self) -> dict:
+        '''Returns the result as a dict with the 'file' and 'downloaded' keys, and
+        the other fields which are set.'''
+
+        return {name: getattr(self, name) for name in self}
+
+    # The same as to_dict(), like DownloadEvent.as_dict()
+    as_dict = to_dict
+
+    def __getitem__(self, key: str):
+        if key in _REQUIRED_FIELDS or (key in _OPTIONAL_FIELDS and getattr(self, key)):
+            return getattr(self, key)
+
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from _REQUIRED_FIELDS
+
+        for name in _OPTIONAL_FIELDS:
+            if getattr(self, name):
+                yield name
+
+    def __len__(self) -> int:
+        return len(_REQUIRED_FIELDS) + sum(1 for name in _OPTIONAL_FIELDS if getattr(self, name))
+
+    def __repr__(self):
+        return f'DownloadResult({self.to_dict()!r})'
+
+class ResultLog(object):
+    '''The results of the episodes of one download, and their totals.
+
+    Each episode is added when it is queued (or skipped). Its result can be updated
+    while it is downloaded and checked, and is final once finish() is called for it.
+    The totals only count the final results, and each final result is passed to the
+    emit function. Unless keep is True, the final results are not held in memory,
+    so a download of any size only keeps the results of the episodes in progress.
+
+    Safe to use from several threads at once.
+    '''
+
+    def __init__(self, keep: bool=True, emit=null):
+        '''Create a ResultLog object.
+
+        Arguments:
+            keep: Whether to keep every result, in feed order, for summary().
+            emit: The function each final result is passed to.
+        '''
+
+        self.keep = keep
+
+        self._emit = emit
+
+        # Every result, by index (only if keep is True)
+        self._results = []
+
+        # index -> the result of each episode which is not final yet
+        self._open = {}
+
+        # The number of episodes added
+        self._count = 0
+
+        self._totals = dict.fromkeys(RESULT_TOTALS, 0)
+
+        self._lock = threading.Lock()
+
+    def add(self, result: DownloadResult, final: bool=False) -> int:
+        '''Add an episode, returning its index.
+
+        Arguments:
+            result: The result of the episode so far.
+            final: Whether the result is already final (such as for a skipped episode).
+        '''
+
+        with self._lock:
+            index = self._count
+            self._count += 1
+
+            if self.keep:
+                self._results.append(result)
+
+            if not final:
+                self._open[index] = result
+                return index
+
+            _count_result(self._totals, result)
+
+        self._emit(result)
+
+        return index
+
+    def update(self, index: int, result: DownloadResult):
+        '''Replace the result of an episode which is not final yet.
+
+        Arguments:
+            index: The index of the episode.
+            result: The new result.
+        '''
+
+        with self._lock:
+            if index not in self._open:
+                return
+
+            self._open[index] = result
+
+            if self.keep:
+                self._results[index] = result
+
+    def finish(self, index: int, result: DownloadResult=None):
+        '''Make the result of an episode final. Finishing an episode twice does nothing.
+
+        Arguments:
+            index: The index of the episode.
+            result: The final result, or None to keep the current one.
+        '''
+
+        with self._lock:
+            current = self._open.pop(index, None)
+
+            if current is None:
+                return
+
+            result = result or current
+
+            if self.keep:
+                self._results[index] = result
+
+            _count_result(self._totals, result)
+
+        self._emit(result)
+
+    def close(self):
+        '''Make the result of every remaining episode final, in feed order.'''
+
+        with self._lock:
+            remaining = sorted(self._open)
+
+        for index in remaining:
+            self.finish(index)
+
+    def summary(self) -> dict:
+        '''Returns the totals of the final results, and the 'downloads' list of
+        every result in feed order if keep is True.'''
+
+        with self._lock:
+            summary = dict(self._totals)
+
+            if self.keep:
+                summary['downloads'] = list(self._results)
+
+        return summary
+
+class JsonLinesWriter(object):
+    '''Writes download results to a file as they finish, one JSON object per line
+    (see DownloadResult.to_dict()). Pass it as the on_result argument of podcast_download
+    or batch_download. Use summarize_results(read_results(path)) to total a file.
+
+    Example:
+        writer = JsonLinesWriter('results.jsonl')
+        podcast_download(rss, 'download', on_result=writer, keep_results=False)
+        writer.close()
+    '''
+
+    def __init__(self, path: str, append: bool=False):
+        '''Open the file.
+
+        Arguments:
+            path: The path of the file.
+            append: Whether to add to the end of an existing file, instead of replacing it.
+        '''
+
+        self.path = path
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def __call__(self, result: DownloadResult):
+        '''Write a result. See write().'''
+
+        self.write(result)
+
+    def write(self, result: DownloadResult):
+        '''Write a result as one line.
+
+        Arguments:
+            result: The result.
+        '''
+
+        self._file.write(json.dumps(result.to_dict(), ensure_ascii=False) + '\n')
+
+    def flush(self):
+        '''Write the buffered lines to the file.'''
+
+        self._file.flush()
+
+    def close(self):
+        '''Close the file.'''
+
+        self._file.close()
+
+def read_results(path: str):
+    '''Yields the DownloadResult objects in a file written by JsonLinesWriter, one line at a time.
+
+    Arguments:
+        path: The path of the file.
+    '''
+
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield DownloadResult.from_dict(json.loads(line))
+
+def summarize_results(results) -> dict:
+    '''Returns the totals of an iterable of DownloadResult objects, without keeping them.
+
+    Arguments:
+        results: The results.
+    '''
+
+    totals = dict.fromkeys(RESULT_TOTALS, 0)
+
+    for result in results:
+        _count_result(totals, result)
+
+    return totals
+
+def _count_result(totals: dict, result: DownloadResult):
+    '''Adds a final result to the totals.'''
+
+    totals['total_items'] += 1
+
+    if result.downloaded:
+        totals['total_downloads'] += 1
+    elif result.skipped:
+        totals['total_skipped'] += 1
+    elif result.cancelled:
+        totals['total_cancelled'] += 1
+    else:
+        totals['total_errors'] += 1
@@ -0,0 +1,279 @@
+# Retrying failed downloads.
+
+import email.utils
+import errno
+import http.client
+import random
+import socket
+import ssl
+import threading
+import time
+
+from datetime import timezone
+
+from .network import HttpStatusError
+
+# The HTTP status codes which indicate a temporary problem with the server
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+# The OSError codes which indicate a temporary network problem
+RETRYABLE_ERRNOS = frozenset(code for code in (
+    getattr(errno, name, None) for name in ('ECONNRESET', 'ECONNABORTED', 'ECONNREFUSED', 'ETIMEDOUT',
+                                            'EHOSTUNREACH', 'ENETUNREACH', 'ENETDOWN', 'ENETRESET', 'EPIPE')
+) if code is not None)
+
+# The getaddrinfo error for a name server that could not be reached in time
+RETRYABLE_GAIERRORS = frozenset(code for code in (getattr(socket, 'EAI_AGAIN', None),) if code is not None)
+
+# The longest Retry-After in seconds that is waited for by default. The wait happens on the
+# download's worker, which holds its connection slot meanwhile, so longer waits fail the download.
+MAX_RETRY_AFTER = 30.0
+
+class TemporaryError(Exception):
+    '''The base class for errors which are worth retrying.'''
+
+class CircuitOpen(Exception):
+    '''The exception that is raised when a request is not sent because its host is down.'''
+
+class RetryPolicy(object):
+    '''Decides whether a failed download is tried again, and how long to wait first.
+
+    Temporary errors (timeouts, dropped connections, unreachable hosts, TLS connections
+    closed mid-stream, truncated downloads and HTTP 408, 425, 429 and 5xx responses)
+    are retried. Anything else, such as a 404 response, an invalid certificate or a
+    full disk, fails straight away.
+
+    The wait grows exponentially with each attempt, with random "full" jitter so
+    that many failed downloads do not all retry at the same moment. If the server
+    sends a Retry-After header, it is used instead.
+    '''
+
+    def __init__(self, attempts: int=4, base_delay: float=1.0, max_delay: float=60.0,
+                 max_retry_after: float=MAX_RETRY_AFTER):
+        '''Create a RetryPolicy object.
+
+        Arguments:
+            attempts: The total number of attempts (1 for no retries).
+            base_delay: The longest wait in seconds before the first retry.
+            max_delay: The longest wait in seconds before any retry.
+            max_retry_after: The longest Retry-After header in seconds that is honoured.
+                             Longer waits are treated as a fatal error.
+        '''
+
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def is_retryable(self, error: Exception) -> bool:
+        '''Whether an error is temporary.
+
+        Arguments:
+            error: The error.
+        '''
+
+        if isinstance(error, HttpStatusError):
+            return error.code in RETRYABLE_STATUS_CODES
+
+        # socket.timeout is only a TimeoutError from Python 3.10
+        if isinstance(error, (TemporaryError, TimeoutError, socket.timeout, ConnectionError,
+                              http.client.HTTPException)):
+            return True
+
+        if isinstance(error, ssl.SSLError):
+            # The connection was closed or reset during the handshake or the transfer,
+            # rather than refused for a bad certificate or protocol
+            return isinstance(error, (ssl.SSLEOFError, ssl.SSLZeroReturnError)) or 'timed out' in str(error)
+
+        if isinstance(error, socket.gaierror):
+            return error.errno in RETRYABLE_GAIERRORS
+
+        return isinstance(error, OSError) and error.errno in RETRYABLE_ERRNOS
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        '''Returns the number of seconds to wait before the next attempt,
+        or None if the download should not be retried.
+
+        Arguments:
+            attempt: The number of the attempt that failed (starting from 1).
+            error: The error.
+        '''
+
+        if attempt >= self.attempts or not self.is_retryable(error):
+            return None
+
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def handle_failure(self, attempt: int, error: Exception, host: str=None, breaker=None) -> float:
+        '''Record a failed attempt with the circuit breaker and return the wait before the next attempt.
+
+        Returns None if the download should not be retried.
+
+        Arguments:
+            attempt: The number of the attempt that failed (starting from 1).
+            error: The error.
+            host: The host the attempt connected to.
+            breaker: The CircuitBreaker to update (None to not use one).
+        '''
+
+        if breaker is not None and self.is_retryable(error):
+            breaker.record_failure(host)
+
+        return self.delay(attempt, error)
+
+    def run(self, function, host: str=None, breaker=None, sleep=time.sleep):
+        '''Call a function, retrying it on temporary errors.
+
+        Returns the result of the function, or raises the last error.
+
+        Arguments:
+            function: The function to call, without arguments.
+            host: The host the function connects to, for the circuit breaker.
+            breaker: The CircuitBreaker to check and update (None to not use one).
+            sleep: The function used to wait between attempts.
+        '''
+
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            if breaker is not None:
+                breaker.check(host)
+
+            try:
+                result = function()
+            except Exception as e:
+                delay = self.handle_failure(attempt, e, host, breaker)
+                if delay is None:
+                    raise
+
+                sleep(delay)
+            else:
+                if breaker is not None:
+                    breaker.record_success(host)
+
+                return result
+
+class CircuitBreaker(object):
+    '''Stops sending requests to a host that is clearly down.
+
+    After `threshold` temporary failures in a row, the host's circuit "opens" and
+    requests to it fail straight away with CircuitOpen, so the workers move on to
+    other hosts. After `reset_timeout` seconds, one request is let through as a
+    trial: if it succeeds the circuit closes again, otherwise it stays open for
+    another `reset_timeout` seconds.
+
+    Safe to use from several threads at once.
+    '''
+
+    def __init__(self, threshold: int=5, reset_timeout: float=60.0):
+        '''Create a CircuitBreaker object.
+
+        Arguments:
+            threshold: The number of temporary failures in a row that open the circuit
+                       (0 to never open it).
+            reset_timeout: The number of seconds before a trial request is let through.
+        '''
+
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        # host -> the number of failures in a row
+        self._failures = {}
+
+        # host -> the time when the next trial request is allowed
+        self._opened_until = {}
+
+        self._lock = threading.Lock()
+
+    def check(self, host: str):
+        '''Raise CircuitOpen if requests to a host should not be sent now.
+
+        Arguments:
+            host: The host.
+        '''
+
+        with self._lock:
+            opened_until = self._opened_until.get(host)
+
+            if opened_until is None:
+                return
+
+            if time.monotonic() < opened_until:
+                raise CircuitOpen(f'{host} is not responding, so the download was not attempted.')
+
+            # Let this request through as a trial, and hold back the others until it finishes
+            self._opened_until[host] = time.monotonic() + self.reset_timeout
+
+    def is_open(self, host: str) -> bool:
+        '''Whether requests to a host are currently being refused.
+
+        Arguments:
+            host: The host.
+        '''
+
+        with self._lock:
+            opened_until = self._opened_until.get(host)
+
+            return opened_until is not None and time.monotonic() < opened_until
+
+    def record_success(self, host: str):
+        '''Record a successful request, closing the host's circuit.
+
+        Arguments:
+            host: The host.
+        '''
+
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_until.pop(host, None)
+
+    def record_failure(self, host: str):
+        '''Record a temporary failure, opening the host's circuit if there were too many in a row.
+
+        Arguments:
+            host: The host.
+        '''
+
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+
+            if self.threshold and failures >= self.threshold:
+                self._opened_until[host] = time.monotonic() + self.reset_timeout
+
+def _retry_after(error: Exception):
+    '''Returns the Retry-After header of an HTTP error in seconds, or None if there is none.'''
+
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        return None
+
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    # The header may also be an HTTP date
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if date is None:
+        return None
+
+    # A date without a time zone (such as "-0000") is in UTC, not local time
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return max(0.0, date.timestamp() - time.time())
@@ -0,0 +1,382 @@
+# Classes for running episode downloads concurrently.
+
+import itertools
+import threading
+
+from collections import deque, OrderedDict
+from urllib.parse import urlsplit
+
+from .selection import parse_date
+
+# The download orders
+# The order of the feed
+ORDER_FEED = 'feed'
+# The newest episodes first, by their publication date
+ORDER_NEWEST = 'newest'
+# The smallest files first, by the length in the feed, so the most episodes finish soonest
+ORDER_SMALLEST = 'smallest'
+# The podcasts take turns, each in feed order
+ORDER_ROUND_ROBIN = 'round-robin'
+
+def url_host(url: str) -> str:
+    '''Returns the host (and port, if any) of a URL in lower case.
+
+    Arguments:
+        url: The URL.
+    '''
+
+    return urlsplit(url).netloc.lower()
+
+class HostSlots(object):
+    '''The connections open to each host, and the most allowed at once.
+
+    Shared by a Scheduler, which holds one slot for each running job, and the segmented
+    downloads run by those jobs (see modules.transfer.SegmentedDownload), which only
+    download more than one range at once while their host has free slots. So the
+    per-host limit counts every connection, not just every file. An overall limit can
+    also be set (such as the number of workers), so the ranges count against it too.
+
+    Safe to use from several threads at once.
+    '''
+
+    def __init__(self, limit: int=0, total: int=0):
+        '''Create a HostSlots object.
+
+        Arguments:
+            limit: The maximum number of connections to each host (0 for no limit).
+            total: The maximum number of connections to all the hosts together (0 for no limit).
+        '''
+
+        self.limit = max(0, limit)
+        self.total = max(0, total)
+
+        # Notified whenever a slot is released. The Scheduler waits for its jobs on it too.
+        self.condition = threading.Condition()
+
+        # The number of slots held for each host
+        self._active = {}
+
+    def has_free(self, host: str) -> bool:
+        '''Whether a host has a free slot.
+
+        Arguments:
+            host: The host.
+        '''
+
+        with self.condition:
+            free = self._free(host)
+
+            return free is None or free > 0
+
+    def acquire(self, host: str):
+        '''Take a slot for a host, even if it has none free (check has_free() first,
+        while holding the condition lock).
+
+        Arguments:
+            host: The host.
+        '''
+
+        with self.condition:
+            self._active[host] = self._active.get(host, 0) + 1
+
+    def acquire_free(self, host: str, count: int) -> int:
+        '''Take up to count of the free slots of a host, without waiting.
+        Returns the number of slots taken, which must be passed to release().
+
+        Arguments:
+            host: The host.
+            count: The most slots to take.
+        '''
+
+        with self.condition:
+            free = self._free(host)
+            taken = max(0, min(count, free)) if free is not None else max(0, count)
+            self._active[host] = self._active.get(host, 0) + taken
+
+            return taken
+
+    def release(self, host: str, count: int=1):
+        '''Return the slots taken for a host.
+
+        Arguments:
+            host: The host.
+            count: The number of slots.
+        '''
+
+        if count <= 0:
+            return
+
+        with self.condition:
+            self._active[host] -= count
+            self.condition.notify_all()
+
+    def _free(self, host: str):
+        '''Returns the number of free slots for a host, or None if there is no limit.
+        Must be called while holding the condition lock.'''
+
+        free = []
+
+        if self.limit:
+            free.append(self.limit - self._active.get(host, 0))
+
+        if self.total:
+            free.append(self.total - sum(self._active.values()))
+
+        return min(free) if free else None
+
+class Scheduler(object):
+    '''Runs jobs on a pool of worker threads.
+
+    Each job belongs to a host, and no more than `host_limit` jobs for the same host
+    will run at once, so that a single server is not hit by every worker.
+
+    Each job also belongs to a group (by default, its host). The groups take turns
+    (round-robin), so a group with many jobs, such as a feed with a huge back catalog,
+    can not starve the others. Jobs in the same group run in the order they were submitted.
+
+    If ordered is True, the groups do not take turns: each worker starts the earliest
+    submitted job whose host is under its limit, so the jobs start in the order they
+    were submitted (such as newest first), apart from those held back by the host limit.
+
+    The running jobs are counted in a HostSlots object, which can be shared with the
+    segmented downloads the jobs run, so their extra connections count against the same limit.
+
+    Example:
+        scheduler = Scheduler(workers=4, host_limit=2)
+        scheduler.start()
+        scheduler.submit('example.com', print, 'Hello')
+        scheduler.close()
+        scheduler.join()
+    '''
+
+    def __init__(self, workers: int=1, host_limit: int=0, ordered: bool=False, slots: HostSlots=None):
+        '''Create a Scheduler object.
+
+        Arguments:
+            workers: The number of worker threads.
+            host_limit: The maximum number of jobs running at once for each host (0 for no limit).
+            ordered: Whether to start the jobs in the order they were submitted,
+                     instead of the groups taking turns.
+            slots: If supplied, the HostSlots the running jobs are counted in (shared with
+                   the segmented downloads), whose limit is used instead of host_limit.
+        '''
+
+        self.workers = max(1, workers)
+        self.slots = slots or HostSlots(host_limit)
+        self.host_limit = self.slots.limit
+        self.ordered = ordered
+
+        # The queued (submission number, (host, function, args, kwargs)) jobs for each group, in turn order
+        self._queues = OrderedDict()
+        self._submitted = itertools.count()
+
+        # The first exception raised by a job, if any
+        self._error = None
+
+        self._closed = False
+
+        # Shared with the slots, so the workers wake up when any slot is released
+        self._condition = self.slots.condition
+        self._threads = []
+
+    def start(self):
+        '''Start the worker threads.'''
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, host: str, function, *args, **kwargs):
+        '''Queue a job in the group for its host.
+
+        Arguments:
+            host: The host the job connects to.
+            function: The function to run.
+            args, kwargs: The arguments for the function.
+        '''
+
+        self.submit_group(host, host, function, *args, **kwargs)
+
+    def submit_group(self, group, host: str, function, *args, **kwargs):
+        '''Queue a job in a group.
+
+        Arguments:
+            group: The group the job belongs to (any hashable value, such as a feed URL).
+            host: The host the job connects to.
+            function: The function to run.
+            args, kwargs: The arguments for the function.
+        '''
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Cannot submit a job to a closed scheduler.')
+
+            self._queues.setdefault(group, deque()).append((next(self._submitted), (host, function, args, kwargs)))
+            self._condition.notify()
+
+    def close(self):
+        '''Stop accepting jobs. The worker threads exit once the queued jobs are finished.'''
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def join(self):
+        '''Wait for all the jobs to finish.
+
+        Re-raises the first exception raised by a job, if any.
+        '''
+
+        for thread in self._threads:
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _can_run(self, host: str) -> bool:
+        '''Whether another job for a host can be started.'''
+
+        return self.slots.has_free(host)
+
+    def _next_job(self):
+        '''Wait for the next job that can be run.
+
+        Returns a (host, function, args, kwargs) tuple, or None if there are no more jobs.
+        Must be called while holding the condition lock.
+        '''
+
+        while True:
+            # Only the first job in each group can be started, to keep the group in order
+            runnable = [group for group, jobs in self._queues.items() if self._can_run(jobs[0][1][0])]
+
+            if runnable:
+                if self.ordered:
+                    # The earliest submitted job that can run
+                    group = min(runnable, key=lambda group: self._queues[group][0][0])
+                else:
+                    # The first group in turn order
+                    group = runnable[0]
+
+                jobs = self._queues[group]
+                job = jobs.popleft()[1]
+
+                if jobs:
+                    # Move the group to the back so that groups take turns
+                    self._queues.move_to_end(group)
+                else:
+                    del self._queues[group]
+
+                return job
+
+            if self._closed and not self._queues:
+                return None
+
+            self._condition.wait()
+
+    def _work(self):
+        '''The worker thread loop.'''
+
+        while True:
+            with self._condition:
+                job = self._next_job()
+
+                if job is None:
+                    return
+
+                host = job[0]
+                self.slots.acquire(host)
+
+            try:
+                job[1](*job[2], **job[3])
+            except Exception as e:
+                with self._condition:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self.slots.release(host)
+
+class QueuedDownload(object):
+    '''An episode waiting to be downloaded, as seen by the download orders.'''
+
+    __slots__ = ('group', 'episode', 'job')
+
+    def __init__(self, group, episode, job):
+        '''Create a QueuedDownload object.
+
+        Arguments:
+            group: The podcast the episode belongs to (any hashable value, such as the feed URL).
+            episode: The modules.podcast.Episode.
+            job: The caller's record of the download, which is passed through unchanged.
+        '''
+
+        self.group = group
+        self.episode = episode
+        self.job = job
+
+def feed_order(downloads: list) -> list:
+    '''Returns the downloads in the order they were queued.'''
+
+    return list(downloads)
+
+def newest_first(downloads: list) -> list:
+    '''Returns the downloads with the newest episodes first. Episodes without a valid
+    date go last, and episodes with the same date keep their order.'''
+
+    def key(download: QueuedDownload) -> tuple:
+        timestamp = parse_date(download.episode.date)
+        return (timestamp is None, -(timestamp or 0))
+
+    return sorted(downloads, key=key)
+
+def smallest_first(downloads: list) -> list:
+    '''Returns the downloads with the smallest files first, by the length in the feed.
+    Files of unknown length go last, and files of the same length keep their order.'''
+
+    return sorted(downloads, key=lambda download: (not download.episode.length, download.episode.length or 0))
+
+def round_robin(downloads: list) -> list:
+    '''Returns the downloads with the podcasts taking turns, in the order each podcast
+    first appears. The episodes of each podcast keep their order.'''
+
+    # The downloads of each podcast, in turn order
+    queues = OrderedDict()
+    for download in downloads:
+        queues.setdefault(download.group, deque()).append(download)
+
+    ordered = []
+
+    while queues:
+        for group in list(queues):
+            jobs = queues[group]
+            ordered.append(jobs.popleft())
+
+            if not jobs:
+                del queues[group]
+
+    return ordered
+
+# The download orders by name. Any function which takes and returns a list
+# of QueuedDownload objects can also be used as an order.
+DOWNLOAD_ORDERS = OrderedDict((
+    (ORDER_FEED, feed_order),
+    (ORDER_NEWEST, newest_first),
+    (ORDER_SMALLEST, smallest_first),
+    (ORDER_ROUND_ROBIN, round_robin),
+))
+
+def order_downloads(downloads: list, order) -> list:
+    '''Returns the downloads in the order they should start.
+
+    Arguments:
+        downloads: A list of QueuedDownload objects.
+        order: The name of an order in DOWNLOAD_ORDERS, or a function which
+               takes and returns a list of QueuedDownload objects.
+    '''
+
+    function = order if callable(order) else DOWNLOAD_ORDERS.get(order)
+
+    if function is None:
+        raise ValueError(f'Invalid download order: {order}')
+
+    return function(downloads)
@@ -0,0 +1,169 @@
+# Choosing which episodes of a podcast to download.
+
+import datetime
+import email.utils
+import re
+
+# The <item> child elements a selection can look at
+SELECTION_ELEMENTS = ('guid', 'title', 'pubDate')
+
+class EpisodeSelection(object):
+    '''Chooses the episodes of a podcast to download.
+
+    An episode is selected if it passes every filter that is set: its GUID is in
+    `guids`, its title matches the `title` regular expression, and its date is
+    between `since` and `until`. Of those, at most `latest` episodes are selected.
+
+    The filters only read the <guid>, <title> and <pubDate> of each <item>, so
+    modules.podcast.Episode objects are never built for the episodes that are left out.
+    The selection also stops reading the feed as soon as no more episodes can be
+    selected: once `latest` episodes have been selected, once every GUID in `guids` has
+    been found, or at the first episode older than `since`. The last of these relies on
+    the feed listing its episodes newest first, as almost every feed does; set
+    newest_first to False for a feed which does not.
+
+    Example:
+        # The five latest episodes published in 2018
+        selection = EpisodeSelection(latest=5, until=datetime.datetime(2019, 1, 1))
+        episodes = iter_remote_episodes(url, selection=selection)
+    '''
+
+    def __init__(self, latest: int=None, since: datetime.datetime=None, until: datetime.datetime=None,
+                 title: str=None, guids=None, newest_first: bool=True):
+        '''Create an EpisodeSelection object.
+
+        Arguments:
+            latest: The largest number of episodes to select (None for no limit).
+            since: If supplied, only select episodes published at or after this time.
+            until: If supplied, only select episodes published before this time.
+                   Times without a time zone are taken to be UTC.
+            title: If supplied, only select episodes whose title matches this regular expression
+                   (anywhere in the title, ignoring case).
+            guids: If supplied, only select the episodes with these GUIDs.
+            newest_first: Whether the feed lists its episodes newest first.
+        '''
+
+        if latest is not None and latest < 0:
+            raise ValueError('The number of episodes can not be negative.')
+
+        self.latest = latest
+        self.since = _timestamp(since) if since is not None else None
+        self.until = _timestamp(until) if until is not None else None
+        self.title = re.compile(title, re.IGNORECASE) if title is not None else None
+        self.guids = frozenset(guids) if guids is not None else None
+        self.newest_first = newest_first
+
+    def select_items(self, items):
+        '''Yields the selected <item> elements, stopping as soon as no more can be selected.
+
+        Arguments:
+            items: An iterable of <item> elements, in feed order.
+        '''
+
+        return self._select(items, _item_fields)
+
+    def select(self, episodes):
+        '''Yields the selected Episode objects, stopping as soon as no more can be selected.
+
+        Arguments:
+            episodes: An iterable of modules.podcast.Episode objects, in feed order.
+        '''
+
+        return self._select(episodes, _episode_fields)
+
+    def _select(self, entries, fields):
+        '''Yields the selected entries.
+
+        Arguments:
+            entries: An iterable of <item> elements or Episode objects.
+            fields: The function returning the (GUID, title, pubDate) of an entry.
+        '''
+
+        if self.latest == 0:
+            return
+
+        selected = 0
+
+        # The GUIDs in the allowlist which have not been found yet
+        missing = set(self.guids) if self.guids is not None else None
+
+        for entry in entries:
+            guid, title, date = fields(entry)
+
+            if missing is not None and guid not in missing:
+                continue
+
+            if self.since is not None or self.until is not None:
+                timestamp = parse_date(date)
+
+                if timestamp is None:
+                    continue
+
+                if self.since is not None and timestamp < self.since:
+                    if self.newest_first:
+                        # The rest of the feed is older still
+                        return
+                    continue
+
+                if self.until is not None and timestamp >= self.until:
+                    continue
+
+            if self.title is not None and not self.title.search(title or ''):
+                continue
+
+            yield entry
+
+            selected += 1
+
+            if missing is not None:
+                missing.discard(guid)
+
+                if not missing:
+                    return
+
+            if self.latest is not None and selected >= self.latest:
+                return
+
+def parse_date(date: str):
+    '''Returns an RSS <pubDate> (RFC 822) as a Unix timestamp, or None if it is missing or invalid.
+
+    Arguments:
+        date: The text of the <pubDate> element.
+    '''
+
+    if not date:
+        return None
+
+    try:
+        parsed = email.utils.parsedate_to_datetime(date.strip())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+    if parsed is None:
+        return None
+
+    return _timestamp(parsed)
+
+def _timestamp(time: datetime.datetime) -> float:
+    '''Returns a datetime as a Unix timestamp, taking times without a time zone to be UTC.'''
+
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+
+    return time.timestamp()
+
+def _item_fields(item) -> tuple:
+    '''Returns the (GUID, title, pubDate) text of an <item> element, in a single pass over its children.'''
+
+    fields = {}
+
+    for child in item:
+        if child.tag in SELECTION_ELEMENTS:
+            fields[child.tag] = child.text
+
+    return fields.get('guid'), fields.get('title'), fields.get('pubDate')
+
+def _episode_fields(episode) -> tuple:
+    '''Returns the (GUID, title, pubDate) of an Episode object.'''
+
+    return episode.guid, episode.title, episode.date
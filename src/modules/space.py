@@ -0,0 +1,198 @@
+# Checking there is room on the disk for a file before it is downloaded.
+
+import os
+import shutil
+import threading
+
+# The space in bytes always left free on the disk by default (none: the floor is opt-in)
+MIN_FREE_SPACE = 0
+
+# Files up to this size in bytes are never paused, only checked against the free space
+SMALL_FILE_SIZE = 1000 * 1000
+
+# The number of seconds between checks of the free space while a download is paused
+PAUSE_INTERVAL = 1.0
+
+class InsufficientSpace(Exception):
+    '''The exception for a file that does not fit on the disk.'''
+
+class SpaceReservation(object):
+    '''The disk space set aside for a file being downloaded.'''
+
+    __slots__ = ('path', 'device', 'size', 'start')
+
+    def __init__(self, path: str, device: int, size: int, start: int):
+        '''Create a SpaceReservation object.
+
+        Arguments:
+            path: The path of the file being written.
+            device: The device the file is on.
+            size: The number of bytes set aside.
+            start: The number of bytes used by the file when the space was set aside.
+        '''
+
+        self.path = path
+        self.device = device
+        self.size = size
+        self.start = start
+
+    def remaining(self) -> int:
+        '''Returns the number of bytes set aside which the file has not used yet.'''
+
+        return max(0, self.size - (_used_bytes(self.path) - self.start))
+
+class DiskSpace(object):
+    '''Admission control for downloads: a file is only started once the disk has room for it.
+
+    The room a download needs is the length of the file given by the feed, less
+    whatever an earlier attempt already saved in its .part file. The space is set aside
+    until the download ends, so the downloads running at once can not each see the same
+    free space and fill the disk between them. A floor of free space can also be kept (min_free).
+
+    A file that does not fit while other downloads are running is paused until they
+    finish, and the free space is measured again. If it still does not fit once nothing
+    else is running, InsufficientSpace is raised, so the episode is reported as failed
+    and the next (possibly smaller) episode is tried, instead of every later download
+    failing on a full disk.
+
+    Files of unknown length and files up to SMALL_FILE_SIZE are never paused: they are
+    only refused if the disk is already out of space (or below the floor).
+
+    Example:
+        space = DiskSpace()
+        reservation = space.reserve('download/episode.mp3.part', episode.length)
+        try:
+            ...
+        finally:
+            space.release(reservation)
+    '''
+
+    def __init__(self, min_free: int=MIN_FREE_SPACE, enabled: bool=True):
+        '''Create a DiskSpace object.
+
+        Arguments:
+            min_free: The space in bytes always left free on the disk (0 for no floor).
+            enabled: Whether to check the space (False to start every download straight away).
+        '''
+
+        self.min_free = max(0, min_free)
+        self.enabled = enabled
+
+        # The reservations of the downloads in progress
+        self._reservations = []
+
+        self._condition = threading.Condition()
+
+    def available(self, directory: str) -> int:
+        '''Returns the bytes which can still be set aside on the disk of a directory.
+
+        Arguments:
+            directory: The directory.
+        '''
+
+        with self._condition:
+            return self._available(directory, _device(directory))
+
+    def reserve(self, path: str, length: int=None, check_cancelled=None) -> SpaceReservation:
+        '''Set aside the space for a file, pausing while other downloads are running if it does not fit.
+
+        Returns the reservation, which must be passed to release() when the download ends
+        (None if the space is not checked).
+
+        Raises InsufficientSpace if the file does not fit, even with no other downloads running.
+        Files of unknown length and small files are not paused (see DiskSpace).
+
+        Arguments:
+            path: The path of the file which will be written (such as the .part file).
+            length: The size of the finished file, if known.
+            check_cancelled: A function called while paused, which raises an exception
+                             to stop waiting (such as TransferOptions.check_cancelled).
+        '''
+
+        if not self.enabled:
+            return None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        device = _device(directory)
+        start = _used_bytes(path)
+        needed = max(0, length - start) if length else 0
+
+        with self._condition:
+            while True:
+                if needed <= SMALL_FILE_SIZE:
+                    # Not worth waiting for: only the space actually free on the disk is checked
+                    available = self._available(directory, device, reserved=False)
+                else:
+                    available = self._available(directory, device)
+
+                if needed <= available and available >= 0:
+                    reservation = SpaceReservation(path, device, needed, start)
+                    self._reservations.append(reservation)
+
+                    return reservation
+
+                if needed <= SMALL_FILE_SIZE or not any(reservation.device == device
+                                                       for reservation in self._reservations):
+                    raise InsufficientSpace(
+                        f'{os.path.basename(path)} needs {_megabytes(needed)} MB, but only '
+                        f'{_megabytes(max(0, available))} MB of the disk can be used '
+                        f'({_megabytes(self.min_free)} MB is kept free).'
+                    )
+
+                # Wait for the other downloads, which may use less space than they set aside
+                self._condition.wait(PAUSE_INTERVAL)
+
+                if check_cancelled is not None:
+                    check_cancelled()
+
+    def release(self, reservation: SpaceReservation):
+        '''Return the space set aside for a file, once its download has ended.
+
+        Arguments:
+            reservation: The reservation returned by reserve() (None is ignored).
+        '''
+
+        if reservation is None:
+            return
+
+        with self._condition:
+            self._reservations.remove(reservation)
+            self._condition.notify_all()
+
+    def _available(self, directory: str, device: int, reserved: bool=True) -> int:
+        '''Returns the free bytes on a disk, less the space kept free and (if reserved is True)
+        the space set aside. Must be called while holding the condition lock.'''
+
+        free = shutil.disk_usage(directory).free - self.min_free
+
+        if not reserved:
+            return free
+
+        return free - sum(reservation.remaining() for reservation in self._reservations
+                          if reservation.device == device)
+
+def _device(directory: str) -> int:
+    '''Returns the device a directory is on.'''
+
+    return os.stat(directory).st_dev
+
+def _used_bytes(path: str) -> int:
+    '''Returns the disk space used by a file, or 0 if it does not exist.
+
+    Uses the allocated blocks where they are known, since a preallocated file
+    can be larger than the space it uses.
+    '''
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+
+    blocks = getattr(stat, 'st_blocks', None)
+
+    return min(stat.st_size, blocks * 512) if blocks is not None else stat.st_size
+
+def _megabytes(size: int) -> str:
+    '''Returns a size in bytes as megabytes, with one decimal place.'''
+
+    return f'{size / 1000000:.1f}'
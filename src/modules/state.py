@@ -0,0 +1,160 @@
+# The record of downloaded episodes kept in each output directory.
+
+import json
+import os
+import threading
+
+from .podcast import Episode
+from .verify import HASH_ALGORITHM, file_digest
+
+# The state file name, saved in the output directory
+STATE_FILENAME = '.podcast_downloader.json'
+
+# The version of the state file format
+STATE_VERSION = 1
+
+class StateStore(object):
+    '''The episodes that have been downloaded to an output directory, keyed by GUID.
+
+    Each record holds the enclosure URL, the file size and the final file name,
+    so later runs can skip episodes that have not changed since they were downloaded.
+    Files that passed modules.verify also have their hash and modification time
+    recorded: a file whose modification time has changed is hashed again before it is skipped.
+
+    The store is safe to update from several threads at once.
+    '''
+
+    def __init__(self, output_dir: str):
+        '''Load the state store for an output directory.
+
+        A missing or unreadable state file is treated as an empty store.
+
+        Arguments:
+            output_dir: The full path of the output directory.
+        '''
+
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, STATE_FILENAME)
+
+        # GUID -> {'url': str, 'size': int, 'file': str, 'length': int or None,
+        #          'sha256': str (if verified), 'mtime': int (if verified)}
+        self.episodes = {}
+
+        self._lock = threading.Lock()
+        self._changed = False
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+
+            if state.get('version') == STATE_VERSION:
+                self.episodes = state['episodes']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def is_downloaded(self, episode: Episode, filename: str, index=None) -> bool:
+        '''Whether an episode was downloaded to a file and has not changed since.
+
+        Arguments:
+            episode: The episode.
+            filename: The file name the episode would be saved as.
+            index: If supplied, the modules.planner.DirectoryIndex of the output directory,
+                   which is used for the file size instead of checking the disk.
+        '''
+
+        record = self.episodes.get(episode.guid)
+
+        if record is None or record['url'] != episode.url or record['file'] != filename:
+            return False
+
+        # The feed lists a different size from when it was downloaded, so the episode has been replaced
+        if episode.length is not None and (record.get('length') or record['size']) != episode.length:
+            return False
+
+        path = os.path.join(self.output_dir, filename)
+
+        # The file has been deleted or replaced since it was downloaded
+        if index is not None:
+            size = index.size(filename)
+            mtime = index.mtime(filename)
+        else:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+
+            size = stat.st_size
+            mtime = stat.st_mtime_ns
+
+        if size != record['size']:
+            return False
+
+        if record.get(HASH_ALGORITHM) is None or mtime == record.get('mtime'):
+            return True
+
+        # The file has been written to since it was verified, so check that its contents are the same
+        try:
+            if file_digest(path) != record[HASH_ALGORITHM]:
+                return False
+        except OSError:
+            return False
+
+        with self._lock:
+            record['mtime'] = mtime
+            self._changed = True
+
+        return True
+
+    def record(self, episode: Episode, filename: str, size: int, digest: str=None, mtime: int=None):
+        '''Record that an episode was downloaded.
+
+        Arguments:
+            episode: The episode.
+            filename: The file name the episode was saved as.
+            size: The size of the file in bytes.
+            digest: The hex digest of the file (see modules.verify), if it was verified.
+            mtime: The modification time of the file in nanoseconds when it was verified.
+        '''
+
+        record = {
+            'url': episode.url,
+            'size': size,
+            'file': filename,
+            'length': episode.length,
+        }
+
+        if digest is not None:
+            record[HASH_ALGORITHM] = digest
+            record['mtime'] = mtime
+
+        with self._lock:
+            self.episodes[episode.guid] = record
+            self._changed = True
+
+    def clear(self):
+        '''Forget all downloaded episodes, so that everything is downloaded again.'''
+
+        with self._lock:
+            self.episodes = {}
+            self._changed = True
+
+    def save(self):
+        '''Write the state file, if anything has changed.
+
+        The file is written to a temporary name first, so an interrupted save
+        never leaves a corrupt state file behind.
+        '''
+
+        with self._lock:
+            if not self._changed:
+                return
+
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'version': STATE_VERSION,
+                    'episodes': self.episodes,
+                }, file)
+
+            os.replace(temporary_path, self.path)
+            self._changed = False
@@ -0,0 +1,740 @@
+# Resumable file downloads.
+
+import concurrent.futures
+import copy
+import http.client
+import json
+import os
+import threading
+import time
+
+from .network import get_default_client
+from .retry import CircuitBreaker, RetryPolicy, TemporaryError
+from .scheduler import HostSlots, url_host
+from .space import DiskSpace
+from .verify import VERIFY_WORKERS
+from .writer import FSYNC_NEVER, StreamWriter, allocate_file, replace_file
+
+# Unfinished downloads are written to the final path with this suffix
+PART_SUFFIX = '.part'
+
+# The validators of an unfinished download are kept next to it with this suffix
+META_SUFFIX = '.part.json'
+
+# The number of bytes read from the network at a time
+CHUNK_SIZE = 64 * 1024
+
+# Files smaller than this are never downloaded in segments
+SEGMENT_THRESHOLD = 32 * 1024 * 1024
+
+# A response body up to this size is read to the end when it is not needed, so its connection can be reused
+DRAIN_LIMIT = 64 * 1024
+
+class TransferOptions(object):
+    '''The settings shared by every file download in a run.
+
+    Example:
+        options = TransferOptions(client=HttpClient(timeout=10), chunk_size=1024 * 1024)
+        podcast_download(rss, output_dir='download', options=options)
+    '''
+
+    def __init__(self, client=None, chunk_size: int=CHUNK_SIZE, preallocate: bool=False,
+                 fsync: str=FSYNC_NEVER, limiter=None, retry: RetryPolicy=None,
+                 breaker: CircuitBreaker=None, segments: int=1, segment_threshold: int=SEGMENT_THRESHOLD,
+                 cancel: threading.Event=None, verify_workers: int=VERIFY_WORKERS,
+                 disk_space: DiskSpace=None, host_slots: HostSlots=None):
+        '''Create a TransferOptions object.
+
+        Arguments:
+            client: The modules.network.HttpClient to use (by default, the shared client).
+            chunk_size: The number of bytes read from the network at a time.
+            preallocate: Whether to reserve the disk space for each file before it is
+                         downloaded, using the Content-Length header or the length in the feed.
+            fsync: The fsync policy for the downloaded files (see modules.writer).
+            limiter: The modules.ratelimit.RateLimiter for the bandwidth and request rate
+                     (None for no limits).
+            retry: The modules.retry.RetryPolicy for failed downloads
+                   (by default, RetryPolicy(). Use RetryPolicy(attempts=1) to never retry).
+            breaker: The modules.retry.CircuitBreaker shared by the downloads
+                     (by default, a new CircuitBreaker(). Use CircuitBreaker(threshold=0) to disable it).
+            segments: The number of byte ranges of a large file downloaded in parallel
+                      (1 to always download files in a single stream).
+            segment_threshold: The smallest file in bytes that is downloaded in segments.
+            cancel: A threading.Event which cancels the downloads when it is set
+                    (None if the downloads can not be cancelled).
+            verify_workers: The number of downloaded files checked and hashed at once,
+                            on threads separate from the downloads (0 to not check them).
+                            See modules.verify.
+            disk_space: The modules.space.DiskSpace shared by the downloads, which only starts
+                        a file once the disk has room for it (by default, a new DiskSpace().
+                        Use DiskSpace(enabled=False) to disable it).
+            host_slots: The modules.scheduler.HostSlots counting the connections to each host,
+                        which a segmented download takes its extra connections from
+                        (None for no limit). Set by podcast_download and batch_download
+                        for the downloads run by their scheduler.
+        '''
+
+        self.client = client or get_default_client()
+        self.chunk_size = chunk_size
+        self.preallocate = preallocate
+        self.fsync = fsync
+        self.limiter = limiter
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.segments = max(1, segments)
+        self.segment_threshold = segment_threshold
+        self.cancel = cancel
+        self.verify_workers = verify_workers
+        self.disk_space = disk_space or DiskSpace()
+        self.host_slots = host_slots
+
+    def check_cancelled(self):
+        '''Raise DownloadCancelled if the downloads have been cancelled.'''
+
+        if self.cancel is not None and self.cancel.is_set():
+            raise DownloadCancelled('The download was cancelled.')
+
+    def copy(self, **changes):
+        '''Returns a copy of the options with some settings changed.
+
+        Arguments:
+            changes: The settings to change, as keyword arguments.
+        '''
+
+        options = copy.copy(self)
+
+        for name, value in changes.items():
+            setattr(options, name, value)
+
+        return options
+
+class IncompleteDownload(TemporaryError):
+    '''The exception that is raised when a download ends before the expected length.'''
+
+class DownloadCancelled(Exception):
+    '''The exception that is raised when a download is stopped by TransferOptions.cancel.'''
+
+class _SegmentsUnsupported(Exception):
+    '''The exception that is raised when a segmented download has to fall back to a single stream.'''
+
+class PartialDownload(object):
+    '''A download to a .part file which is renamed to the final path once it is finished.
+
+    If a .part file from an earlier attempt exists, the download continues where
+    it stopped with an HTTP Range request. The request is validated with the
+    ETag or Last-Modified header of the earlier attempt (using If-Range), so if
+    the remote file has changed, or the server ignores ranges, the whole file is
+    downloaded again.
+
+    Example:
+        download = PartialDownload('https://example.com/episode.mp3', 'episode.mp3')
+        download.open()
+        try:
+            while download.read_chunk():
+                pass
+            download.finish()
+        finally:
+            download.close()
+    '''
+
+    def __init__(self, url: str, filepath: str, options: TransferOptions=None, length: int=None):
+        '''Create a PartialDownload object.
+
+        Arguments:
+            url: The URL of the file.
+            filepath: The final path of the file.
+            options: The transfer settings (by default, TransferOptions()).
+            length: The expected size of the file from the feed, if known.
+                    Only used to preallocate the file if the server does not send its length.
+        '''
+
+        self.options = options or TransferOptions()
+        self.url = url
+        self.host = url_host(url)
+        self.filepath = filepath
+        self.part_path = filepath + PART_SUFFIX
+        self.meta_path = filepath + META_SUFFIX
+        self.length = length
+
+        # The number of bytes in the .part file
+        self.position = 0
+
+        # The number of bytes the file should have in total (None if unknown)
+        self.total = None
+
+        # Whether the download continued from an earlier attempt
+        self.resumed = False
+
+        # The seconds from sending the request to receiving the response headers
+        self.latency = None
+
+        self.response = None
+        self.writer = None
+
+        # The validators saved for the .part file
+        self._meta = None
+
+    def open(self):
+        '''Send the request and open the .part file.'''
+
+        client = self.options.client
+        limiter = self.options.limiter
+        headers = {}
+        resume_from = self._resume_position()
+
+        if resume_from:
+            headers['Range'] = f'bytes={resume_from}-'
+            headers['If-Range'] = self._meta.get('etag') or self._meta.get('last_modified')
+
+        self.options.check_cancelled()
+
+        if limiter is not None:
+            limiter.request(self.host)
+
+        sent = time.monotonic()
+        self.response = client.get(self.url, headers)
+        self.latency = time.monotonic() - sent
+
+        if self.response.status == 416 and resume_from:
+            # The range is not satisfiable, so the .part file is either complete or invalid
+            total = _content_range_total(self.response.headers.get('Content-Range'))
+            self.response.read()
+            self.response.close()
+            self.response = None
+
+            if total == resume_from:
+                self.position = self.total = total
+                self.resumed = True
+                return
+
+            # Start again from the beginning
+            self._discard_part()
+
+            if limiter is not None:
+                limiter.request(self.host)
+
+            self.response = client.get(self.url)
+
+        self.response.raise_for_status()
+
+        if self.response.status == 206 and resume_from:
+            # The server continued from the end of the .part file
+            start = _content_range_start(self.response.headers.get('Content-Range'))
+            if start != resume_from:
+                self.response.close()
+                raise IncompleteDownload(f'The server returned the wrong range for {self.url}.')
+
+            self.position = resume_from
+            self.resumed = True
+        else:
+            # The server sent the whole file
+            self.position = 0
+            self._meta = self._response_validators()
+
+        self.writer = StreamWriter(self.part_path, self.position, self.options.chunk_size,
+                                   self.options.fsync)
+
+        length = self.response.headers.get('Content-Length')
+        if length is not None:
+            self.total = self.position + int(length)
+
+        if self.options.preallocate and (self.total or self.length):
+            self.writer.preallocate(self.total or self.length)
+
+        self._save_meta()
+
+    def read_chunk(self) -> int:
+        '''Copy the next chunk of the response to the .part file.
+
+        Returns the number of bytes written, which is 0 once the response is finished.
+        '''
+
+        if self.response is None:
+            return 0
+
+        # The .part file is kept, so a cancelled download can be resumed
+        self.options.check_cancelled()
+
+        size = self.writer.write_from(self.response)
+        self.position += size
+
+        if self.options.limiter is not None and size:
+            # Wait here if the bandwidth limit has been reached
+            self.options.limiter.transfer(self.host, size)
+
+        return size
+
+    def finish(self):
+        '''Check the length of the .part file and rename it to the final path.'''
+
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+        if self.total is not None and self.position != self.total:
+            self.close()
+            raise IncompleteDownload(
+                f'Downloaded {self.position} of {self.total} bytes from {self.url}.'
+            )
+
+        if self.writer is not None:
+            self.writer.finish()
+            self.writer = None
+
+        replace_file(self.part_path, self.filepath, self.options.fsync)
+
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+    def close(self):
+        '''Close the response and the .part file. The .part file is kept so the download can be resumed.'''
+
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+        if self.writer is not None:
+            preallocated = self.writer.preallocated
+
+            # The writer trims any preallocated space, so the .part file can be resumed
+            self.writer.close()
+            self.writer = None
+
+            if preallocated:
+                self._save_meta()
+
+    def _resume_position(self) -> int:
+        '''Returns the size of a .part file that can be resumed, or 0 if there is none.'''
+
+        if not os.path.isfile(self.part_path):
+            return 0
+
+        try:
+            with open(self.meta_path, 'r') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return 0
+
+        # A preallocated .part file that was never trimmed (for example, after a crash)
+        # is longer than the data written, so it can not be resumed
+        if meta.get('url') != self.url or meta.get('preallocated'):
+            return 0
+
+        if not meta.get('etag') and not meta.get('last_modified'):
+            return 0
+
+        self._meta = meta
+
+        return os.path.getsize(self.part_path)
+
+    def _response_validators(self):
+        '''Returns the validators of the response, or None if it can not be resumed.
+
+        Weak ETags can not be used to resume a download, so they are ignored.
+        '''
+
+        etag = self.response.headers.get('ETag')
+        if etag and etag.startswith('W/'):
+            etag = None
+        last_modified = self.response.headers.get('Last-Modified')
+
+        if not etag and not last_modified:
+            return None
+
+        return {
+            'url': self.url,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+
+    def _save_meta(self):
+        '''Save the validators next to the .part file, or remove them if there are none.'''
+
+        if self._meta is None:
+            if os.path.exists(self.meta_path):
+                os.remove(self.meta_path)
+            return
+
+        self._meta['preallocated'] = self.writer is not None and self.writer.preallocated
+
+        with open(self.meta_path, 'w') as file:
+            json.dump(self._meta, file)
+
+    def _discard_part(self):
+        '''Delete the .part file and its validator.'''
+
+        for path in (self.part_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        self._meta = None
+
+class SegmentedDownload(object):
+    '''A download of one large file as several byte ranges fetched in parallel.
+
+    The server is first asked for the first range of the file, which shows whether it
+    supports ranges and how large the file is. The .part file is then allocated at
+    its full size, and each range is written into its place on its own connection:
+    the first range by the calling thread (reading the response to the probe), and
+    the others by their own threads. Each range is retried separately according to
+    options.retry, continuing from where it stopped. The ranges are validated with
+    If-Range, so a file that changes during the download is not stitched together
+    from two versions.
+
+    Unlike PartialDownload, an unfinished segmented download can not be resumed
+    later, so its .part file is removed if it fails.
+
+    The caller is expected to hold one connection slot for the host (such as a
+    Scheduler job). If options.host_slots is set, the other ranges only run at once
+    while there are free slots, so the download never goes over the per-host limit
+    (or the overall limit, see modules.scheduler.HostSlots).
+
+    Example:
+        download = SegmentedDownload('https://example.com/episode.mp4', 'episode.mp4', options)
+        if download.probe():
+            download.run()
+    '''
+
+    def __init__(self, url: str, filepath: str, options: TransferOptions=None, progress=None,
+                 length: int=None):
+        '''Create a SegmentedDownload object.
+
+        Arguments:
+            url: The URL of the file.
+            filepath: The final path of the file.
+            options: The transfer settings (by default, TransferOptions()).
+                     options.segments is the number of ranges.
+            progress: A function called as the download progresses (see download_file).
+            length: The expected size of the file from the feed, if known, which sets the
+                    size of the first range. Otherwise the first range is the size of a
+                    range of a file of options.segment_threshold bytes.
+        '''
+
+        self.options = options or TransferOptions()
+        self.url = url
+        self.length = length
+        self.host = url_host(url)
+        self.filepath = filepath
+        self.part_path = filepath + PART_SUFFIX
+        self.meta_path = filepath + META_SUFFIX
+
+        # The size of the file (None until it is probed)
+        self.total = None
+
+        # The response to the probe, whose body is the first range, and the end of that range
+        self._response = None
+        self._first_end = None
+
+        # The ETag or Last-Modified header the ranges are validated with
+        self._validator = None
+
+        # Set when a range fails, so the others stop early
+        self._stopped = threading.Event()
+
+        self._progress = progress
+        self._position = 0
+        self._progress_lock = threading.Lock()
+
+    def probe(self) -> bool:
+        '''Ask the server for the first range of the file.
+
+        Returns whether the file should be downloaded in segments: False if the server
+        does not support ranges or validators, or the file is smaller than
+        options.segment_threshold. If it returns True, the response is kept open as the
+        first range, so run() must be called.
+        '''
+
+        limiter = self.options.limiter
+
+        if limiter is not None:
+            limiter.request(self.host)
+
+        size = -(-(self.length or self.options.segment_threshold) // self.options.segments)
+
+        sent = time.monotonic()
+        response = self.options.client.get(self.url, {'Range': f'bytes=0-{str(size - 1)}'})
+        latency = time.monotonic() - sent
+
+        try:
+            response.raise_for_status()
+
+            content_range = response.headers.get('Content-Range')
+            total = _content_range_total(content_range)
+
+            etag = response.headers.get('ETag')
+            if etag and etag.startswith('W/'):
+                etag = None
+            validator = etag or response.headers.get('Last-Modified')
+
+            if (response.status != 206 or _content_range_start(content_range) != 0 or total is None
+                    or not validator or total < self.options.segment_threshold):
+                # The server ignores ranges, or the file is not worth splitting
+                _discard(response)
+                return False
+        except BaseException:
+            response.close()
+            raise
+
+        self._validator = validator
+        self._response = response
+        self._first_end = min(size, total)
+        self.total = total
+
+        # The ranges are requested from the final URL, after any redirects
+        self.url = response.url
+
+        if self._progress is not None:
+            self._progress(0, 0, total, latency)
+
+        return True
+
+    def run(self) -> int:
+        '''Download the ranges and rename the finished file to the final path.
+
+        Returns the size of the file.
+        '''
+
+        # The first range was requested by the probe, and the rest of the file is split between the others
+        rest = self.total - self._first_end
+        size = -(-rest // max(1, self.options.segments - 1)) if rest else 1
+        ranges = [(0, self._first_end)] + [(start, min(start + size, self.total))
+                                           for start in range(self._first_end, self.total, size)]
+
+        # The caller's slot covers the first range, which is downloaded on the calling thread.
+        # The others take the free slots, and the ranges without a slot wait for one of the
+        # running ranges to finish (or run after the first range, if there are no free slots).
+        slots = self.options.host_slots
+        extra = slots.acquire_free(self.host, len(ranges) - 1) if slots is not None else len(ranges) - 1
+        response, self._response = self._response, None
+        executor = None
+
+        try:
+            # An earlier single stream download is replaced
+            for path in (self.part_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+            allocate_file(self.part_path, self.total)
+
+            futures = []
+            if extra:
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=extra)
+                futures = [executor.submit(self._download_range, start, end) for start, end in ranges[1:]]
+
+                # Stop the other ranges as soon as one fails
+                for future in futures:
+                    future.add_done_callback(self._stop_on_error)
+
+            try:
+                self._download_range(0, self._first_end, response)
+                response = None
+
+                if executor is None:
+                    for start, end in ranges[1:]:
+                        self._download_range(start, end)
+            except BaseException:
+                self._stopped.set()
+                raise
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            for future in futures:
+                if future.exception() is not None:
+                    raise future.exception()
+
+            if os.path.getsize(self.part_path) != self.total:
+                raise IncompleteDownload(f'The segments of {self.url} do not add up to {self.total} bytes.')
+
+            replace_file(self.part_path, self.filepath, self.options.fsync)
+        except BaseException:
+            if response is not None:
+                response.close()
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+            raise
+        finally:
+            if slots is not None:
+                slots.release(self.host, extra)
+
+        return self.total
+
+    def _stop_on_error(self, future: concurrent.futures.Future):
+        '''Stop the other ranges once a range has failed.'''
+
+        if not future.cancelled() and future.exception() is not None:
+            self._stopped.set()
+
+    def _download_range(self, start: int, end: int, response=None):
+        '''Download the bytes from start up to (but not including) end into the .part file.
+
+        Arguments:
+            start: The first byte of the range.
+            end: The byte after the last byte of the range.
+            response: If supplied, the response to the request for the range (such as the
+                      probe's), which is read by the first attempt instead of sending a request.
+        '''
+
+        options = self.options
+        position = start
+        pending = response
+
+        def attempt():
+            nonlocal position, pending
+
+            response, pending = pending, None
+
+            if self._stopped.is_set():
+                if response is not None:
+                    response.close()
+                return
+
+            if response is None:
+                options.check_cancelled()
+
+                if options.limiter is not None:
+                    options.limiter.request(self.host)
+
+                headers = {'Range': f'bytes={position}-{end - 1}', 'If-Range': self._validator}
+                response = options.client.get(self.url, headers)
+
+            writer = None
+
+            try:
+                response.raise_for_status()
+
+                length = response.headers.get('Content-Length')
+                if (response.status != 206
+                        or _content_range_start(response.headers.get('Content-Range')) != position
+                        or length is None or int(length) != end - position):
+                    # The file has changed since it was probed
+                    raise _SegmentsUnsupported(f'The server did not return the requested range of {self.url}.')
+
+                writer = StreamWriter(self.part_path, position, options.chunk_size, options.fsync,
+                                      truncate=False)
+
+                while position < end and not self._stopped.is_set():
+                    options.check_cancelled()
+
+                    size = writer.write_from(response)
+                    if not size:
+                        break
+
+                    position += size
+
+                    if self._progress is not None:
+                        with self._progress_lock:
+                            self._position += size
+                            self._progress(size, self._position, self.total)
+
+                    if options.limiter is not None:
+                        options.limiter.transfer(self.host, size)
+
+                writer.finish()
+                writer = None
+            finally:
+                if writer is not None:
+                    writer.close()
+                response.close()
+
+            if position < end and not self._stopped.is_set():
+                raise IncompleteDownload(f'Downloaded {position - start} of {end - start} bytes '
+                                         f'of a segment of {self.url}.')
+
+        sleep = options.cancel.wait if options.cancel is not None else time.sleep
+        options.retry.run(attempt, self.host, options.breaker, sleep)
+
+def download_file(url: str, filepath: str, options: TransferOptions=None, length: int=None,
+                  progress=None) -> int:
+    '''Download a file, resuming an earlier attempt if possible.
+
+    Temporary errors are retried according to options.retry. Each retry resumes from
+    the .part file left by the failed attempt.
+
+    If options.segments is more than 1, large files are downloaded as several
+    ranges in parallel (see SegmentedDownload), falling back to a single stream
+    if the server does not support ranges.
+
+    Returns the size of the file.
+
+    Arguments:
+        url: The URL of the file.
+        filepath: The path to save the file to.
+        options: The transfer settings (by default, TransferOptions()).
+        length: The expected size of the file from the feed, if known.
+        progress: A function (size, position, length, latency=None) called when the response
+                  arrives (with size 0 and the request latency in seconds) and after each chunk
+                  (with the chunk size). position is the bytes received so far, and length
+                  the expected size of the file (None if it is not known).
+    '''
+
+    options = options or TransferOptions()
+    host = url_host(url)
+
+    # Waiting for a retry is cut short if the downloads are cancelled
+    sleep = options.cancel.wait if options.cancel is not None else time.sleep
+
+    # A .part file left by a single stream download is resumed rather than started again
+    if (options.segments > 1 and (length is None or length >= options.segment_threshold)
+            and not os.path.exists(filepath + META_SUFFIX)):
+        segmented = SegmentedDownload(url, filepath, options, progress, length)
+
+        if options.retry.run(segmented.probe, host, options.breaker, sleep):
+            try:
+                return segmented.run()
+            except _SegmentsUnsupported:
+                pass
+
+    def attempt() -> int:
+        download = PartialDownload(url, filepath, options, length)
+        download.open()
+
+        try:
+            if progress is None:
+                while download.read_chunk():
+                    pass
+            else:
+                progress(0, download.position, download.total, download.latency)
+
+                size = download.read_chunk()
+                while size:
+                    progress(size, download.position, download.total)
+                    size = download.read_chunk()
+
+            download.finish()
+        finally:
+            download.close()
+
+        return download.position
+
+    return options.retry.run(attempt, host, options.breaker, sleep)
+
+def _discard(response):
+    '''Close a response that is not needed. A short body is read first, so the connection
+    goes back to the pool instead of being closed.'''
+
+    try:
+        length = response.headers.get('Content-Length')
+
+        if length is not None and int(length) <= DRAIN_LIMIT:
+            response.read()
+    except (OSError, ValueError, http.client.HTTPException):
+        pass
+    finally:
+        response.close()
+
+def _content_range_start(content_range: str):
+    '''Returns the first byte position of a "bytes start-end/total" Content-Range header, or None.'''
+
+    try:
+        return int(content_range.split()[1].split('-')[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def _content_range_total(content_range: str):
+    '''Returns the total length of a "bytes start-end/total" Content-Range header, or None.'''
+
+    try:
+        return int(content_range.split('/')[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
@@ -0,0 +1,213 @@
+# Checking downloaded files before they are recorded as downloaded.
+
+import hashlib
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .retry import TemporaryError
+
+# The hash of each file saved in the state store
+HASH_ALGORITHM = 'sha256'
+
+# The number of files checked at once
+VERIFY_WORKERS = 2
+
+# The number of bytes read at a time while hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class VerificationFailed(TemporaryError):
+    '''The exception for a downloaded file that does not have the expected size.'''
+
+class Verification(object):
+    '''The result of checking a downloaded file.'''
+
+    __slots__ = ('size', 'digest', 'mtime', 'error', 'warning')
+
+    def __init__(self, size: int, digest: str=None, mtime: int=None, error: Exception=None,
+                 warning: str=None):
+        '''Create a Verification object.
+
+        Arguments:
+            size: The size of the file on disk.
+            digest: The hex digest of the file, if it could be read.
+            mtime: The modification time of the file in nanoseconds, if it could be read.
+            error: The reason the file failed the check, or None if it passed.
+            warning: Something unexpected about a file that passed, such as a wrong length in the feed.
+        '''
+
+        self.size = size
+        self.digest = digest
+        self.mtime = mtime
+        self.error = error
+        self.warning = warning
+
+def file_digest(path: str, algorithm: str=HASH_ALGORITHM, chunk_size: int=HASH_CHUNK_SIZE) -> str:
+    '''Returns the hex digest of a file, reading it in chunks.
+
+    Arguments:
+        path: The path of the file.
+        algorithm: The hashlib algorithm name.
+        chunk_size: The number of bytes read at a time.
+    '''
+
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with open(path, 'rb', buffering=0) as file:
+        size = file.readinto(buffer)
+        while size:
+            digest.update(view[:size])
+            size = file.readinto(buffer)
+
+    return digest.hexdigest()
+
+def verify_file(path: str, size: int, length: int=None, algorithm: str=HASH_ALGORITHM,
+                server_length: int=None) -> Verification:
+    '''Check the size of a downloaded file and work out its hash.
+
+    If the file has the size given by the server, which the download was checked
+    against, a different length in the feed is only a warning: the feed is wrong,
+    and downloading the file again would get the same file.
+
+    Arguments:
+        path: The path of the file.
+        size: The number of bytes the download wrote.
+        length: The size of the file given by the feed, if known.
+        algorithm: The hashlib algorithm name.
+        server_length: The size of the file given by the server (its Content-Length
+                       or Content-Range), if known.
+    '''
+
+    try:
+        stat = os.stat(path)
+        digest = file_digest(path, algorithm)
+    except OSError as e:
+        return Verification(0, error=e)
+
+    verification = Verification(stat.st_size, digest, stat.st_mtime_ns)
+
+    if stat.st_size != size:
+        verification.error = VerificationFailed(
+            f'{os.path.basename(path)} has {str(stat.st_size)} bytes on disk, '
+            f'but {str(size)} bytes were downloaded.'
+        )
+    elif length is not None and stat.st_size != length:
+        message = (f'{os.path.basename(path)} has {str(stat.st_size)} bytes, '
+                   f'but the feed gives its length as {str(length)} bytes.')
+
+        if server_length is not None and stat.st_size == server_length:
+            verification.warning = message + ' The server gives the same length as the file, so it is kept.'
+        else:
+            verification.error = VerificationFailed(message)
+
+    return verification
+
+class Verifier(object):
+    '''Checks downloaded files on its own pool of threads, so the download workers
+    can move on to the next file while the last one is hashed.
+
+    Each file's size is compared with the bytes downloaded and the length in the
+    feed, and its hash is worked out for the state store. A file whose length does
+    not match the feed passes with a warning if it matches the length given by the
+    server. Otherwise it is reported as failed, so it can be downloaded again. If the
+    new download has the same hash as the failed one, the server is consistently
+    sending that file and the length in the feed is wrong, so it passes.
+
+    Example:
+        verifier = Verifier()
+        verifier.submit('download/episode.mp3', size, episode.length, key=episode)
+        for key, verification in verifier.wait():
+            ...
+        verifier.close()
+    '''
+
+    def __init__(self, workers: int=VERIFY_WORKERS, algorithm: str=HASH_ALGORITHM):
+        '''Create a Verifier object.
+
+        Arguments:
+            workers: The number of files checked at once.
+            algorithm: The hashlib algorithm name.
+        '''
+
+        self.algorithm = algorithm
+        self.executor = ThreadPoolExecutor(max(1, workers))
+
+        # The (key, future) of each check that has not been collected by wait()
+        self._pending = []
+
+        # path -> the digest of a download of the file that failed the check
+        self._failed_digests = {}
+
+        self._lock = threading.Lock()
+
+    def submit(self, path: str, size: int, length: int=None, key=None, server_length: int=None):
+        '''Queue a downloaded file to be checked. Safe to call from any thread.
+
+        Arguments:
+            path: The path of the file.
+            size: The number of bytes the download wrote.
+            length: The size of the file given by the feed, if known.
+            key: Any value identifying the download, which is returned by wait().
+            server_length: The size of the file given by the server, if known.
+        '''
+
+        future = self.executor.submit(self.verify, path, size, length, server_length)
+
+        with self._lock:
+            self._pending.append((key, future))
+
+    def verify(self, path: str, size: int, length: int=None, server_length: int=None) -> Verification:
+        '''Check a downloaded file on the calling thread. See verify_file().
+
+        Arguments:
+            path: The path of the file.
+            size: The number of bytes the download wrote.
+            length: The size of the file given by the feed, if known.
+            server_length: The size of the file given by the server, if known.
+        '''
+
+        verification = verify_file(path, size, length, self.algorithm, server_length)
+
+        if verification.error is not None and verification.size == size and verification.digest:
+            with self._lock:
+                previous = self._failed_digests.get(path)
+                self._failed_digests[path] = verification.digest
+
+            if previous == verification.digest:
+                # The same file twice, so the length in the feed is wrong
+                verification.error = None
+
+        return verification
+
+    def wait(self) -> list:
+        '''Wait for the queued checks to finish, returning the (key, Verification) of each,
+        in the order they were queued.'''
+
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+
+        return [(key, future.result()) for key, future in pending]
+
+    def collect(self) -> list:
+        '''Returns the (key, Verification) of each queued check that has finished, without
+        waiting for the others, in the order they were queued.'''
+
+        with self._lock:
+            finished = [(key, future) for key, future in self._pending if future.done()]
+            if finished:
+                self._pending = [(key, future) for key, future in self._pending if not future.done()]
+
+        return [(key, future.result()) for key, future in finished]
+
+    def close(self, wait: bool=True):
+        '''Stop the threads once the queued checks have finished.
+
+        Arguments:
+            wait: Whether to wait for the queued checks to finish.
+        '''
+
+        self.executor.shutdown(wait=wait)
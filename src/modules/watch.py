@@ -0,0 +1,242 @@
+# Watching podcasts for new episodes.
+
+import heapq
+import statistics
+import threading
+import time
+
+from collections import OrderedDict
+from xml.etree.ElementTree import Element
+
+from .batch import _feed_directory, load_feed
+from .download import _prepare_output_dir, podcast_download
+from .misc import null
+from .selection import parse_date
+from .transfer import TransferOptions
+
+# The shortest and longest time in seconds between two polls of the same feed
+MIN_INTERVAL = 15 * 60
+MAX_INTERVAL = 24 * 60 * 60
+
+# The time in seconds between polls of a feed whose cadence is not known
+DEFAULT_INTERVAL = 60 * 60
+
+# The number of polls in the usual gap between two episodes
+POLLS_PER_EPISODE = 8
+
+# The number of recent episodes the cadence is worked out from
+CADENCE_EPISODES = 10
+
+# Once this fraction of the usual gap has passed since the latest episode,
+# the next episode is due and the feed is polled DUE_SPEEDUP times as often
+DUE_FRACTION = 0.9
+DUE_SPEEDUP = 4
+
+def episode_dates(rss: Element) -> list:
+    '''Returns the publication dates of the episodes in a podcast as Unix timestamps, newest first.
+
+    Episodes with a missing or invalid <pubDate> are left out.
+
+    Arguments:
+        rss: The podcast RSS.
+    '''
+
+    dates = []
+
+    for item in rss.findall('channel/item'):
+        date = parse_date(item.findtext('pubDate'))
+
+        if date is not None:
+            dates.append(date)
+
+    dates.sort(reverse=True)
+
+    return dates
+
+def poll_interval(dates: list, now: float=None, min_interval: float=MIN_INTERVAL,
+                  max_interval: float=MAX_INTERVAL) -> float:
+    '''Returns the time in seconds to wait before polling a feed again, based on how often it publishes.
+
+    The usual gap between episodes is the median gap between the latest CADENCE_EPISODES
+    episodes, and the feed is polled POLLS_PER_EPISODE times in that gap. A weekly show is
+    polled about once a day, and a daily show every few hours. When the next episode is
+    due, the feed is polled more often, so it is picked up soon after it is published.
+
+    Arguments:
+        dates: The publication dates of the episodes as Unix timestamps, newest first
+               (see episode_dates()).
+        now: The current time as a Unix timestamp (by default, time.time()).
+        min_interval: The shortest interval in seconds.
+        max_interval: The longest interval in seconds.
+    '''
+
+    if now is None:
+        now = time.time()
+
+    recent = dates[:CADENCE_EPISODES]
+    gaps = [newer - older for newer, older in zip(recent, recent[1:]) if newer > older]
+
+    if not gaps:
+        # The cadence is not known
+        return min(max(DEFAULT_INTERVAL, min_interval), max_interval)
+
+    gap = statistics.median(gaps)
+    interval = gap / POLLS_PER_EPISODE
+
+    if now - recent[0] >= gap * DUE_FRACTION:
+        interval /= DUE_SPEEDUP
+
+    return min(max(interval, min_interval), max_interval)
+
+class WatchedFeed(object):
+    '''A feed being watched, and when it is polled next.'''
+
+    def __init__(self, source: str):
+        '''Create a WatchedFeed object.
+
+        Arguments:
+            source: The URL or path of the RSS file.
+        '''
+
+        self.source = source
+
+        # The directory the episodes are saved in, once the feed has been fetched
+        self.directory = None
+
+        # The time of the next poll (time.monotonic), and the interval before it
+        self.next_poll = 0.0
+        self.interval = None
+
+        # The number of polls in a row which failed
+        self.failures = 0
+
+class FeedWatcher(object):
+    '''Polls podcasts for new episodes until it is stopped, downloading them with podcast_download.
+
+    Each feed is polled on its own schedule (see poll_interval()). Remote feeds are
+    fetched with conditional requests if a modules.cache.FeedCache is supplied, so a
+    feed that has not changed costs one small request. A feed that can not be fetched
+    is tried again after MIN_INTERVAL seconds, doubling with each failure up to MAX_INTERVAL.
+
+    Example:
+        watcher = FeedWatcher(['https://example.com/feed.xml'], 'download', cache=FeedCache())
+        watcher.run()
+
+    Call stop() from another thread or a signal handler to stop watching. A download in
+    progress is cancelled, and its partial file is kept so the next run can resume it.
+    '''
+
+    def __init__(self, feeds: list, output_dir: str='', rename: bool=False, print_progress=null,
+                 delay: int=0, workers: int=1, cache=None, options: TransferOptions=None, on_event=None,
+                 min_interval: float=MIN_INTERVAL, max_interval: float=MAX_INTERVAL, on_poll=null,
+                 selection=None, order=None, on_result=None):
+        '''Create a FeedWatcher object.
+
+        Arguments:
+            feeds: The URLs or paths of the RSS files. If there is more than one, each
+                   podcast is saved in a subdirectory named after its title, as batch_download does.
+            output_dir: The output directory name (or the same directory if an empty string is supplied).
+            rename: Whether to rename the downloaded files to the names of the episodes.
+            print_progress: The function for handling the progress output.
+            delay: The delay in seconds between requests to the same server (see podcast_download).
+            workers: The number of files to download at once.
+            cache: If supplied, the modules.cache.FeedCache for remote RSS files.
+            options: The settings for the file downloads (see modules.transfer.TransferOptions).
+                     Its cancel event is used to stop watching, and is created if it is not set.
+            on_event: A function called with a modules.events.DownloadEvent for each step of
+                      each download (see podcast_download).
+            min_interval: The shortest time in seconds between two polls of the same feed.
+            max_interval: The longest time in seconds between two polls of the same feed.
+            on_poll: A function called with the source of the feed and the podcast_download
+                     result (or the exception, if the poll failed) after each poll.
+            selection: If supplied, a modules.selection.EpisodeSelection choosing the episodes
+                       to download from each feed.
+            order: The order the new episodes of each feed are downloaded in (see podcast_download).
+            on_result: A function called with the modules.results.DownloadResult of each episode
+                       as soon as it is final (see podcast_download).
+        '''
+
+        self.feeds = [WatchedFeed(source) for source in OrderedDict.fromkeys(feeds)]
+        self.output_dir = output_dir
+        self.rename = rename
+        self.print_progress = print_progress
+        self.delay = delay
+        self.workers = workers
+        self.cache = cache
+        self.options = options.copy() if options is not None else TransferOptions()
+        self.on_event = on_event
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.on_poll = on_poll
+        self.selection = selection
+        self.order = order
+        self.on_result = on_result
+
+        if self.options.cancel is None:
+            self.options.cancel = threading.Event()
+
+    def stop(self):
+        '''Stop watching, cancelling the download in progress.'''
+
+        self.options.cancel.set()
+
+    def run(self):
+        '''Poll the feeds until stop() is called. Every feed is polled straight away.'''
+
+        stopped = self.options.cancel
+
+        # (time of the next poll, position in the feed list) for each feed
+        queue = [(feed.next_poll, index) for index, feed in enumerate(self.feeds)]
+        heapq.heapify(queue)
+
+        while queue and not stopped.is_set():
+            next_poll, index = queue[0]
+
+            # Sleep until the next poll, waking up straight away if the watcher is stopped
+            wait = next_poll - time.monotonic()
+            if wait > 0 and stopped.wait(wait):
+                break
+
+            heapq.heappop(queue)
+            feed = self.feeds[index]
+
+            self.poll(feed)
+
+            feed.next_poll = time.monotonic() + feed.interval
+            heapq.heappush(queue, (feed.next_poll, index))
+
+    def poll(self, feed: WatchedFeed):
+        '''Fetch a feed, download its new episodes and work out when to poll it next.
+
+        Arguments:
+            feed: The feed.
+        '''
+
+        try:
+            rss = load_feed(feed.source, self.cache, self.options.client)
+
+            if feed.directory is None:
+                if len(self.feeds) == 1:
+                    feed.directory = _prepare_output_dir(self.output_dir)
+                else:
+                    feed.directory = _feed_directory(_prepare_output_dir(self.output_dir), rss, feed.source)
+
+            result = podcast_download(rss, self.delay, feed.directory, self.rename,
+                                      print_progress=self.print_progress, workers=self.workers,
+                                      options=self.options, on_event=self.on_event,
+                                      selection=self.selection, order=self.order,
+                                      on_result=self.on_result)
+        except Exception as e:
+            self.print_progress(f'  ERROR -> "{feed.source}": {str(e)}')
+
+            # Back off while the feed can not be fetched
+            feed.failures += 1
+            feed.interval = min(self.min_interval * 2 ** min(feed.failures - 1, 16), self.max_interval)
+
+            self.on_poll(feed.source, e)
+        else:
+            feed.failures = 0
+            feed.interval = poll_interval(episode_dates(rss), min_interval=self.min_interval,
+                                          max_interval=self.max_interval)
+
+            self.on_poll(feed.source, result)
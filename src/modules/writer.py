@@ -0,0 +1,203 @@
+# The file writing stage of the downloader.
+
+import os
+
+# The fsync policies
+# Never call fsync (the operating system writes the file when it chooses)
+FSYNC_NEVER = 'never'
+# Call fsync once, before the finished file is renamed into place
+FSYNC_FINISH = 'finish'
+# Call fsync after every chunk
+FSYNC_ALWAYS = 'always'
+
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_FINISH, FSYNC_ALWAYS)
+
+class StreamWriter(object):
+    '''Writes a stream to a file in chunks, reading into one reusable buffer.
+
+    The file is opened unbuffered, since each write is already a full chunk,
+    so no data is copied between the network and the file apart from the read itself.
+
+    Example:
+        writer = StreamWriter('episode.mp3.part', chunk_size=256 * 1024)
+        writer.preallocate(length)
+        while writer.write_from(response):
+            pass
+        writer.finish()
+    '''
+
+    def __init__(self, path: str, position: int=0, chunk_size: int=64 * 1024, fsync: str=FSYNC_NEVER,
+                 truncate: bool=True):
+        '''Open a file for writing.
+
+        Arguments:
+            path: The path of the file.
+            position: Continue writing after this many bytes of an existing file
+                      (0 to start a new file).
+            chunk_size: The size of the buffer, which is the most bytes read at a time.
+            fsync: The fsync policy (FSYNC_NEVER, FSYNC_FINISH or FSYNC_ALWAYS).
+            truncate: Whether to remove anything in the file after the position
+                      (False to write into the middle of a file made by allocate_file).
+        '''
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Invalid fsync policy: {fsync}')
+
+        self.path = path
+        self.fsync = fsync
+
+        # The number of bytes in the file so far
+        self.position = position
+
+        # Whether the file has been made longer than the data written to it
+        self.preallocated = False
+
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+
+        if position or not truncate:
+            self._file = open(path, 'r+b', buffering=0)
+            self._file.seek(position)
+
+            if truncate:
+                self._file.truncate()
+        else:
+            self._file = open(path, 'wb', buffering=0)
+
+    def preallocate(self, size: int):
+        '''Reserve disk space for the whole file, to reduce fragmentation.
+
+        Uses posix_fallocate where it is available, and otherwise extends the file.
+        The file is truncated back to the data written when it is finished or closed.
+
+        Arguments:
+            size: The expected size of the file in bytes.
+        '''
+
+        if size <= self.position:
+            return
+
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._file.fileno(), self.position, size - self.position)
+                self.preallocated = True
+                return
+            except OSError:
+                # Not supported by this file system
+                pass
+
+        self._file.truncate(size)
+        self._file.seek(self.position)
+        self.preallocated = True
+
+    def write_from(self, stream) -> int:
+        '''Read the next chunk of a stream into the buffer and write it to the file.
+
+        Returns the number of bytes written, which is 0 at the end of the stream.
+
+        Arguments:
+            stream: A binary stream with a readinto() method (such as an HTTP response).
+        '''
+
+        size = stream.readinto(self._buffer)
+
+        if size:
+            self.write(self._view[:size])
+
+        return size
+
+    def write(self, data):
+        '''Write bytes to the file.
+
+        Arguments:
+            data: A bytes-like object.
+        '''
+
+        view = memoryview(data)
+
+        # Unbuffered writes may be partial
+        while view:
+            written = self._file.write(view)
+            view = view[written:]
+            self.position += written
+
+        if self.fsync == FSYNC_ALWAYS:
+            os.fsync(self._file.fileno())
+
+    def finish(self):
+        '''Flush and close the file, applying the fsync policy.'''
+
+        if self._file is None:
+            return
+
+        self._trim()
+
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        '''Close the file without finishing it, for example after an error.
+
+        Any preallocated space past the data written is removed,
+        so the length of the file is the number of bytes written.
+        '''
+
+        if self._file is None:
+            return
+
+        try:
+            self._trim()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def _trim(self):
+        '''Remove any preallocated space past the data written.'''
+
+        if self.preallocated:
+            self._file.truncate(self.position)
+            self.preallocated = False
+
+def allocate_file(path: str, size: int):
+    '''Create a file of a given size, reserving the disk space where possible.
+
+    Several StreamWriter objects (with truncate=False) can then write different
+    parts of the file at the same time.
+
+    Arguments:
+        path: The path of the file.
+        size: The size of the file in bytes.
+    '''
+
+    with open(path, 'wb') as file:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(file.fileno(), 0, size)
+                return
+            except OSError:
+                # Not supported by this file system
+                pass
+
+        file.truncate(size)
+
+def replace_file(source: str, destination: str, fsync: str=FSYNC_NEVER):
+    '''Atomically rename a finished file into place.
+
+    Arguments:
+        source: The path of the finished file.
+        destination: The final path.
+        fsync: The fsync policy. Unless it is FSYNC_NEVER, the directory is synced
+               too (where supported), so the rename survives a crash.
+    '''
+
+    os.replace(source, destination)
+
+    if fsync != FSYNC_NEVER and os.name != 'nt':
+        directory = os.open(os.path.dirname(os.path.abspath(destination)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
@@ -1,8 +1,11 @@
+import gzip
+
 from defusedxml import ElementTree
-from urllib import request
 
 from xml.etree.ElementTree import Element
 
+from .network import get_default_client
+
 class XmlElementNotFound(Exception):
     '''The exception that is raised when an XML element was not found.'''
 
@@ -34,16 +37,72 @@ def get_unique_xml_element(scope: Element, element: str) -> Element:
         # Return the element
         return elements[0]
 
-def parse_remote_xml(url: str) -> Element:
+def parse_remote_xml(url: str, cache=None, client=None) -> Element:
     '''Parse a remote XML file using defusedxml.
 
+    The file is requested with gzip compression, if the server supports it.
+
     Arguments:
         url: The URL of the XML file.
+        cache: If supplied, a modules.cache.FeedCache. The request is made conditional
+               on the cached copy, which is used if the file has not been modified.
+        client: The modules.network.HttpClient to use (by default, the shared client).
     '''
 
+    client = client or get_default_client()
+
+    headers = {'Accept-Encoding': 'gzip'}
+    if cache is not None:
+        headers.update(cache.validators(url))
+
     # Request the XML file
-    xml_string = request.urlopen(url).read()
+    with client.get(url, headers) as response:
+        if response.status == 304 and cache is not None:
+            # The file has not been modified, so use the cached copy
+            return cache.load(url)
+
+        response.raise_for_status()
+
+        xml_string = read_response(response)
+
+    # Parse the XML file
+    rss = ElementTree.fromstring(xml_string)
+
+    if cache is not None:
+        cache.store(url, xml_string, response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'), rss)
+
+    return rss
+
+async def parse_remote_xml_async(url: str, cache=None, client=None) -> Element:
+    '''The asyncio counterpart of parse_remote_xml.
+
+    The request is run in the event loop's default executor,
+    so the event loop is not blocked while the XML file is downloaded.
+
+    Arguments:
+        url: The URL of the XML file.
+        cache: If supplied, a modules.cache.FeedCache (see parse_remote_xml).
+        client: The modules.network.HttpClient to use (by default, the shared client).
+    '''
+
+    # asyncio is slow to import, so it is only imported when it is used
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+
+    return await loop.run_in_executor(None, parse_remote_xml, url, cache, client)
+
+def read_response(response) -> bytes:
+    '''Returns the body of an HTTP response, decompressing it if it is gzip encoded.
+
+    Arguments:
+        response: The HTTP response.
+    '''
+
+    body = response.read()
+
+    if response.headers.get('Content-Encoding', '').lower() == 'gzip':
+        body = gzip.decompress(body)
 
-    # Return the parsed the XML file
-    return ElementTree.fromstring(xml_string)
-    
\ No newline at end of file
+    return body
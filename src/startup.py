@@ -1,10 +1,6 @@
 import sys
 
-from defusedxml import ElementTree
-
-from modules.xml import get_unique_xml_element, parse_remote_xml
-from modules.download import podcast_download
-from modules.gui import *
+from modules.gui import MainWidget, QtWidgets
 
 def startup():
     '''The startup GUI function.'''
@@ -1,7 +1,3 @@
-from defusedxml import ElementTree
-
-from modules.xml import get_unique_xml_element, parse_remote_xml
-from modules.download import podcast_download
 from modules.string import command_line_to_bool
 
 def startup():
@@ -18,26 +14,50 @@ def startup():
     print(' ##################################################')
     print()
 
-    # Ask if the RSS file is remote or local
+    # Ask if the RSS file is remote or local, or if several podcasts are listed in an OPML file
     remote_rss_input = None
+    opml = False
     while remote_rss_input is None:
-        remote_rss_input = input('Is the RSS file remote or local?\n1: Remote (default)\t2: Local\n')
+        remote_rss_input = input('Is the RSS file remote or local?\n'
+                                 '1: Remote (default)\t2: Local\t3: OPML file (several podcasts)\n')
         if not remote_rss_input or remote_rss_input == '1':
             remote_rss = True
         elif remote_rss_input == '2':
             remote_rss = False
+        elif remote_rss_input == '3':
+            remote_rss = False
+            opml = True
         else:
             remote_rss_input = None
 
+    # The download modules are imported once the first question has been answered,
+    # so it is asked as soon as the program starts
+    from defusedxml import ElementTree
+
+    from modules.batch import batch_download, parse_opml
+    from modules.cache import FeedCache
+    from modules.download import podcast_download
+    from modules.metrics import MetricsCollector
+    from modules.ratelimit import RateLimiter
+    from modules.transfer import TransferOptions
+    from modules.xml import parse_remote_xml
+
+    # Unchanged remote RSS files are loaded from the feed cache
+    feed_cache = FeedCache()
+
     # Ask for the RSS file
     rss_source = ''
     while not rss_source:
-        rss_source = input(f'The RSS {"URL" if remote_rss else "path"}: ')
+        rss_source = input(f'The {"OPML" if opml else "RSS"} {"URL" if remote_rss else "path"}: ')
     
         try:
             # Parse the RSS file
-            if remote_rss:
-                rss = parse_remote_xml(rss_source)
+            if opml:
+                feeds = parse_opml(rss_source)
+                if not feeds:
+                    raise ValueError('The OPML file does not list any RSS feeds.')
+            elif remote_rss:
+                rss = parse_remote_xml(rss_source, cache=feed_cache)
             else:
                 rss = ElementTree.parse(rss_source)
         except Exception as e:
@@ -49,7 +69,7 @@ def startup():
     delay_input = None
     while delay_input is None:
         try:
-            delay_input = input('The delay time between downloads (1 second): ')
+            delay_input = input('The delay time between requests to the same server (1 second): ')
             if delay_input:
                 delay = int(delay_input)
             else:
@@ -58,6 +78,36 @@ def startup():
             print(str(e))
             delay_input = None
 
+    # Ask for the bandwidth limit
+    bandwidth_input = None
+    while bandwidth_input is None:
+        try:
+            bandwidth_input = input('The bandwidth limit in KB/s (no limit): ')
+            if bandwidth_input:
+                bandwidth = int(bandwidth_input)
+                if bandwidth < 0:
+                    raise ValueError('The bandwidth limit can not be negative.')
+            else:
+                bandwidth = 0
+        except Exception as e:
+            print(str(e))
+            bandwidth_input = None
+
+    # Ask for the number of files to download at once
+    workers_input = None
+    while workers_input is None:
+        try:
+            workers_input = input('The number of files to download at once (1): ')
+            if workers_input:
+                workers = int(workers_input)
+                if workers < 1:
+                    raise ValueError('At least one file must be downloaded at once.')
+            else:
+                workers = 1
+        except Exception as e:
+            print(str(e))
+            workers_input = None
+
     # Ask for the output directory
     output_dir = input('The output directory (download): ')
     if not output_dir:
@@ -75,18 +125,48 @@ def startup():
         else:
             rename = True
 
+    # Ask whether to download episodes that were downloaded by an earlier run
+    resync_input = None
+    while resync_input is None:
+        resync_input = input('Download episodes that were already downloaded again? (no): ')
+        if resync_input:
+            try:
+                resync = command_line_to_bool(resync_input, strict=True)
+            except ValueError:
+                resync_input = None
+        else:
+            resync = False
+
+    # The rate limits apply to all downloads at once
+    options = TransferOptions(limiter=RateLimiter(bytes_per_second=bandwidth * 1000,
+                                                  requests_per_second=1 / delay if delay else None))
+
+    # Measure the download speed
+    metrics = MetricsCollector()
+
     print('Starting download...\n')
 
-    # Count the total number of files
-    total_files = len(rss.findall('channel/item'))
-    print(f'{str(total_files)} file{"s" if total_files != 1 else ""} in total.\n')
+    if opml:
+        print(f'{str(len(feeds))} podcast{"s" if len(feeds) != 1 else ""} in total.\n')
+
+        # Call the batch download function
+        download = batch_download(feeds, output_dir, rename, print_progress=print,
+                                  workers=workers, resync=resync, cache=feed_cache, options=options,
+                                  on_event=metrics)
+    else:
+        # Count the total number of files
+        total_files = len(rss.findall('channel/item'))
+        print(f'{str(total_files)} file{"s" if total_files != 1 else ""} in total.\n')
 
-    # Call the download function
-    download = podcast_download(rss, delay, output_dir, rename, print_progress=print)
+        # Call the download function
+        download = podcast_download(rss, delay, output_dir, rename, print_progress=print,
+                                    workers=workers, resync=resync, options=options, on_event=metrics)
 
     print('Download complete\n')
     print(f'{str(download["total_downloads"])} files downloaded.')
+    print(f'{str(download["total_skipped"])} files already downloaded.')
     print(f'{str(download["total_errors"])} errors.')
+    print(f'{metrics.total_bytes() / 1000000:.1f} MB downloaded at {metrics.bytes_per_second() / 1000:.0f} KB/s.')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,277 @@
+import argparse
+import datetime
+import signal
+import sys
+import threading
+
+from modules.batch import batch_download, load_feed, parse_opml
+from modules.cache import FeedCache
+from modules.catalog import Catalog, default_catalog_path
+from modules.download import podcast_download
+from modules.events import fan_out
+from modules.metrics import MetricsCollector
+from modules.podcast import iter_episodes, iter_remote_episodes
+from modules.ratelimit import RateLimiter
+from modules.results import JsonLinesWriter
+from modules.scheduler import DOWNLOAD_ORDERS
+from modules.selection import EpisodeSelection
+from modules.space import MIN_FREE_SPACE, DiskSpace
+from modules.transfer import TransferOptions
+from modules.watch import MAX_INTERVAL, MIN_INTERVAL, FeedWatcher
+
+def startup() -> int:
+    '''The headless startup function, for running from scripts, cron or a service manager.
+
+    Returns the exit status: 0 if every episode was downloaded, or 1 if there were errors.
+    '''
+
+    parser = argparse.ArgumentParser(description='Download all podcasts in RSS files without asking any questions.')
+    parser.add_argument('feeds', nargs='*',
+                        help='The URLs or paths of the RSS files')
+    parser.add_argument('--opml', action='append', default=[],
+                        help='An OPML file listing more RSS feeds (may be given more than once)')
+    parser.add_argument('-o', '--output-dir', default='download',
+                        help='The output directory (download). With more than one feed, each podcast '
+                             'is saved in a subdirectory named after its title')
+    parser.add_argument('--keep-names', action='store_true',
+                        help='Keep the file names from the URLs, instead of using the episode names')
+    parser.add_argument('--delay', type=int, default=1,
+                        help='The delay time in seconds between requests to the same server (1)')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='The bandwidth limit in KB/s (0 for no limit)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The number of files to download at once (1)')
+    parser.add_argument('--order', choices=list(DOWNLOAD_ORDERS),
+                        help='The order to download the episodes in (the feed order, or round-robin '
+                             'with more than one feed)')
+    parser.add_argument('--min-free', type=int, default=MIN_FREE_SPACE // 1000000,
+                        help=f'The disk space in MB to always leave free (0 for none). Episodes that do not '
+                             f'fit are skipped ({str(MIN_FREE_SPACE // 1000000)})')
+    parser.add_argument('--resync', action='store_true',
+                        help='Download episodes that were already downloaded again')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Fetch the feeds in full, instead of checking whether they have changed')
+    parser.add_argument('--metrics',
+                        help='A file to write the download metrics to in the Prometheus text format, '
+                             'after each download')
+    parser.add_argument('--results',
+                        help='A file to write the result of each episode to as it finishes, '
+                             'one JSON object per line')
+    parser.add_argument('--latest', type=int,
+                        help='Only download the latest episodes, up to this number')
+    parser.add_argument('--since', type=_date,
+                        help='Only download episodes published on or after this date (YYYY-MM-DD, UTC)')
+    parser.add_argument('--until', type=_date,
+                        help='Only download episodes published before this date (YYYY-MM-DD, UTC)')
+    parser.add_argument('--title',
+                        help='Only download episodes whose title matches this regular expression')
+    parser.add_argument('--guid', action='append',
+                        help='Only download the episode with this GUID (may be given more than once)')
+    parser.add_argument('--catalog', default=default_catalog_path(),
+                        help=f'The episode catalog, a database of every podcast and episode seen ({default_catalog_path()})')
+    parser.add_argument('--no-catalog', action='store_true',
+                        help='Do not record the episodes in the catalog')
+    parser.add_argument('--report', action='store_true',
+                        help='Print the podcasts in the catalog and the episodes waiting to be downloaded, '
+                             'without fetching any feeds')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Only print errors and the summary')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running, polling the feeds for new episodes until stopped')
+    parser.add_argument('--min-interval', type=float, default=MIN_INTERVAL / 60,
+                        help=f'The shortest time in minutes between polls of a feed ({MIN_INTERVAL / 60:.0f})')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL / 60,
+                        help=f'The longest time in minutes between polls of a feed ({MAX_INTERVAL / 60:.0f})')
+    args = parser.parse_args()
+
+    if args.report:
+        if args.no_catalog:
+            parser.error('--report can not be used with --no-catalog.')
+
+        return _report(Catalog(args.catalog))
+
+    feeds = list(args.feeds)
+    for path in args.opml:
+        try:
+            feeds.extend(parse_opml(path))
+        except Exception as e:
+            parser.error(f'Could not read {path}: {str(e)}')
+
+    if not feeds:
+        parser.error('No RSS feeds were given.')
+    if args.delay < 0 or args.bandwidth < 0 or args.min_free < 0:
+        parser.error('The delay time, bandwidth limit and free space can not be negative.')
+    if args.workers < 1:
+        parser.error('At least one file must be downloaded at once.')
+    if args.watch and args.resync:
+        parser.error('--resync can not be used with --watch.')
+
+    # Choose the episodes to download
+    selection = None
+    if any(value is not None for value in (args.latest, args.since, args.until, args.title, args.guid)):
+        try:
+            selection = EpisodeSelection(args.latest, args.since, args.until, args.title, args.guid)
+        except Exception as e:
+            parser.error(str(e))
+
+    # Stop cleanly on Ctrl+C or a termination request, keeping the partial files for the next run
+    cancel = threading.Event()
+
+    def stop(signum, frame):
+        print('Stopping...', file=sys.stderr)
+        cancel.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # The rate limits apply to all downloads at once
+    options = TransferOptions(limiter=RateLimiter(bytes_per_second=args.bandwidth * 1000,
+                                                  requests_per_second=1 / args.delay if args.delay else None),
+                              cancel=cancel, disk_space=DiskSpace(args.min_free * 1000000))
+
+    feed_cache = None if args.no_cache else FeedCache()
+    metrics = MetricsCollector()
+    catalog = None if args.no_catalog else Catalog(args.catalog)
+    results = JsonLinesWriter(args.results, append=args.watch) if args.results else None
+    on_event = fan_out(metrics, catalog)
+    print_progress = _error_printer if args.quiet else print
+    rename = not args.keep_names
+
+    if args.watch:
+        def on_poll(source: str, result):
+            if args.metrics:
+                metrics.write_prometheus(args.metrics)
+
+            if results is not None:
+                results.flush()
+
+            if catalog is not None:
+                for feed in watcher.feeds:
+                    if feed.source == source and feed.directory is not None:
+                        catalog.add_feed(feed.directory, source)
+
+                catalog.flush()
+
+        watcher = FeedWatcher(feeds, args.output_dir, rename, print_progress, args.delay, args.workers,
+                              feed_cache, options, on_event, args.min_interval * 60, args.max_interval * 60,
+                              on_poll, selection, args.order, results)
+        try:
+            watcher.run()
+        finally:
+            _close(catalog, results)
+
+        return 0
+
+    if len(feeds) == 1:
+        # The <channel> element of a streamed feed, for the podcast title
+        channels = []
+
+        try:
+            remote = feeds[0].lower().startswith(('http://', 'https://'))
+
+            if selection is None or (remote and feed_cache is not None):
+                # A cached remote feed is only downloaded again if it has changed (see modules.cache)
+                rss = load_feed(feeds[0], feed_cache, options.client)
+            elif remote:
+                # Stream the feed, so it stops being fetched once the selected episodes are found
+                rss = iter_remote_episodes(feeds[0], options.client, selection, channels.append)
+            else:
+                rss = iter_episodes(feeds[0], selection, channels.append)
+
+            # A streamed feed is fetched while the episodes are downloaded, and is already selected
+            download = podcast_download(rss, args.delay, args.output_dir, rename,
+                                        print_progress=print_progress, workers=args.workers,
+                                        resync=args.resync, options=options, on_event=on_event,
+                                        selection=selection if hasattr(rss, 'findall') else None,
+                                        order=args.order, on_result=results, keep_results=False)
+
+            if catalog is not None:
+                if hasattr(rss, 'findtext'):
+                    title = rss.findtext('channel/title')
+                else:
+                    title = channels[0].findtext('title') if channels else None
+
+                catalog.add_feed(args.output_dir, feeds[0], title)
+        except Exception as e:
+            print(f'  ERROR -> "{feeds[0]}": {str(e)}', file=sys.stderr)
+            return 1
+        finally:
+            _close(catalog, results)
+    else:
+        try:
+            download = batch_download(feeds, args.output_dir, rename, print_progress=print_progress,
+                                      workers=args.workers, resync=args.resync, cache=feed_cache,
+                                      options=options, on_event=on_event, selection=selection,
+                                      order=args.order, on_result=results, keep_results=False)
+
+            if catalog is not None:
+                for source, result in download['feeds'].items():
+                    if 'directory' in result:
+                        catalog.add_feed(result['directory'], source, result['title'])
+        finally:
+            _close(catalog, results)
+
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+
+    print(f'{str(download["total_downloads"])} files downloaded.')
+    print(f'{str(download["total_skipped"])} files already downloaded.')
+    if download['total_cancelled']:
+        print(f'{str(download["total_cancelled"])} files cancelled.')
+    print(f'{str(download["total_errors"])} errors.')
+    print(f'{metrics.total_bytes() / 1000000:.1f} MB downloaded at {metrics.bytes_per_second() / 1000:.0f} KB/s.')
+
+    return 1 if download['total_errors'] or download['total_cancelled'] else 0
+
+def _report(catalog: Catalog) -> int:
+    '''Prints the podcasts in the catalog and the episodes waiting to be downloaded.
+
+    Returns the exit status: 0 if nothing is waiting, or 1 if any episode is queued or failed.
+
+    Arguments:
+        catalog: The catalog.
+    '''
+
+    try:
+        feeds = catalog.feeds()
+        pending = catalog.pending()
+    finally:
+        catalog.close()
+
+    for feed in feeds:
+        latest = datetime.datetime.utcfromtimestamp(feed['latest']).strftime('%Y-%m-%d') if feed['latest'] else '-'
+        print(f'{feed["title"] or feed["feed"]}: {str(feed["episodes"])} episodes, '
+              f'{str(feed["downloaded"] or 0)} downloaded, {str(feed["queued"] or 0)} queued, '
+              f'{str(feed["failed"] or 0)} failed, latest {latest}')
+
+    for episode in pending:
+        message = f'  {episode["status"].upper()} -> "{episode["title"]}" ({episode["feed_title"] or episode["feed"]})'
+        if episode['error']:
+            message += f': {episode["error"]}'
+        print(message)
+
+    return 1 if pending else 0
+
+def _close(*outputs):
+    '''Closes the catalog and the results file, skipping those which are not used.'''
+
+    for output in outputs:
+        if output is not None:
+            output.close()
+
+def _date(value: str) -> datetime.datetime:
+    '''Parses a YYYY-MM-DD date argument.'''
+
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not a date in the YYYY-MM-DD format.')
+
+def _error_printer(message: str):
+    '''Prints only the error messages, to standard error.'''
+
+    if message.lstrip().startswith('ERROR'):
+        print(message, file=sys.stderr)
+
+if __name__ == '__main__':
+    sys.exit(startup())
@@ -0,0 +1,2 @@
+# The unit tests. Run them from the src directory with:
+#     python -m unittest discover tests
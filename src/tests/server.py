@@ -0,0 +1,158 @@
+# A local HTTP server for the tests.
+
+import re
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+class FileServer(object):
+    '''A local HTTP server which serves files from memory.
+
+    Files support Range requests and have an ETag. Each response can be delayed,
+    and the next responses can be cut short, to test resuming and parallel downloads.
+
+    Example:
+        with FileServer({'/episode.mp3': b'...'}) as server:
+            download_file(server.url('/episode.mp3'), 'episode.mp3')
+    '''
+
+    def __init__(self, files: dict, latency: float=0):
+        '''Create a FileServer object. The server is started by start().
+
+        Arguments:
+            files: The body of each file, by path.
+            latency: The number of seconds each response is delayed.
+        '''
+
+        self.files = files
+        self.latency = latency
+
+        # The headers of each request, in order
+        self.requests = []
+
+        # The client addresses of the connections the requests arrived on
+        self.connections = set()
+
+        # The most requests answered at once
+        self.max_active = 0
+
+        # The number of bytes each of the next responses is cut short after
+        self.cuts = []
+
+        self._active = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def url(self, path: str) -> str:
+        '''Returns the URL of a file.'''
+
+        host, port = self._server.server_address[:2]
+
+        return f'http://{host}:{str(port)}{path}'
+
+    def start(self):
+        '''Start the server on a free port.'''
+
+        self._server = _ThreadingServer(('127.0.0.1', 0), _handler(self))
+        # A short poll interval, so stop() returns quickly
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def stop(self):
+        '''Stop the server.'''
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    '''An HTTP server which answers each connection on its own thread.'''
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The clients drop their connections at any time, such as when a download is cancelled
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def _handler(server: FileServer):
+    '''Returns the request handler class for a FileServer.'''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with server._lock:
+                server.requests.append(dict(self.headers))
+                server.connections.add(self.client_address)
+                server._active += 1
+                server.max_active = max(server.max_active, server._active)
+                cut = server.cuts.pop(0) if server.cuts else None
+
+            try:
+                if server.latency:
+                    time.sleep(server.latency)
+
+                self._send(cut)
+            finally:
+                with server._lock:
+                    server._active -= 1
+
+        def _send(self, cut: int=None):
+            body = server.files.get(self.path)
+
+            if body is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            etag = f'"{str(len(body))}"'
+            start = 0
+            end = len(body)
+
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+            if_range = self.headers.get('If-Range')
+
+            if match and (if_range is None or if_range == etag):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)) + 1)
+
+                if start >= len(body):
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{str(len(body))}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {str(start)}-{str(end - 1)}/{str(len(body))}')
+            else:
+                self.send_response(200)
+
+            self.send_header('Content-Length', str(end - start))
+            self.send_header('ETag', etag)
+            self.end_headers()
+
+            if cut is not None:
+                # Send part of the body, then drop the connection
+                self.wfile.write(body[start:min(end, start + cut)])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+
+            self.wfile.write(body[start:end])
+
+    return Handler
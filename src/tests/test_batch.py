@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+
+from xml.etree.ElementTree import Element, ElementTree, SubElement
+
+from modules.batch import _feed_directory, batch_download, iter_batch_download
+from modules.network import HttpClient
+from modules.retry import RetryPolicy
+from modules.space import DiskSpace
+from modules.transfer import TransferOptions
+
+from tests.server import FileServer
+
+def _rss(title: str) -> Element:
+    '''Returns a feed with a title and no episodes.'''
+
+    rss = Element('rss')
+    SubElement(SubElement(rss, 'channel'), 'title').text = title
+
+    return rss
+
+def _write_feed(path: str, title: str, urls: list):
+    '''Writes a feed with an episode for each URL, and an <item> without an <enclosure>.'''
+
+    rss = _rss(title)
+    channel = rss.find('channel')
+
+    for url in urls:
+        item = SubElement(channel, 'item')
+        SubElement(item, 'guid').text = url
+        SubElement(item, 'title').text = url
+        SubElement(item, 'pubDate').text = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        SubElement(item, 'enclosure', {'url': url})
+
+    item = SubElement(channel, 'item')
+    SubElement(item, 'guid').text = 'invalid'
+    SubElement(item, 'title').text = 'No enclosure'
+    SubElement(item, 'pubDate').text = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+    ElementTree(rss).write(path)
+
+class BatchDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.directory = self._directory.name
+
+        client = HttpClient(proxies={})
+        self.addCleanup(client.close)
+        self.options = TransferOptions(client=client, retry=RetryPolicy(attempts=1),
+                                       disk_space=DiskSpace(enabled=False))
+
+        self.files = {f'/{str(i)}.mp3': bytes([i]) * (1000 + i) for i in range(4)}
+        self.server = FileServer(self.files)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        # Two feeds with the same title, and one which does not exist
+        self.feeds = [os.path.join(self.directory, name) for name in ('a.xml', 'b.xml', 'missing.xml')]
+        _write_feed(self.feeds[0], 'Podcast', [self.server.url('/0.mp3'), self.server.url('/1.mp3')])
+        _write_feed(self.feeds[1], 'Podcast', [self.server.url('/2.mp3'), self.server.url('/3.mp3')])
+
+        self.output_dir = os.path.join(self.directory, 'download')
+
+    def test_feeds_are_downloaded_to_their_own_directories(self):
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                output_dir = os.path.join(self.output_dir, str(workers))
+                report = batch_download(self.feeds, output_dir, workers=workers, options=self.options)
+
+                # The invalid items and the missing feed are the errors
+                self.assertEqual((report['total_items'], report['total_downloads'], report['total_errors']),
+                                 (6, 4, 3))
+                self.assertIn('error', report['feeds'][self.feeds[2]])
+
+                for source, paths in zip(self.feeds, (('/0.mp3', '/1.mp3'), ('/2.mp3', '/3.mp3'))):
+                    feed = report['feeds'][source]
+
+                    self.assertEqual(feed['title'], 'Podcast')
+                    self.assertEqual([download['error'] for download in feed['downloads'] if 'error' in download],
+                                     ['Invalid episode: Could not find the <enclosure> element.'])
+
+                    for path in paths:
+                        with open(os.path.join(feed['directory'], path[1:]), 'rb') as file:
+                            self.assertEqual(file.read(), self.files[path])
+
+                self.assertNotEqual(report['feeds'][self.feeds[0]]['directory'],
+                                    report['feeds'][self.feeds[1]]['directory'])
+
+                # The next run skips the episodes, with the feeds in the other order
+                report = batch_download(self.feeds[::-1], output_dir, workers=workers, options=self.options)
+
+                self.assertEqual((report['total_downloads'], report['total_skipped']), (0, 4))
+
+    def test_iter_batch_download(self):
+        results = iter_batch_download(self.feeds, output_dir=self.output_dir, options=self.options)
+        downloaded = []
+
+        try:
+            while True:
+                result = next(results)
+                if result.downloaded:
+                    downloaded.append(result.file)
+        except StopIteration as e:
+            report = e.value
+
+        self.assertEqual(sorted(downloaded), ['0.mp3', '1.mp3', '2.mp3', '3.mp3'])
+        self.assertEqual(report['total_downloads'], 4)
+        self.assertNotIn('downloads', report['feeds'][self.feeds[0]])
+
+class FeedDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_feeds_keep_their_directories_in_any_order(self):
+        first = _feed_directory(self.directory, _rss('Podcast'), 'https://example.com/1.xml')
+        second = _feed_directory(self.directory, _rss('Podcast'), 'https://example.com/2.xml')
+
+        self.assertEqual(os.path.basename(first), 'Podcast')
+        self.assertRegex(os.path.basename(second), r'^Podcast \([0-9a-f]{8}\)$')
+
+        # The feeds swap places in the list
+        self.assertEqual(_feed_directory(self.directory, _rss('Podcast'), 'https://example.com/2.xml'), second)
+        self.assertEqual(_feed_directory(self.directory, _rss('Podcast'), 'https://example.com/1.xml'), first)
+
+    def test_directory_without_a_feed_is_taken_over(self):
+        os.mkdir(os.path.join(self.directory, 'Podcast'))
+
+        directory = _feed_directory(self.directory, _rss('Podcast'), 'https://example.com/1.xml')
+
+        self.assertEqual(os.path.basename(directory), 'Podcast')
+
+if __name__ == '__main__':
+    unittest.main()
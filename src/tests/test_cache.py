@@ -0,0 +1,91 @@
+import json
+import tempfile
+import unittest
+
+from defusedxml import ElementTree
+
+from modules.cache import FeedCache
+from modules.podcast import Episode
+
+URL = 'https://example.com/feed.xml'
+
+FEED = b'''<rss version="2.0"><channel>
+<title>Podcast</title>
+<description>Not needed by the downloader</description>
+<item>
+    <guid>1</guid><title>First</title><description>Long text</description>
+    <pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate>
+    <enclosure url="https://example.com/1.mp3" length="1000" type="audio/mpeg"/>
+</item>
+<item>
+    <guid>2</guid><title>Second</title>
+    <pubDate>Tue, 02 Jan 2024 00:00:00 GMT</pubDate>
+    <enclosure url="https://example.com/2.mp3" length="2000" type="audio/mpeg"/>
+</item>
+</channel></rss>'''
+
+def _episodes(rss) -> list:
+    return [(episode.guid, episode.title, episode.date, episode.url, episode.length)
+            for episode in (Episode(item) for item in rss.findall('channel/item'))]
+
+class FeedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_validators(self):
+        cache = FeedCache(self.directory)
+        cache.store(URL, FEED, '"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+        self.assertEqual(FeedCache(self.directory).validators(URL), {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT',
+        })
+        self.assertEqual(cache.validators('https://example.com/other.xml'), {})
+
+    def test_new_process_loads_the_saved_episodes_without_parsing(self):
+        FeedCache(self.directory).store(URL, FEED, '"v1"', rss=ElementTree.fromstring(FEED))
+
+        cache = FeedCache(self.directory)
+
+        # The body is not parsed again, so breaking it does not matter
+        with open(cache._path(URL, '.xml'), 'wb') as file:
+            file.write(b'not xml')
+
+        rss = cache.load(URL)
+
+        self.assertEqual(rss.findtext('channel/title'), 'Podcast')
+        self.assertEqual(_episodes(rss), _episodes(ElementTree.fromstring(FEED)))
+
+    def test_out_of_date_episodes_are_parsed_again(self):
+        FeedCache(self.directory).store(URL, FEED, '"v1"', rss=ElementTree.fromstring(FEED))
+
+        cache = FeedCache(self.directory)
+        path = cache._path(URL, '.episodes.json')
+
+        with open(path, 'r', encoding='utf-8') as file:
+            record = json.load(file)
+
+        record['validators'] = ['"v0"', None]
+        record['items'] = []
+
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(record, file)
+
+        self.assertEqual(len(_episodes(cache.load(URL))), 2)
+
+        # The episodes are saved again for the current validators
+        with open(path, 'r', encoding='utf-8') as file:
+            self.assertEqual(json.load(file)['validators'], ['"v1"', None])
+
+    def test_feeds_without_validators_are_not_cached(self):
+        cache = FeedCache(self.directory)
+        cache.store(URL, FEED)
+
+        self.assertEqual(cache.validators(URL), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from xml.etree.ElementTree import Element, SubElement
+
+from modules.download import _read_ahead, podcast_download, podcast_download_async
+from modules.events import RESPONSE
+from modules.network import HttpClient
+from modules.podcast import Episode
+from modules.retry import RetryPolicy
+from modules.space import DiskSpace
+from modules.state import StateStore
+from modules.transfer import TransferOptions
+
+from tests.server import FileServer
+
+def _feed(server: FileServer, names: list) -> Element:
+    '''Returns a feed with an episode for each file name, whose GUID is the file name.'''
+
+    rss = Element('rss')
+    channel = SubElement(rss, 'channel')
+    SubElement(channel, 'title').text = 'Podcast'
+
+    for name in names:
+        item = SubElement(channel, 'item')
+        SubElement(item, 'guid').text = name
+        SubElement(item, 'title').text = name
+        SubElement(item, 'pubDate').text = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        body = server.files.get('/' + name)
+        SubElement(item, 'enclosure', {'url': server.url('/' + name),
+                                       'length': str(len(body)) if body is not None else '0'})
+
+    return rss
+
+class ReadAheadTest(unittest.TestCase):
+    def test_source_is_read_without_waiting_for_the_consumer(self):
+        finished = threading.Event()
+
+        def source():
+            yield from range(5)
+            finished.set()
+
+        items = _read_ahead(source())
+
+        self.assertEqual(next(items), 0)
+
+        # The source reaches its end while the first item is still being "downloaded"
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(list(items), [1, 2, 3, 4])
+
+    def test_errors_are_raised_after_the_items_read(self):
+        def source():
+            yield 1
+            raise OSError('Connection reset')
+
+        items = _read_ahead(source())
+
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(OSError):
+            next(items)
+
+    def test_closing_stops_and_closes_the_source(self):
+        closed = threading.Event()
+
+        def source():
+            try:
+                yield from range(100)
+            finally:
+                closed.set()
+
+        items = _read_ahead(source(), size=1)
+
+        self.assertEqual(next(items), 0)
+        items.close()
+
+        self.assertTrue(closed.wait(5))
+
+class PodcastDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+        client = HttpClient(proxies={})
+        self.addCleanup(client.close)
+        self.options = TransferOptions(client=client, retry=RetryPolicy(attempts=1),
+                                       disk_space=DiskSpace(enabled=False))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_download_and_skip(self):
+        files = {f'/{str(i)}.mp3': bytes([i]) * (1000 + i) for i in range(6)}
+
+        for workers in (1, 3):
+            with self.subTest(workers=workers), FileServer(files) as server:
+                output_dir = os.path.join(self.directory, str(workers))
+                rss = _feed(server, [f'{str(i)}.mp3' for i in range(6)] + ['missing.mp3'])
+                finished = []
+
+                result = podcast_download(rss, output_dir=output_dir, workers=workers, options=self.options,
+                                          on_result=finished.append)
+
+                self.assertEqual((result['total_items'], result['total_downloads'], result['total_errors']),
+                                 (7, 6, 1))
+                self.assertEqual([download['file'] for download in result['downloads']],
+                                 [f'{str(i)}.mp3' for i in range(6)] + ['missing.mp3'])
+                self.assertIn('error', result['downloads'][6])
+                self.assertEqual(sorted(download['file'] for download in finished),
+                                 sorted(download['file'] for download in result['downloads']))
+
+                for i in range(6):
+                    with open(os.path.join(output_dir, f'{str(i)}.mp3'), 'rb') as file:
+                        self.assertEqual(file.read(), files[f'/{str(i)}.mp3'])
+
+                # The downloads are recorded, so the next run skips them
+                self.assertEqual(len(StateStore(output_dir).episodes), 6)
+
+                result = podcast_download(rss, output_dir=output_dir, workers=workers, options=self.options,
+                                          keep_results=False)
+
+                self.assertEqual((result['total_skipped'], result['total_errors']), (6, 1))
+                self.assertNotIn('downloads', result)
+
+    def test_time_to_first_byte_excludes_waiting_for_disk_space(self):
+        class SlowDiskSpace(DiskSpace):
+            def reserve(self, path: str, length: int=None, check_cancelled=None):
+                time.sleep(0.5)
+                return super().reserve(path, length, check_cancelled)
+
+        options = self.options.copy(disk_space=SlowDiskSpace(enabled=False))
+        files = {'/0.mp3': b'\0' * 1000}
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers), FileServer(files) as server:
+                events = []
+
+                podcast_download(_feed(server, ['0.mp3']), output_dir=os.path.join(self.directory, str(workers)),
+                                 workers=workers, options=options, on_event=events.append)
+
+                elapsed = [event.elapsed for event in events if event.kind == RESPONSE]
+
+                self.assertEqual(len(elapsed), 1)
+                self.assertLess(elapsed[0], 0.4)
+
+class PodcastDownloadAsyncTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+        client = HttpClient(proxies={})
+        self.addCleanup(client.close)
+        self.options = TransferOptions(client=client, chunk_size=1024, retry=RetryPolicy(attempts=1),
+                                       disk_space=DiskSpace(enabled=False))
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _results(self, rss, output_dir: str) -> list:
+        '''Runs podcast_download_async to the end, returning the results.'''
+
+        async def results() -> list:
+            return [result async for result in podcast_download_async(rss, output_dir, options=self.options)]
+
+        return self.loop.run_until_complete(results())
+
+    def test_download_from_a_feed_or_episodes(self):
+        files = {f'/{str(i)}.mp3': bytes([i]) * (5000 + i) for i in range(4)}
+        names = [f'{str(i)}.mp3' for i in range(4)]
+
+        with FileServer(files) as server:
+            rss = _feed(server, names + ['missing.mp3'])
+            episodes = (Episode(item) for item in rss.findall('channel/item'))
+
+            for kind, feed in (('rss', rss), ('episodes', episodes)):
+                with self.subTest(feed=kind):
+                    output_dir = os.path.join(self.directory, kind)
+                    results = self._results(feed, output_dir)
+
+                    self.assertEqual(sorted(result.file for result in results if result.downloaded), names)
+                    self.assertEqual([result.file for result in results if result.error], ['missing.mp3'])
+
+                    for name in names:
+                        with open(os.path.join(output_dir, name), 'rb') as file:
+                            self.assertEqual(file.read(), files['/' + name])
+
+                    self.assertEqual(len(StateStore(output_dir).episodes), 4)
+
+    def test_cancelled_download_is_downloaded_by_the_next_run(self):
+        files = {f'/{str(i)}.mp3': bytes([i]) * 5000 for i in range(4)}
+
+        async def download(rss):
+            async for result in podcast_download_async(rss, self.directory, options=self.options):
+                pass
+
+        # The responses are slow, so the downloads are cancelled while the requests are being sent
+        with FileServer(files, latency=0.5) as server:
+            rss = _feed(server, [path[1:] for path in files])
+
+            task = self.loop.create_task(download(rss))
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+            task.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                self.loop.run_until_complete(task)
+
+            self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.mp3')], [])
+            self.assertEqual(StateStore(self.directory).episodes, {})
+
+            results = self._results(rss, self.directory)
+
+        self.assertEqual(len([result for result in results if result.downloaded]), 4)
+
+if __name__ == '__main__':
+    unittest.main()
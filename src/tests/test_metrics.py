@@ -0,0 +1,49 @@
+import time
+import unittest
+
+from modules import events
+from modules.metrics import MetricsCollector
+
+def _event(kind: str, when: float, **fields) -> events.DownloadEvent:
+    '''Returns an event for example.com which happened at a given time.'''
+
+    event = events.DownloadEvent(kind, 'Episode', 'https://example.com/episode.mp3', 'example.com',
+                                 'episode.mp3', **fields)
+    event.time = when
+
+    return event
+
+class MetricsCollectorTest(unittest.TestCase):
+    def test_speed_uses_the_time_of_the_events(self):
+        metrics = MetricsCollector()
+        start = time.time() - 4
+
+        # The events are handled at once, as if they had waited in a queue
+        metrics(_event(events.RESPONSE, start, elapsed=0.5, position=0))
+        metrics(_event(events.BYTES, start + 1, size=1000, position=1000))
+        metrics(_event(events.BYTES, start + 4, size=3000, position=4000))
+
+        self.assertAlmostEqual(metrics.bytes_per_second(), 1000.0)
+        self.assertAlmostEqual(metrics.current_bytes_per_second(), 1000.0, delta=10)
+
+    def test_old_bytes_leave_the_rate_window(self):
+        metrics = MetricsCollector(rate_window=5.0)
+        start = time.time() - 20
+
+        metrics(_event(events.BYTES, start, size=1000, position=1000))
+        metrics(_event(events.BYTES, start + 1, size=1000, position=2000))
+
+        self.assertEqual(metrics.current_bytes_per_second(), 0.0)
+        self.assertEqual(metrics.total_bytes(), 2000)
+
+    def test_time_to_first_byte(self):
+        metrics = MetricsCollector()
+        metrics(_event(events.RESPONSE, time.time(), elapsed=0.02, latency=0.01, position=0))
+
+        snapshot = metrics.snapshot()
+
+        self.assertEqual(snapshot['time_to_first_byte']['example.com']['count'], 1)
+        self.assertEqual(snapshot['latency']['example.com']['sum'], 0.01)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from xml.etree.ElementTree import Element, SubElement
+
+from modules.planner import DirectoryIndex, FilenamePlanner
+from modules.podcast import Episode
+from modules.state import StateStore
+
+def _episode(guid: str, length: int=None) -> Episode:
+    '''Returns an Episode whose enclosure is called audio.mp3.'''
+
+    item = Element('item')
+    SubElement(item, 'guid').text = guid
+    SubElement(item, 'title').text = 'Episode'
+    SubElement(item, 'pubDate').text = 'Mon, 01 Jan 2024 00:00:00 GMT'
+    SubElement(item, 'enclosure', {'url': f'https://example.com/{guid}/audio.mp3',
+                                   'length': str(length) if length is not None else '0'})
+
+    return Episode(item)
+
+class FilenamePlannerTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _write(self, filename: str, size: int):
+        with open(os.path.join(self.directory, filename), 'wb') as file:
+            file.write(b'\0' * size)
+
+    def _planner(self) -> FilenamePlanner:
+        return FilenamePlanner(StateStore(self.directory), False, DirectoryIndex(self.directory))
+
+    def test_same_names_are_numbered(self):
+        planner = self._planner()
+
+        self.assertEqual([planner.assign(_episode(guid)) for guid in ('1', '2', '3')],
+                         ['audio.mp3', 'audio (2).mp3', 'audio (3).mp3'])
+
+    def test_other_file_in_the_directory_is_not_overwritten(self):
+        self._write('Audio.mp3', 500)
+
+        self.assertEqual(self._planner().assign(_episode('1', 1000)), 'audio (2).mp3')
+        self.assertEqual(self._planner().assign(_episode('1')), 'audio (2).mp3')
+
+    def test_file_with_the_episode_length_keeps_its_name(self):
+        self._write('audio.mp3', 1000)
+
+        self.assertEqual(self._planner().assign(_episode('1', 1000)), 'audio.mp3')
+
+    def test_file_saved_by_an_earlier_run_keeps_its_name(self):
+        self._write('audio.mp3', 500)
+
+        state = StateStore(self.directory)
+        state.record(_episode('1', 1000), 'audio.mp3', 500)
+        planner = FilenamePlanner(state, False, DirectoryIndex(self.directory))
+
+        self.assertEqual(planner.assign(_episode('2', 1000)), 'audio (2).mp3')
+        self.assertEqual(planner.assign(_episode('1', 1000)), 'audio.mp3')
+
+if __name__ == '__main__':
+    unittest.main()
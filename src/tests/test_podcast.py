@@ -0,0 +1,63 @@
+import io
+import unittest
+
+from modules.podcast import iter_episodes, parse_length
+from modules.xml import XmlElementNotFound
+
+FEED = b'''<rss version="2.0"><channel>
+<title>Podcast</title>
+<item>
+    <guid>1</guid><title>First</title>
+    <pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate>
+    <enclosure url="https://example.com/files/1.mp3" length="1000" type="audio/mpeg"/>
+</item>
+<item>
+    <guid>2</guid><title>Second</title>
+    <pubDate>Tue, 02 Jan 2024 00:00:00 GMT</pubDate>
+    <enclosure url="https://example.com/files/2.mp3" length="-1" type="audio/mpeg"/>
+</item>
+</channel></rss>'''
+
+class IterEpisodesTest(unittest.TestCase):
+    def test_episodes(self):
+        episodes = list(iter_episodes(io.BytesIO(FEED)))
+
+        self.assertEqual([episode.guid for episode in episodes], ['1', '2'])
+        self.assertEqual(episodes[0].file_name, '1.mp3')
+        self.assertEqual(episodes[0].length, 1000)
+        self.assertIsNone(episodes[1].length)
+
+    def test_channel_is_passed_before_the_first_episode(self):
+        titles = []
+        episodes = iter_episodes(io.BytesIO(FEED), on_channel=lambda channel: titles.append(channel.findtext('title')))
+
+        next(episodes)
+
+        self.assertEqual(titles, ['Podcast'])
+
+        # The channel is only passed once
+        list(episodes)
+        self.assertEqual(titles, ['Podcast'])
+
+    def test_channel_without_episodes(self):
+        channels = []
+
+        self.assertEqual(list(iter_episodes(io.BytesIO(b'<rss><channel><title>Empty</title></channel></rss>'),
+                                            on_channel=channels.append)), [])
+        self.assertEqual([channel.findtext('title') for channel in channels], ['Empty'])
+
+class EpisodeTest(unittest.TestCase):
+    def test_missing_element(self):
+        items = iter_episodes(io.BytesIO(b'<rss><channel><item><guid>1</guid></item></channel></rss>'))
+
+        with self.assertRaises(XmlElementNotFound):
+            next(items)
+
+    def test_parse_length(self):
+        self.assertEqual(parse_length('12345'), 12345)
+        self.assertIsNone(parse_length('0'))
+        self.assertIsNone(parse_length(None))
+        self.assertIsNone(parse_length('unknown'))
+
+if __name__ == '__main__':
+    unittest.main()
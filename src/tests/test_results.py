@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import unittest
+
+from modules.results import DownloadResult, JsonLinesWriter, ResultLog, read_results, summarize_results
+
+class DownloadResultTest(unittest.TestCase):
+    def test_reads_like_a_dict(self):
+        result = DownloadResult('a.mp3', downloaded=True, guid='1')
+
+        self.assertEqual(result['file'], 'a.mp3')
+        self.assertTrue(result['downloaded'])
+        self.assertIn('guid', result)
+        self.assertNotIn('error', result)
+        self.assertIsNone(result.get('error'))
+        self.assertEqual(list(result.keys()), ['file', 'downloaded', 'guid'])
+        self.assertEqual(len(result), 3)
+
+        with self.assertRaises(KeyError):
+            result['error']
+
+    def test_equals_the_old_dict(self):
+        old = {'file': 'a.mp3', 'downloaded': False, 'error': 'Not found'}
+        result = DownloadResult('a.mp3', error='Not found')
+
+        self.assertEqual(result, old)
+        self.assertEqual(old, result)
+        self.assertEqual(dict(result), old)
+        self.assertEqual(result, DownloadResult.from_dict(old))
+        self.assertNotEqual(result, DownloadResult('a.mp3'))
+
+    def test_to_dict_serializes(self):
+        result = DownloadResult('a.mp3', skipped=True, feed='download')
+
+        self.assertEqual(json.loads(json.dumps(result.to_dict())),
+                         {'file': 'a.mp3', 'downloaded': False, 'skipped': True, 'feed': 'download'})
+
+class ResultLogTest(unittest.TestCase):
+    def test_counts_final_results_in_feed_order(self):
+        emitted = []
+        log = ResultLog(emit=emitted.append)
+
+        first = log.add(DownloadResult('a.mp3'))
+        log.add(DownloadResult('b.mp3', skipped=True), final=True)
+        third = log.add(DownloadResult('c.mp3'))
+
+        log.update(first, DownloadResult('a.mp3', error='Timed out'))
+        log.finish(third, DownloadResult('c.mp3', downloaded=True))
+        log.close()
+
+        # Finishing twice does nothing
+        log.finish(first, DownloadResult('a.mp3', downloaded=True))
+
+        summary = log.summary()
+
+        self.assertEqual([result['file'] for result in emitted], ['b.mp3', 'c.mp3', 'a.mp3'])
+        self.assertEqual([result['file'] for result in summary['downloads']], ['a.mp3', 'b.mp3', 'c.mp3'])
+        self.assertEqual(summary['downloads'][0]['error'], 'Timed out')
+        self.assertEqual((summary['total_items'], summary['total_downloads'], summary['total_skipped'],
+                          summary['total_errors']), (3, 1, 1, 1))
+
+    def test_does_not_keep_results(self):
+        log = ResultLog(keep=False)
+
+        log.finish(log.add(DownloadResult('a.mp3')), DownloadResult('a.mp3', cancelled=True))
+
+        summary = log.summary()
+
+        self.assertNotIn('downloads', summary)
+        self.assertEqual(summary['total_cancelled'], 1)
+
+class JsonLinesTest(unittest.TestCase):
+    def test_write_and_read(self):
+        results = [
+            DownloadResult('a.mp3', downloaded=True, guid='1'),
+            DownloadResult('b.mp3', error='Not found', guid='2'),
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.jsonl')
+
+            writer = JsonLinesWriter(path)
+            for result in results:
+                writer(result)
+            writer.close()
+
+            # Appending keeps the earlier lines
+            writer = JsonLinesWriter(path, append=True)
+            writer(DownloadResult('c.mp3', skipped=True))
+            writer.close()
+
+            read = list(read_results(path))
+
+        self.assertEqual(read, results + [DownloadResult('c.mp3', skipped=True)])
+        self.assertEqual(summarize_results(read), {
+            'total_items': 3, 'total_downloads': 1, 'total_skipped': 1, 'total_cancelled': 0, 'total_errors': 1,
+        })
+
+if __name__ == '__main__':
+    unittest.main()
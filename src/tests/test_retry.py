@@ -0,0 +1,145 @@
+import email.utils
+import errno
+import socket
+import ssl
+import time
+import unittest
+
+from unittest import mock
+
+from modules.network import HttpStatusError
+from modules.retry import CircuitBreaker, CircuitOpen, RetryPolicy, TemporaryError
+
+class _LegacySocketTimeout(OSError):
+    '''socket.timeout as it is on Python 3.6 to 3.9: an OSError, but not a TimeoutError.'''
+
+class RetryableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy()
+
+    def test_legacy_socket_timeout(self):
+        with mock.patch.object(socket, 'timeout', _LegacySocketTimeout):
+            self.assertTrue(self.policy.is_retryable(_LegacySocketTimeout('timed out')))
+
+    def test_socket_timeout(self):
+        self.assertTrue(self.policy.is_retryable(socket.timeout('timed out')))
+
+    def test_connection_reset(self):
+        self.assertTrue(self.policy.is_retryable(OSError(errno.ECONNRESET, 'Connection reset by peer')))
+
+    def test_timed_out_errno(self):
+        self.assertTrue(self.policy.is_retryable(OSError(errno.ETIMEDOUT, 'Connection timed out')))
+
+    def test_host_unreachable(self):
+        self.assertTrue(self.policy.is_retryable(OSError(errno.EHOSTUNREACH, 'No route to host')))
+
+    def test_ssl_eof(self):
+        self.assertTrue(self.policy.is_retryable(ssl.SSLEOFError(8, 'EOF occurred in violation of protocol')))
+
+    def test_ssl_read_timeout(self):
+        self.assertTrue(self.policy.is_retryable(ssl.SSLError('The read operation timed out')))
+
+    def test_ssl_certificate_error(self):
+        self.assertFalse(self.policy.is_retryable(ssl.SSLError(1, '[SSL: CERTIFICATE_VERIFY_FAILED]')))
+
+    def test_disk_full(self):
+        self.assertFalse(self.policy.is_retryable(OSError(errno.ENOSPC, 'No space left on device')))
+
+    def test_temporary_dns_failure(self):
+        if not hasattr(socket, 'EAI_AGAIN'):
+            self.skipTest('EAI_AGAIN is not available')
+
+        self.assertTrue(self.policy.is_retryable(socket.gaierror(socket.EAI_AGAIN, 'Temporary failure')))
+        self.assertFalse(self.policy.is_retryable(socket.gaierror(socket.EAI_NONAME, 'Name not known')))
+
+    def test_status_codes(self):
+        self.assertTrue(self.policy.is_retryable(HttpStatusError('http://example.com', 503, 'Unavailable')))
+        self.assertFalse(self.policy.is_retryable(HttpStatusError('http://example.com', 404, 'Not Found')))
+
+    def test_temporary_error(self):
+        self.assertTrue(self.policy.is_retryable(TemporaryError('truncated')))
+        self.assertFalse(self.policy.is_retryable(ValueError('invalid')))
+
+class RetryRunTest(unittest.TestCase):
+
+    def test_retries_until_success(self):
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ConnectionResetError()
+            return 'done'
+
+        result = RetryPolicy(attempts=4).run(function, sleep=lambda delay: None)
+
+        self.assertEqual(result, 'done')
+        self.assertEqual(len(attempts), 3)
+
+    def test_gives_up_after_attempts(self):
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            raise socket.timeout('timed out')
+
+        with self.assertRaises(socket.timeout):
+            RetryPolicy(attempts=2).run(function, sleep=lambda delay: None)
+
+        self.assertEqual(len(attempts), 2)
+
+    def test_fatal_error_is_not_retried(self):
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            raise HttpStatusError('http://example.com', 404, 'Not Found')
+
+        with self.assertRaises(HttpStatusError):
+            RetryPolicy(attempts=4).run(function, sleep=lambda delay: None)
+
+        self.assertEqual(len(attempts), 1)
+
+    def test_retry_after_header(self):
+        error = HttpStatusError('http://example.com', 429, 'Too Many Requests', {'Retry-After': '7'})
+
+        self.assertEqual(RetryPolicy().delay(1, error), 7.0)
+        self.assertIsNone(RetryPolicy(max_retry_after=5).delay(1, error))
+
+    def test_retry_after_date_without_a_time_zone_is_utc(self):
+        # Such as "Mon, 01 Jan 2024 00:00:10 -0000"
+        date = email.utils.formatdate(time.time() + 10)
+        error = HttpStatusError('http://example.com', 503, 'Service Unavailable', {'Retry-After': date})
+
+        self.assertAlmostEqual(RetryPolicy().delay(1, error), 10, delta=2)
+
+    def test_long_retry_after_fails_the_download(self):
+        error = HttpStatusError('http://example.com', 429, 'Too Many Requests', {'Retry-After': '120'})
+
+        self.assertIsNone(RetryPolicy().delay(1, error))
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+
+        breaker.record_failure('example.com')
+        breaker.check('example.com')
+        breaker.record_failure('example.com')
+
+        with self.assertRaises(CircuitOpen):
+            breaker.check('example.com')
+
+        breaker.check('other.example.com')
+
+    def test_success_closes(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+
+        breaker.record_failure('example.com')
+        breaker.record_success('example.com')
+
+        self.assertFalse(breaker.is_open('example.com'))
+
+if __name__ == '__main__':
+    unittest.main()
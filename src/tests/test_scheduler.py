@@ -0,0 +1,194 @@
+import threading
+import unittest
+
+from modules.scheduler import (ORDER_NEWEST, ORDER_ROUND_ROBIN, ORDER_SMALLEST, HostSlots, QueuedDownload,
+                               Scheduler, order_downloads, url_host)
+
+class _Episode(object):
+    '''The fields of modules.podcast.Episode used by the download orders.'''
+
+    def __init__(self, url: str, length: int=None, date: str=None):
+        self.url = url
+        self.length = length
+        self.date = date
+
+def _run(scheduler: Scheduler, jobs: list) -> list:
+    '''Submits (group, host, name) jobs before starting the workers, and returns the names in start order.'''
+
+    started = []
+    lock = threading.Lock()
+
+    def job(name):
+        with lock:
+            started.append(name)
+
+    for group, host, name in jobs:
+        scheduler.submit_group(group, host, job, name)
+
+    scheduler.start()
+    scheduler.close()
+    scheduler.join()
+
+    return started
+
+class OrderTest(unittest.TestCase):
+
+    def test_url_host(self):
+        self.assertEqual(url_host('https://Example.COM:8080/a.mp3'), 'example.com:8080')
+
+    def test_smallest_first(self):
+        downloads = [QueuedDownload('feed', _Episode('http://a/' + str(length), length), length)
+                     for length in (300, None, 100, 200)]
+
+        ordered = [download.job for download in order_downloads(downloads, ORDER_SMALLEST)]
+
+        self.assertEqual(ordered, [100, 200, 300, None])
+
+    def test_newest_first(self):
+        dates = ['Mon, 01 Jan 2018 10:00:00 GMT', None, 'Wed, 03 Jan 2018 10:00:00 GMT',
+                 'Tue, 02 Jan 2018 10:00:00 GMT']
+        downloads = [QueuedDownload('feed', _Episode('http://a/', date=date), index)
+                     for index, date in enumerate(dates)]
+
+        ordered = [download.job for download in order_downloads(downloads, ORDER_NEWEST)]
+
+        self.assertEqual(ordered, [2, 3, 0, 1])
+
+    def test_round_robin(self):
+        downloads = [QueuedDownload(group, _Episode('http://a/'), group + str(number))
+                     for group, number in (('a', 1), ('a', 2), ('a', 3), ('b', 1))]
+
+        ordered = [download.job for download in order_downloads(downloads, ORDER_ROUND_ROBIN)]
+
+        self.assertEqual(ordered, ['a1', 'b1', 'a2', 'a3'])
+
+    def test_invalid_order(self):
+        with self.assertRaises(ValueError):
+            order_downloads([], 'largest')
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_ordered_start_order_across_hosts(self):
+        # Smallest first, with the jobs on two hosts
+        jobs = [('a', 'a', 1), ('a', 'a', 2), ('a', 'a', 3), ('b', 'b', 100), ('b', 'b', 200)]
+
+        started = _run(Scheduler(workers=1, host_limit=2, ordered=True), jobs)
+
+        self.assertEqual(started, [1, 2, 3, 100, 200])
+
+    def test_ordered_download_order_across_hosts(self):
+        lengths = [100, 1, 200, 2, 3]
+        downloads = [QueuedDownload('feed', _Episode(f'http://{"b" if length >= 100 else "a"}/', length), length)
+                     for length in lengths]
+
+        jobs = [(url_host(download.episode.url), url_host(download.episode.url), download.job)
+                for download in order_downloads(downloads, ORDER_SMALLEST)]
+
+        started = _run(Scheduler(workers=1, host_limit=1, ordered=True), jobs)
+
+        self.assertEqual(started, [1, 2, 3, 100, 200])
+
+    def test_round_robin_groups(self):
+        jobs = [('a', 'a', 1), ('a', 'a', 2), ('a', 'a', 3), ('b', 'b', 100), ('b', 'b', 200)]
+
+        started = _run(Scheduler(workers=1), jobs)
+
+        self.assertEqual(started, [1, 100, 2, 200, 3])
+
+    def test_ordered_skips_busy_host(self):
+        # The first job on host a holds its only slot, so the job on host b starts before a's second job
+        release = threading.Event()
+        started = []
+        lock = threading.Lock()
+
+        def job(name, wait=False):
+            with lock:
+                started.append(name)
+            if wait:
+                release.wait(5)
+
+        scheduler = Scheduler(workers=2, host_limit=1, ordered=True)
+        scheduler.submit('a', job, 'a1', wait=True)
+        scheduler.submit('a', job, 'a2')
+        scheduler.submit('b', job, 'b1')
+        scheduler.start()
+
+        # Wait for b1, which can only start while a1 is running
+        for _ in range(500):
+            with lock:
+                if 'b1' in started:
+                    break
+            threading.Event().wait(0.01)
+
+        release.set()
+        scheduler.close()
+        scheduler.join()
+
+        self.assertEqual(started, ['a1', 'b1', 'a2'])
+
+    def test_host_limit(self):
+        running = {'now': 0, 'most': 0}
+        lock = threading.Lock()
+
+        def job():
+            with lock:
+                running['now'] += 1
+                running['most'] = max(running['most'], running['now'])
+            threading.Event().wait(0.02)
+            with lock:
+                running['now'] -= 1
+
+        scheduler = Scheduler(workers=4, host_limit=2, ordered=True)
+        for _ in range(8):
+            scheduler.submit('a', job)
+        scheduler.start()
+        scheduler.close()
+        scheduler.join()
+
+        self.assertEqual(running['most'], 2)
+
+    def test_jobs_wait_for_slots_taken_outside_the_scheduler(self):
+        slots = HostSlots(1)
+        started = threading.Event()
+
+        # Such as the extra range of a segmented download
+        slots.acquire('a')
+
+        scheduler = Scheduler(workers=2, slots=slots)
+        scheduler.submit('a', started.set)
+        scheduler.start()
+
+        self.assertFalse(started.wait(0.1))
+
+        slots.release('a')
+        self.assertTrue(started.wait(5))
+
+        scheduler.close()
+        scheduler.join()
+
+    def test_slots_count_against_the_total(self):
+        slots = HostSlots(2, total=3)
+        slots.acquire('a')
+
+        # Such as the extra ranges of two segmented downloads
+        self.assertEqual(slots.acquire_free('a', 5), 1)
+        self.assertEqual(slots.acquire_free('b', 5), 1)
+        self.assertFalse(slots.has_free('c'))
+
+        slots.release('a')
+        self.assertTrue(slots.has_free('c'))
+
+    def test_job_error_is_raised(self):
+        def job():
+            raise ValueError('failed')
+
+        scheduler = Scheduler()
+        scheduler.submit('a', job)
+        scheduler.start()
+        scheduler.close()
+
+        with self.assertRaises(ValueError):
+            scheduler.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from modules.space import SMALL_FILE_SIZE, DiskSpace, InsufficientSpace
+
+class DiskSpaceTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._directory.name, 'episode.mp3.part')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_reservation_is_set_aside_until_released(self):
+        space = DiskSpace(min_free=0)
+        before = space.available(self._directory.name)
+
+        reservation = space.reserve(self.path, 1000 * 1000)
+
+        # Other files may be written to the disk at the same time, so allow for some change
+        self.assertLess(space.available(self._directory.name), before - 900 * 1000)
+
+        space.release(reservation)
+        self.assertGreater(space.available(self._directory.name), before - 100 * 1000)
+
+    def test_file_which_does_not_fit(self):
+        space = DiskSpace(min_free=0)
+        length = space.available(self._directory.name) + 1000 * 1000 * 1000
+
+        with self.assertRaises(InsufficientSpace):
+            space.reserve(self.path, length)
+
+    def test_space_already_written_is_not_needed_again(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'\1' * 100 * 1000)
+
+        reservation = DiskSpace(min_free=0).reserve(self.path, 150 * 1000)
+
+        self.assertEqual(reservation.size, 50 * 1000)
+
+    def test_small_and_unknown_files_do_not_wait(self):
+        space = DiskSpace()
+        reservation = space.reserve(self.path, space.available(self._directory.name))
+
+        # The disk is fully set aside, but the files are started straight away
+        small = space.reserve(self.path + '.small', SMALL_FILE_SIZE)
+        unknown = space.reserve(self.path + '.unknown')
+
+        self.assertEqual((small.size, unknown.size), (SMALL_FILE_SIZE, 0))
+
+        for reserved in (reservation, small, unknown):
+            space.release(reserved)
+
+    def test_floor_is_kept_free(self):
+        space = DiskSpace(min_free=10 ** 18)
+
+        with self.assertRaises(InsufficientSpace):
+            space.reserve(self.path)
+
+    def test_disabled(self):
+        space = DiskSpace(enabled=False)
+
+        self.assertIsNone(space.reserve(self.path, 10 ** 18))
+        space.release(None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+from xml.etree.ElementTree import Element, SubElement
+
+from modules.podcast import Episode
+from modules.state import STATE_FILENAME, StateStore
+from modules.verify import file_digest
+
+DATA = b'episode' * 100
+
+def _episode(guid: str='1', url: str='https://example.com/episode.mp3', length: int=len(DATA)) -> Episode:
+    '''Returns an Episode with the given GUID, URL and length.'''
+
+    item = Element('item')
+    SubElement(item, 'guid').text = guid
+    SubElement(item, 'title').text = 'Episode'
+    SubElement(item, 'pubDate').text = 'Mon, 01 Jan 2024 00:00:00 GMT'
+    SubElement(item, 'enclosure', {'url': url, 'length': str(length)})
+
+    return Episode(item)
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        self.path = os.path.join(self.directory, 'episode.mp3')
+
+        with open(self.path, 'wb') as file:
+            file.write(DATA)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_record_is_saved_and_loaded(self):
+        state = StateStore(self.directory)
+        state.record(_episode(), 'episode.mp3', len(DATA))
+        state.save()
+
+        self.assertTrue(StateStore(self.directory).is_downloaded(_episode(), 'episode.mp3'))
+
+    def test_changed_episode_is_not_downloaded(self):
+        state = StateStore(self.directory)
+        state.record(_episode(), 'episode.mp3', len(DATA))
+
+        self.assertFalse(state.is_downloaded(_episode('2'), 'episode.mp3'))
+        self.assertFalse(state.is_downloaded(_episode(url='https://example.com/new.mp3'), 'episode.mp3'))
+        self.assertFalse(state.is_downloaded(_episode(length=len(DATA) + 1), 'episode.mp3'))
+        self.assertFalse(state.is_downloaded(_episode(), 'other.mp3'))
+
+    def test_deleted_or_resized_file_is_not_downloaded(self):
+        state = StateStore(self.directory)
+        state.record(_episode(), 'episode.mp3', len(DATA))
+
+        with open(self.path, 'ab') as file:
+            file.write(b'more')
+        self.assertFalse(state.is_downloaded(_episode(length=None), 'episode.mp3'))
+
+        os.remove(self.path)
+        self.assertFalse(state.is_downloaded(_episode(length=None), 'episode.mp3'))
+
+    def test_verified_file_is_hashed_again_once_modified(self):
+        state = StateStore(self.directory)
+        state.record(_episode(), 'episode.mp3', len(DATA), file_digest(self.path), os.stat(self.path).st_mtime_ns)
+
+        # Same contents, new modification time
+        os.utime(self.path, ns=(0, 0))
+        self.assertTrue(state.is_downloaded(_episode(), 'episode.mp3'))
+
+        # Same size, different contents
+        with open(self.path, 'r+b') as file:
+            file.write(b'E')
+        os.utime(self.path, ns=(1000, 1000))
+        self.assertFalse(state.is_downloaded(_episode(), 'episode.mp3'))
+
+    def test_unreadable_state_file_is_empty(self):
+        with open(os.path.join(self.directory, STATE_FILENAME), 'w', encoding='utf-8') as file:
+            file.write('{not json')
+
+        self.assertEqual(StateStore(self.directory).episodes, {})
+
+    def test_clear(self):
+        state = StateStore(self.directory)
+        state.record(_episode(), 'episode.mp3', len(DATA))
+        state.save()
+
+        state.clear()
+        state.save()
+
+        self.assertFalse(StateStore(self.directory).is_downloaded(_episode(), 'episode.mp3'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import tempfile
+import unittest
+
+from modules.network import HttpClient
+from modules.retry import RetryPolicy
+from modules.scheduler import HostSlots, url_host
+from modules.space import DiskSpace
+from modules.transfer import META_SUFFIX, PART_SUFFIX, IncompleteDownload, TransferOptions, download_file
+
+from tests.server import FileServer
+
+DATA = bytes(range(256)) * 64
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._directory.name, 'episode.mp3')
+        client = HttpClient(proxies={})
+        self.addCleanup(client.close)
+        self.options = TransferOptions(client=client, chunk_size=1024,
+                                       retry=RetryPolicy(attempts=1), disk_space=DiskSpace(enabled=False))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _interrupted_download(self, server: FileServer, url: str):
+        '''Starts a download which is cut off after 1000 bytes.'''
+
+        server.cuts.append(1000)
+
+        with self.assertRaises(IncompleteDownload):
+            download_file(url, self.path, self.options, len(DATA))
+
+        self.assertEqual(os.path.getsize(self.path + PART_SUFFIX), 1000)
+        self.assertTrue(os.path.exists(self.path + META_SUFFIX))
+
+    def test_resumes_with_a_range_request(self):
+        with FileServer({'/episode.mp3': DATA}) as server:
+            url = server.url('/episode.mp3')
+
+            self._interrupted_download(server, url)
+            size = download_file(url, self.path, self.options, len(DATA))
+
+        self.assertEqual(size, len(DATA))
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), DATA)
+
+        self.assertEqual(server.requests[-1]['Range'], 'bytes=1000-')
+        self.assertEqual(server.requests[-1]['If-Range'], f'"{str(len(DATA))}"')
+        self.assertFalse(os.path.exists(self.path + PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + META_SUFFIX))
+
+    def test_changed_file_is_downloaded_again(self):
+        changed = DATA + b'new'
+
+        with FileServer({'/episode.mp3': DATA}) as server:
+            url = server.url('/episode.mp3')
+
+            self._interrupted_download(server, url)
+
+            # The ETag no longer matches, so the server sends the whole new file
+            server.files['/episode.mp3'] = changed
+            size = download_file(url, self.path, self.options)
+
+        self.assertEqual(size, len(changed))
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), changed)
+
+    def test_retry_resumes_the_failed_attempt(self):
+        options = self.options.copy(retry=RetryPolicy(attempts=2, base_delay=0))
+
+        with FileServer({'/episode.mp3': DATA}) as server:
+            server.cuts.append(1000)
+            size = download_file(server.url('/episode.mp3'), self.path, options, len(DATA))
+
+        self.assertEqual(size, len(DATA))
+        self.assertEqual([request.get('Range') for request in server.requests], [None, 'bytes=1000-'])
+
+class SegmentedDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._directory.name, 'episode.mp3')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _options(self, host_slots: HostSlots=None) -> TransferOptions:
+        client = HttpClient(proxies={})
+        self.addCleanup(client.close)
+
+        return TransferOptions(client=client, chunk_size=1024, segments=4,
+                               segment_threshold=1024, retry=RetryPolicy(attempts=1),
+                               disk_space=DiskSpace(enabled=False), host_slots=host_slots)
+
+    def test_ranges_without_a_limit(self):
+        with FileServer({'/episode.mp3': DATA}, latency=0.1) as server:
+            size = download_file(server.url('/episode.mp3'), self.path, self._options())
+
+        self.assertEqual(size, len(DATA))
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), DATA)
+
+        # The probe is the first range, and the other three run at the same time
+        self.assertEqual([request['Range'] for request in server.requests][:1], ['bytes=0-255'])
+        self.assertEqual(len(server.requests), 4)
+        self.assertGreaterEqual(server.max_active, 3)
+
+    def test_ranges_take_slots_from_the_host_limit(self):
+        slots = HostSlots(2)
+
+        with FileServer({'/episode.mp3': DATA}, latency=0.1) as server:
+            url = server.url('/episode.mp3')
+
+            # The scheduler job running the download holds one slot
+            slots.acquire(url_host(url))
+            try:
+                size = download_file(url, self.path, self._options(slots))
+            finally:
+                slots.release(url_host(url))
+
+        self.assertEqual(size, len(DATA))
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), DATA)
+
+        # The other ranges share the one free slot
+        self.assertEqual(len(server.requests), 4)
+        self.assertLessEqual(server.max_active, 2)
+
+        # Every slot is returned
+        self.assertEqual(slots.acquire_free(url_host(url), 5), 2)
+
+    def test_first_range_comes_from_the_feed_length(self):
+        with FileServer({'/episode.mp3': DATA}) as server:
+            size = download_file(server.url('/episode.mp3'), self.path, self._options(), len(DATA))
+
+        self.assertEqual(size, len(DATA))
+        self.assertEqual(sorted(request['Range'] for request in server.requests),
+                         ['bytes=0-4095', 'bytes=12288-16383', 'bytes=4096-8191', 'bytes=8192-12287'])
+
+    def test_small_file_reuses_the_probe_connection(self):
+        with FileServer({'/episode.mp3': DATA[:100]}) as server:
+            size = download_file(server.url('/episode.mp3'), self.path, self._options())
+
+        self.assertEqual(size, 100)
+
+        # The probe is answered with the whole file, which is read so the connection goes back to the pool
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(len(server.connections), 1)
+
+if __name__ == '__main__':
+    unittest.main()
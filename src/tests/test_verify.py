@@ -0,0 +1,80 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from modules.verify import Verifier, VerificationFailed, verify_file
+
+DATA = b'episode' * 100
+
+class VerifyFileTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._directory.name, 'episode.mp3')
+
+        with open(self.path, 'wb') as file:
+            file.write(DATA)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_matching_file_passes(self):
+        verification = verify_file(self.path, len(DATA), len(DATA))
+
+        self.assertIsNone(verification.error)
+        self.assertIsNone(verification.warning)
+        self.assertEqual(verification.size, len(DATA))
+        self.assertEqual(verification.digest, hashlib.sha256(DATA).hexdigest())
+
+    def test_size_on_disk_must_match_the_download(self):
+        verification = verify_file(self.path, len(DATA) + 1, server_length=len(DATA) + 1)
+
+        self.assertIsInstance(verification.error, VerificationFailed)
+
+    def test_wrong_feed_length_fails_without_the_server_length(self):
+        verification = verify_file(self.path, len(DATA), len(DATA) + 10)
+
+        self.assertIsInstance(verification.error, VerificationFailed)
+
+    def test_wrong_feed_length_is_a_warning_if_the_server_length_matches(self):
+        verification = verify_file(self.path, len(DATA), len(DATA) + 10, server_length=len(DATA))
+
+        self.assertIsNone(verification.error)
+        self.assertIn('the feed gives its length', verification.warning)
+
+    def test_missing_file_fails(self):
+        os.remove(self.path)
+
+        self.assertIsInstance(verify_file(self.path, len(DATA)).error, OSError)
+
+class VerifierTest(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._directory.name, 'episode.mp3')
+
+        with open(self.path, 'wb') as file:
+            file.write(DATA)
+
+        self.verifier = Verifier(1)
+
+    def tearDown(self):
+        self.verifier.close()
+        self._directory.cleanup()
+
+    def test_results_in_queued_order(self):
+        self.verifier.submit(self.path, len(DATA), key='first')
+        self.verifier.submit(self.path, len(DATA), len(DATA) + 1, key='second', server_length=len(DATA))
+
+        results = self.verifier.wait()
+
+        self.assertEqual([key for key, _ in results], ['first', 'second'])
+        self.assertTrue(all(verification.error is None for _, verification in results))
+        self.assertIsNotNone(results[1][1].warning)
+
+    def test_same_file_twice_passes(self):
+        # Without the server length, the file fails once, then passes if the same file is downloaded again
+        self.assertIsNotNone(self.verifier.verify(self.path, len(DATA), len(DATA) + 1).error)
+        self.assertIsNone(self.verifier.verify(self.path, len(DATA), len(DATA) + 1).error)
+
+if __name__ == '__main__':
+    unittest.main()